@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import posixpath
+import shlex
+import tempfile
+import threading
+import time
+import uuid
+from base64 import b64encode
+from typing import Callable, Dict, Iterator, NamedTuple, Optional
+from urllib.parse import urlparse
+import requests
+import models
+from ssh_pool import ssh_pool
+from winrm_pool import winrm_cache
+
+# Controller-side directory for downloaded installers (content-addressed by SHA-256)
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "./artifact_cache")
+# Seconds to wait on the installer_url server before giving up
+ARTIFACT_DOWNLOAD_TIMEOUT = int(os.getenv("ARTIFACT_DOWNLOAD_TIMEOUT", "60"))
+# Size of each piece pushed to a target (KB); WinRM messages must stay below MaxEnvelopeSizekb
+ARTIFACT_CHUNK_KB = int(os.getenv("ARTIFACT_CHUNK_KB", "128"))
+# Where pushed installers are stored on targets
+ARTIFACT_REMOTE_DIR_LINUX = os.getenv("ARTIFACT_REMOTE_DIR_LINUX", "/tmp/deploymaster-artifacts")
+ARTIFACT_REMOTE_DIR_WINDOWS = os.getenv("ARTIFACT_REMOTE_DIR_WINDOWS", r"C:\Windows\Temp\deploymaster-artifacts")
+
+# Seconds a checksum mismatch is remembered, so a fan-out doesn't download a bad installer per target
+CHECKSUM_MISMATCH_TTL = 60
+
+# Replaced by the pushed installer's path in install commands
+INSTALLER_PLACEHOLDER = "{installer}"
+
+class ChecksumMismatch(Exception):
+    """An installer's content does not match the expected SHA-256"""
+
+class Artifact(NamedTuple):
+    sha256: str
+    size: int
+    filename: str
+    path: str  # Local path in the cache
+
+    @property
+    def remote_name(self) -> str:
+        """File name on targets; the hash prefix keeps different versions apart"""
+        return f"{self.sha256[:16]}-{self.filename}"
+
+class ArtifactCache:
+    """
+    Installers downloaded once per URL and stored by SHA-256.
+    Concurrent jobs asking for the same URL wait for a single download.
+    """
+
+    def __init__(self, root: str = ARTIFACT_CACHE_DIR):
+        self.root = root
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        # (url, expected sha256) -> (error, when)
+        self._mismatches: Dict[tuple, tuple] = {}
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "sha256", sha256[:2], sha256)
+
+    def _index_path(self, url: str) -> str:
+        return os.path.join(self.root, "urls", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _url_lock(self, url: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def get(self, url: str, expected_sha256: Optional[str] = None) -> Optional[Artifact]:
+        """The cached artifact for a URL, if present (and matching expected_sha256)"""
+        try:
+            with open(self._index_path(url)) as index_file:
+                entry = json.load(index_file)
+        except (OSError, ValueError):
+            return None
+        if expected_sha256 and entry["sha256"] != expected_sha256.lower():
+            return None
+        path = self.blob_path(entry["sha256"])
+        if not os.path.exists(path):
+            return None
+        return Artifact(entry["sha256"], entry["size"], entry["filename"], path)
+
+    def fetch(self, url: str, expected_sha256: Optional[str] = None) -> Artifact:
+        """Return the cached artifact for a URL, downloading and verifying it first if needed"""
+        artifact = self.get(url, expected_sha256)
+        if artifact is not None:
+            return artifact
+        with self._url_lock(url):
+            artifact = self.get(url, expected_sha256)
+            if artifact is not None:
+                return artifact
+            mismatch = self._mismatches.get((url, expected_sha256))
+            if mismatch is not None and time.monotonic() - mismatch[1] < CHECKSUM_MISMATCH_TTL:
+                raise mismatch[0]
+            try:
+                return self._download(url, expected_sha256)
+            except ChecksumMismatch as e:
+                self._mismatches[(url, expected_sha256)] = (e, time.monotonic())
+                raise
+
+    def _download(self, url: str, expected_sha256: Optional[str]) -> Artifact:
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=os.path.join(self.root, "tmp"), delete=False) as part:
+            try:
+                with requests.get(url, stream=True, timeout=ARTIFACT_DOWNLOAD_TIMEOUT) as response:
+                    response.raise_for_status()
+                    for block in response.iter_content(chunk_size=1024 * 1024):
+                        digest.update(block)
+                        part.write(block)
+                        size += len(block)
+            except BaseException:
+                part.close()
+                os.unlink(part.name)
+                raise
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            os.unlink(part.name)
+            raise ChecksumMismatch(f"{url} has SHA-256 {sha256}, expected {expected_sha256.lower()}")
+
+        path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(part.name, path)
+        filename = posixpath.basename(urlparse(url).path) or "installer"
+        os.makedirs(os.path.dirname(self._index_path(url)), exist_ok=True)
+        with open(self._index_path(url) + ".tmp", "w") as index_file:
+            json.dump({"url": url, "sha256": sha256, "size": size, "filename": filename}, index_file)
+        os.replace(self._index_path(url) + ".tmp", self._index_path(url))
+        return Artifact(sha256, size, filename, path)
+
+def read_chunks(path: str, chunk_size: int = ARTIFACT_CHUNK_KB * 1024) -> Iterator[bytes]:
+    with open(path, "rb") as local_file:
+        while True:
+            chunk = local_file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def remote_path(artifact: Artifact, os_type: models.OSType) -> str:
+    if os_type == models.OSType.WINDOWS:
+        return f"{ARTIFACT_REMOTE_DIR_WINDOWS}\\{artifact.remote_name}"
+    return posixpath.join(ARTIFACT_REMOTE_DIR_LINUX, artifact.remote_name)
+
+def rewrite_install_command(command: str, url: str, path: str, os_type: models.OSType) -> Optional[str]:
+    """
+    Point an install command at the pushed copy of its installer.
+    {installer} becomes the path; the installer URL itself becomes a file:// URL,
+    which curl and Invoke-WebRequest read like the original download.
+    Returns None when the command references neither.
+    """
+    if INSTALLER_PLACEHOLDER not in command and url not in command:
+        return None
+    if os_type == models.OSType.WINDOWS:
+        file_url = "file:///" + path.replace("\\", "/")
+    else:
+        file_url = "file://" + path
+    return command.replace(INSTALLER_PLACEHOLDER, path).replace(url, file_url)
+
+def push_linux(server: models.Server, artifact: Artifact, log_callback: Callable[[str], None]) -> str:
+    """Copy an artifact to a Linux server over SFTP on its pooled connection. Returns the remote path."""
+    path = remote_path(artifact, models.OSType.LINUX)
+    ssh, _ = ssh_pool.acquire(server)
+    healthy = False
+    try:
+        if linux_sha256(ssh, path) == artifact.sha256:
+            log_callback(f"📦 {artifact.filename} already on {server.hostname}\n")
+            healthy = True
+            return path
+
+        log_callback(f"📤 Pushing {artifact.filename} ({artifact.size // 1024} KB) to {server.hostname}...\n")
+        # Unique name, so concurrent deployments to the same server don't write the same file
+        part_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        sftp = ssh.open_sftp()
+        try:
+            _sftp_makedirs(sftp, posixpath.dirname(path))
+            with sftp.open(part_path, "wb") as remote_file:
+                # Don't wait for each write to be acknowledged before sending the next chunk
+                remote_file.set_pipelined(True)
+                for chunk in read_chunks(artifact.path):
+                    remote_file.write(chunk)
+            sftp.posix_rename(part_path, path)
+        finally:
+            sftp.close()
+
+        remote_sha256 = linux_sha256(ssh, path)
+        healthy = True
+        if remote_sha256 != artifact.sha256:
+            raise ChecksumMismatch(f"{artifact.filename} on {server.hostname} has SHA-256 {remote_sha256}")
+        log_callback(f"✅ Pushed and verified {artifact.filename}\n")
+        return path
+    finally:
+        ssh_pool.release(server, ssh, healthy)
+
+def _sftp_makedirs(sftp, directory: str):
+    try:
+        sftp.stat(directory)
+    except IOError:
+        _sftp_makedirs(sftp, posixpath.dirname(directory))
+        sftp.mkdir(directory)
+
+def linux_sha256(ssh, path: str) -> Optional[str]:
+    quoted = shlex.quote(path)
+    _, stdout, _ = ssh.exec_command(f"sha256sum {quoted} 2>/dev/null || shasum -a 256 {quoted} 2>/dev/null")
+    output = stdout.read().decode().split()
+    stdout.channel.recv_exit_status()
+    return output[0].lower() if output else None
+
+WINDOWS_HASH_SCRIPT = """$path = '{path}'
+if (Test-Path $path) {{ (Get-FileHash -Algorithm SHA256 $path).Hash }}
+"""
+
+# Reads base64 lines from stdin into the target file, then prints its SHA-256
+WINDOWS_RECEIVE_SCRIPT = """$ErrorActionPreference = 'Stop'
+$path = '{path}'
+$part = '{part_path}'
+New-Item -ItemType Directory -Force -Path (Split-Path $path) | Out-Null
+$stream = [IO.File]::Open($part, 'Create')
+try {{
+    while (($line = [Console]::In.ReadLine()) -ne $null) {{
+        if ($line) {{
+            $bytes = [Convert]::FromBase64String($line)
+            $stream.Write($bytes, 0, $bytes.Length)
+        }}
+    }}
+}} finally {{
+    $stream.Close()
+}}
+Move-Item -Force $part $path
+(Get-FileHash -Algorithm SHA256 $path).Hash
+"""
+
+def push_windows(server: models.Server, artifact: Artifact, log_callback: Callable[[str], None]) -> str:
+    """Copy an artifact to a Windows server through stdin of a command in its cached WinRM shell"""
+    path = remote_path(artifact, models.OSType.WINDOWS)
+    quoted_path = path.replace("'", "''")
+    result, _ = winrm_cache.run_ps(server, WINDOWS_HASH_SCRIPT.format(path=quoted_path))
+    if result.std_out.decode("utf-8", errors="replace").strip().lower() == artifact.sha256:
+        log_callback(f"📦 {artifact.filename} already on {server.hostname}\n")
+        return path
+
+    log_callback(f"📤 Pushing {artifact.filename} ({artifact.size // 1024} KB) to {server.hostname}...\n")
+    script = WINDOWS_RECEIVE_SCRIPT.format(path=quoted_path, part_path=f"{quoted_path}.{uuid.uuid4().hex[:8]}.part")
+    lines = (b64encode(chunk) + b"\r\n" for chunk in read_chunks(artifact.path))
+    result, _ = winrm_cache.run_ps(server, script, stdin_chunks=lines)
+    if result.status_code != 0:
+        raise RuntimeError(f"Pushing {artifact.filename} failed: {result.std_err.decode('utf-8', errors='replace')}")
+    remote_sha256 = result.std_out.decode("utf-8", errors="replace").strip().lower()
+    if remote_sha256 != artifact.sha256:
+        raise ChecksumMismatch(f"{artifact.filename} on {server.hostname} has SHA-256 {remote_sha256}")
+    log_callback(f"✅ Pushed and verified {artifact.filename}\n")
+    return path
+
+def stage_installer(
+    server: models.Server,
+    application: models.Application,
+    log_callback: Callable[[str], None]
+) -> str:
+    """
+    Make an application's installer available on a server and return the install
+    command rewritten to use it. Commands that don't reference the installer are
+    returned unchanged and nothing is pushed.
+    """
+    command = application.install_command
+    if not application.installer_url:
+        return command
+    if rewrite_install_command(command, application.installer_url, "", server.os_type) is None:
+        return command
+
+    artifact = artifact_cache.fetch(application.installer_url, application.installer_sha256)
+    if server.os_type == models.OSType.WINDOWS:
+        path = push_windows(server, artifact, log_callback)
+    else:
+        path = push_linux(server, artifact, log_callback)
+    return rewrite_install_command(command, application.installer_url, path, server.os_type)
+
+artifact_cache = ArtifactCache()
@@ -0,0 +1,138 @@
+import os
+import shlex
+import uuid
+from base64 import b64encode
+from typing import Callable, List, NamedTuple, Optional
+
+# Run all of a server's applications as one remote script per server (one round trip per host)
+# instead of one remote command per application
+DEPLOYMENT_BATCH_SCRIPTS = os.getenv("DEPLOYMENT_BATCH_SCRIPTS", "false").lower() in ("1", "true", "yes")
+
+BEGIN = "BEGIN"
+END = "END"
+SKIP = "SKIP"
+
+class BatchStep(NamedTuple):
+    """One application's install command inside a batch script"""
+    application_id: int
+    command: str
+    # Prerequisites that must have exited 0 earlier in the script (or in an earlier batch)
+    depends_on: List[int]
+
+class StepEvent(NamedTuple):
+    kind: str
+    application_id: int
+    # Exit code for END, the prerequisite that did not succeed for SKIP
+    value: Optional[int] = None
+
+def new_marker() -> str:
+    """Random marker that step output cannot contain by accident"""
+    return f"__DEPLOYMASTER_{uuid.uuid4().hex}__"
+
+def compile_linux_script(steps: List[BatchStep], marker: str, succeeded: List[int] = ()) -> str:
+    """
+    POSIX shell script running the steps in order. Each step runs in its own
+    login-shell process (like a separate exec request would), so an `exit` in one
+    command ends only that step. A step whose prerequisite did not exit 0 prints a
+    SKIP marker instead of running. `succeeded` are prerequisites that finished in
+    an earlier batch.
+    """
+    lines = [f"M={shlex.quote(marker)}"]
+    lines += [f"rc_{application_id}=0" for application_id in succeeded]
+    for step in steps:
+        step_id = step.application_id
+        checks = [
+            f'[ "${{rc_{prerequisite}:-1}}" != 0 ]; then\n  printf \'\\n%s {SKIP} {step_id} {prerequisite}\\n\' "$M"'
+            for prerequisite in step.depends_on
+        ]
+        run = (
+            f"printf '\\n%s {BEGIN} {step_id}\\n' \"$M\"\n"
+            f"  \"${{SHELL:-/bin/sh}}\" -c {shlex.quote(step.command)}\n"
+            f"  rc_{step_id}=$?\n"
+            f"  printf '\\n%s {END} {step_id} %s\\n' \"$M\" \"$rc_{step_id}\""
+        )
+        if checks:
+            lines.append("if " + "\nelif ".join(checks) + "\nelse\n  " + run + "\nfi")
+        else:
+            lines.append(run.replace("\n  ", "\n"))
+    return "\n".join(lines) + "\n"
+
+def compile_windows_script(steps: List[BatchStep], marker: str, succeeded: List[int] = ()) -> str:
+    """
+    PowerShell script running the steps in order, each in a child powershell
+    process (as a separate run_ps call would), with the same markers and skip
+    rules as compile_linux_script.
+    """
+    lines = [f"$M = '{marker}'", "$rc = @{}"]
+    lines += [f"$rc[{application_id}] = 0" for application_id in succeeded]
+    for step in steps:
+        step_id = step.application_id
+        encoded = b64encode(step.command.encode("utf_16_le")).decode("ascii")
+        checks = [
+            f'($rc[{prerequisite}] -ne 0) {{ Write-Output "`n$M {SKIP} {step_id} {prerequisite}" }}'
+            for prerequisite in step.depends_on
+        ]
+        run = (
+            f'Write-Output "`n$M {BEGIN} {step_id}"; '
+            f'& powershell -NoProfile -NonInteractive -EncodedCommand {encoded} 2>&1 | ForEach-Object {{ "$_" }}; '
+            f'$rc[{step_id}] = $LASTEXITCODE; '
+            f'Write-Output "`n$M {END} {step_id} $($rc[{step_id}])"'
+        )
+        if checks:
+            lines.append("if " + " elseif ".join(checks) + f" else {{ {run} }}")
+        else:
+            lines.append(run)
+    return "\n".join(lines) + "\n"
+
+def parse_marker(line: str, marker: str) -> Optional[StepEvent]:
+    """The step event a line announces, or None for ordinary output"""
+    parts = line.strip().split()
+    if len(parts) < 3 or parts[0] != marker or parts[1] not in (BEGIN, END, SKIP):
+        return None
+    try:
+        numbers = [int(part) for part in parts[2:4]]
+    except ValueError:
+        return None
+    if parts[1] != BEGIN and len(numbers) < 2:
+        return None
+    return StepEvent(parts[1], numbers[0], numbers[1] if len(numbers) > 1 else None)
+
+class BatchOutputSplitter:
+    """
+    Splits the combined output of a batch script back into steps.
+    Ordinary lines go to on_output with the id of the step that printed them
+    (None before the first step); marker lines go to on_event. The blank line
+    each marker is preceded by (so it starts on a line of its own) is dropped.
+    """
+
+    def __init__(
+        self,
+        marker: str,
+        on_output: Callable[[Optional[int], str], None],
+        on_event: Callable[[StepEvent], None]
+    ):
+        self.marker = marker
+        self.on_output = on_output
+        self.on_event = on_event
+        self.current: Optional[int] = None
+        self._held_blank: Optional[str] = None
+
+    def feed(self, line: str):
+        event = parse_marker(line, self.marker) if self.marker in line else None
+        if event is not None:
+            self._held_blank = None
+            self.current = event.application_id if event.kind == BEGIN else None
+            self.on_event(event)
+            return
+        if self._held_blank is not None:
+            self.on_output(self.current, self._held_blank)
+            self._held_blank = None
+        if line.strip("\r\n") == "":
+            self._held_blank = line
+        else:
+            self.on_output(self.current, line)
+
+    def close(self):
+        if self._held_blank is not None:
+            self.on_output(self.current, self._held_blank)
+            self._held_blank = None
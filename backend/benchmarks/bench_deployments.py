@@ -0,0 +1,239 @@
+"""
+End-to-end deployment benchmark
+Starts loopback SSH servers (benchmarks/ssh_stub.py) and WSMan endpoints
+(benchmarks/wsman_stub.py) that answer every command with canned, timestamped
+output after a configurable latency, serves the API with uvicorn on loopback,
+registers them and drives deployments through POST /api/deployments while
+WebSocket clients follow the live log. Per deployment it reports:
+
+  hosts/min    servers finished per minute of wall time (POST to completed)
+  host         time from POST until a server's last job finished, p50/p99
+  job          duration of one application on one server, p50/p99
+  lines/s      stored log lines per second of wall time
+  db MB, amp   bytes the process wrote to the database files (write_bytes from
+               /proc/self/io, Linux only) and that over the bytes of log text stored
+  writes       INSERT/UPDATE/DELETE rows sent to SQLite
+  ws lag       delay from a stub printing a line to a WebSocket client receiving it
+
+Deployments run inline in the API process with per-application commands: canned
+output carries no batch markers, so DEPLOYMENT_BATCH_SCRIPTS is switched off.
+
+Usage (from backend/):
+    python -m benchmarks.bench_deployments --linux 50 --windows 10 --apps 2 --latency 0.2 --output-lines 200
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+from benchmarks.bench_event_loop import percentile
+
+# Lines stamped by the stubs end with " @<time.time()>"
+STAMP_PATTERN = re.compile(r" @(\d+\.\d+)")
+
+def write_bytes() -> Optional[int]:
+    """Bytes this process has caused to be written to files, where the kernel reports it"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+class Watcher(threading.Thread):
+    """WebSocket client following one deployment's live log and timing stamped lines"""
+
+    def __init__(self, url: str):
+        super().__init__(daemon=True)
+        self.url = url
+        self.lags: List[float] = []
+        self.lines = 0
+        self.frames = 0
+        self.error: Optional[Exception] = None
+        self.connected = threading.Event()
+        self.done = threading.Event()
+
+    def run(self):
+        asyncio.run(self._follow())
+
+    async def _follow(self):
+        import websockets
+
+        try:
+            async with websockets.connect(self.url, max_size=None) as websocket:
+                # Lines stamped earlier were replayed from the buffer, not delivered live
+                connected_at = time.time()
+                self.connected.set()
+                while not self.done.is_set():
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), 0.1)
+                    except asyncio.TimeoutError:
+                        continue
+                    received_at = time.time()
+                    self.frames += 1
+                    for line in json.loads(message).get("lines", []):
+                        for stamp in STAMP_PATTERN.findall(line["text"]):
+                            self.lines += 1
+                            if float(stamp) >= connected_at:
+                                self.lags.append(received_at - float(stamp))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.connected.set()
+
+    def stop(self):
+        self.done.set()
+        self.join(5)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linux", type=int, default=20, help="Loopback SSH servers")
+    parser.add_argument("--windows", type=int, default=5, help="Loopback WSMan endpoints")
+    parser.add_argument("--apps", type=int, default=2, help="Applications per OS")
+    parser.add_argument("--deployments", type=int, default=1, help="Deployments run one after another")
+    parser.add_argument("--max-parallel", type=int, default=None, help="Deployment max_parallel")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds each command takes")
+    parser.add_argument("--output-lines", type=int, default=100, help="Output lines per command")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of commands exiting 1")
+    parser.add_argument("--watchers", type=int, default=1, help="WebSocket clients per deployment")
+    args = parser.parse_args()
+
+    # Point the database at a scratch directory and configure the app before its modules load
+    os.chdir(tempfile.mkdtemp(prefix="deploymaster-bench-"))
+    os.environ["WINRM_TRANSPORT"] = "plaintext"
+    os.environ["DEPLOYMENT_EXECUTION"] = "inline"
+    os.environ["DEPLOYMENT_BATCH_SCRIPTS"] = "false"
+    os.environ["LOG_ARCHIVE_INTERVAL"] = "0"
+    import httpx
+    import uvicorn
+    from sqlalchemy import event
+    import main as api
+    from benchmarks.ssh_stub import SSHStub
+    from benchmarks.wsman_stub import WSManStub
+    from database import async_engine, engine
+
+    writes = {"rows": 0}
+
+    def count_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            writes["rows"] += len(parameters) if executemany else 1
+
+    for counted_engine in (engine, async_engine.sync_engine):
+        event.listen(counted_engine, "before_cursor_execute", count_writes)
+    # Pre-flight probes open and drop TCP connections, which paramiko reports as socket errors
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    stub_options = dict(output_lines=args.output_lines, failure_rate=args.failure_rate, stamp_output=True)
+    ssh_stubs = [SSHStub(execute=False, command_latency=args.latency, **stub_options) for _ in range(args.linux)]
+    wsman_stubs = [WSManStub(shell_latency=args.latency, **stub_options) for _ in range(args.windows)]
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning", ws="websockets"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    client = httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60)
+
+    server_ids, application_ids = [], []
+    for os_type, stubs in (("linux", ssh_stubs), ("windows", wsman_stubs)):
+        for index, stub in enumerate(stubs):
+            server_ids.append(client.post("/api/servers", json={
+                "hostname": f"bench-{os_type}-{index + 1}", "ip_address": "127.0.0.1", "os_type": os_type,
+                "username": "bench", "password": "bench", "port": stub.start()
+            }).raise_for_status().json()["id"])
+        if stubs:
+            for index in range(args.apps):
+                application_ids.append(client.post("/api/applications", json={
+                    "name": f"bench-{os_type}-{index + 1}", "version": "1.0", "os_type": os_type,
+                    "install_command": f"install bench-{index + 1}"
+                }).raise_for_status().json()["id"])
+
+    print(
+        f"{args.linux} linux + {args.windows} windows servers, {args.apps} applications per OS, "
+        f"{args.latency:.2f}s and {args.output_lines} lines per command, failure rate {args.failure_rate:.0%}"
+    )
+    print(
+        f"{'run':>3} {'seconds':>8} {'hosts/min':>10} {'host p50/p99 s':>15} {'job p50/p99 s':>14} "
+        f"{'lines/s':>9} {'failed':>7} {'db MB':>7} {'amp':>6} {'writes':>8} {'ws lag p50/p99 ms':>18}"
+    )
+    for run in range(1, args.deployments + 1):
+        rows_before, bytes_before = writes["rows"], write_bytes()
+        posted_at = datetime.utcnow()
+        started = time.perf_counter()
+        deployment = client.post("/api/deployments", json={
+            "application_ids": application_ids, "server_ids": server_ids, "max_parallel": args.max_parallel
+        }).raise_for_status().json()
+        watchers = [Watcher(f"ws://127.0.0.1:{port}/ws/deployments/{deployment['id']}") for _ in range(args.watchers)]
+        for watcher in watchers:
+            watcher.start()
+        for watcher in watchers:
+            watcher.connected.wait(10)
+
+        while True:
+            latest = client.get("/api/deployments", params={"limit": 1}).json()["items"][0]
+            if latest["id"] == deployment["id"] and latest["status"] in ("success", "failed"):
+                break
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        # Let the last coalesced frames arrive
+        time.sleep(0.5)
+        for watcher in watchers:
+            watcher.stop()
+        rows_written = writes["rows"] - rows_before
+        bytes_written = write_bytes() - bytes_before if bytes_before is not None else None
+
+        # Skipped jobs never ran
+        results = [
+            result for result in client.get(f"/api/deployments/{deployment['id']}/results").json()
+            if result["status"] != "skipped"
+        ]
+        log = client.get(f"/api/deployments/{deployment['id']}/logs", headers={"Accept-Encoding": "identity"}).content
+        durations = [result["duration"] for result in results if result["duration"] is not None]
+        host_finished = {}
+        for result in results:
+            if result["finished_at"]:
+                finished_at = datetime.fromisoformat(result["finished_at"])
+                host_finished[result["server_id"]] = max(finished_at, host_finished.get(result["server_id"], finished_at))
+        host_latencies = [(finished_at - posted_at).total_seconds() for finished_at in host_finished.values()]
+        lags = [lag for watcher in watchers for lag in watcher.lags]
+        failed = sum(result["status"] == "failed" for result in results)
+        lines = log.count(b"\n")
+
+        def pair(values: list, scale: float = 1.0, digits: int = 2) -> str:
+            if not values:
+                return "-"
+            return f"{percentile(values, 0.5) * scale:.{digits}f}/{percentile(values, 0.99) * scale:.{digits}f}"
+
+        db_mb = f"{bytes_written / 1024 / 1024:7.1f}" if bytes_written is not None else f"{'n/a':>7}"
+        amplification = f"{bytes_written / len(log):6.1f}" if bytes_written is not None and log else f"{'n/a':>6}"
+        print(
+            f"{run:>3} {elapsed:>8.2f} {len(host_finished) / elapsed * 60:>10.0f} {pair(host_latencies):>15} "
+            f"{pair(durations):>14} {lines / elapsed:>9.0f} {failed:>7} {db_mb} {amplification} "
+            f"{rows_written:>8} {pair(lags, 1000, 1):>18}"
+        )
+        for watcher in watchers:
+            if watcher.error is not None:
+                print(f"    watcher failed: {watcher.error!r}")
+
+    client.close()
+    server.should_exit = True
+    for stub in ssh_stubs + wsman_stubs:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Event-loop latency under concurrent deployment database work
+Runs the same deployment-path database calls (create, status updates with
+log appends, final status) from many concurrent coroutines, once calling the
+synchronous crud functions on the loop and once through AsyncSession.run_sync.
+A ticker coroutine measures how late the loop wakes it up.
+
+Usage (from backend/):
+    python -m benchmarks.bench_event_loop --deployments 20 --updates 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+TICK_SECONDS = 0.005
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deployments", type=int, default=20, help="Concurrent deployments")
+    parser.add_argument("--updates", type=int, default=50, help="Status/log updates per deployment")
+    args = parser.parse_args()
+
+    # Point the database at a scratch directory before the app modules load
+    os.chdir(tempfile.mkdtemp(prefix="deploymaster-bench-"))
+    import crud
+    import models
+    import schemas
+    from database import engine, SessionLocal, AsyncSessionLocal
+
+    models.Base.metadata.create_all(bind=engine)
+    running = models.DeploymentStatus.RUNNING
+    request = schemas.DeploymentCreate(application_ids=[], server_ids=[])
+
+    # One short session per call, like the request handlers: holding a pooled connection
+    # across awaits would exhaust the pool (5 + 10) and block the loop on checkout
+    def call_sync(function, *args):
+        with SessionLocal() as db:
+            return function(db, *args)
+
+    async def call_async(function, *args):
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(function, *args)
+
+    async def deploy_sync():
+        deployment_id = call_sync(crud.create_deployment, request).id
+        for update in range(args.updates):
+            call_sync(crud.update_deployment_status, deployment_id, running, f"line {update}\n")
+            await asyncio.sleep(0)
+        call_sync(crud.update_deployment_status, deployment_id, models.DeploymentStatus.SUCCESS)
+
+    async def deploy_async():
+        deployment_id = (await call_async(crud.create_deployment, request)).id
+        for update in range(args.updates):
+            await call_async(crud.update_deployment_status, deployment_id, running, f"line {update}\n")
+        await call_async(crud.update_deployment_status, deployment_id, models.DeploymentStatus.SUCCESS)
+
+    async def measure(deploy) -> tuple:
+        lags = []
+        done = asyncio.Event()
+
+        async def ticker():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(TICK_SECONDS)
+                lags.append((time.perf_counter() - start - TICK_SECONDS) * 1000)
+
+        ticker_task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        await asyncio.gather(*[deploy() for _ in range(args.deployments)])
+        elapsed = time.perf_counter() - start
+        done.set()
+        await ticker_task
+        return elapsed, lags
+
+    print(f"{'mode':<6} {'seconds':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for mode, deploy in (("sync", deploy_sync), ("async", deploy_async)):
+        elapsed, lags = asyncio.run(measure(deploy))
+        print(
+            f"{mode:<6} {elapsed:>8.3f} {statistics.median(lags):>11.2f} "
+            f"{percentile(lags, 0.99):>11.2f} {max(lags):>11.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Log bridge throughput and latency benchmark
+Executor-style threads emit log lines through LogBridge while the event loop
+delivers them to a no-op broadcaster. Lines are also persisted by the batched
+log writer into a throwaway SQLite database.
+
+Usage (from backend/):
+    python -m benchmarks.bench_log_bridge --threads 20 --lines 5000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=20, help="Concurrent emitting threads")
+    parser.add_argument("--lines", type=int, default=5000, help="Lines per thread")
+    args = parser.parse_args()
+
+    # Point the database at a scratch directory before the app modules load
+    os.chdir(tempfile.mkdtemp(prefix="deploymaster-bench-"))
+    import models
+    from database import engine, SessionLocal
+    from log_bridge import LogBridge
+    from log_writer import log_writer
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    deployment = models.Deployment()
+    db.add(deployment)
+    db.commit()
+    deployment_id = deployment.id
+    db.close()
+
+    async def deliver(deployment_id: int, message: str, server_id: int, application_id: int):
+        pass
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        bridge = LogBridge(loop, deliver)
+        bridge.start()
+
+        def emit_lines(thread_index: int):
+            callback = bridge.callback(deployment_id, thread_index, 1)
+            for line in range(args.lines):
+                callback(f"thread {thread_index} line {line}\n")
+
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            loop.run_in_executor(None, emit_lines, thread_index)
+            for thread_index in range(args.threads)
+        ])
+        await bridge.drain()
+        delivered = time.perf_counter() - start
+        log_writer.flush()
+        persisted = time.perf_counter() - start
+        await bridge.stop()
+        return bridge.stats(), delivered, persisted
+
+    stats, delivered, persisted = asyncio.run(run())
+    total = args.threads * args.lines
+    print(f"lines:              {total}")
+    print(f"delivered in:       {delivered:.3f}s ({total / delivered:,.0f} lines/s)")
+    print(f"persisted in:       {persisted:.3f}s ({total / persisted:,.0f} lines/s)")
+    print(f"avg latency:        {stats['avg_latency_ms']:.2f} ms")
+    print(f"max latency:        {stats['max_latency_ms']:.2f} ms")
+
+if __name__ == "__main__":
+    main()
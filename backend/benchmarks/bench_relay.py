@@ -0,0 +1,99 @@
+"""
+Installer distribution: direct push vs relay tree
+Starts N loopback SSH servers (benchmarks/ssh_stub.py), each with its own home
+directory, and distributes one installer to all of them, once pushed from the
+controller to every server and once relayed through servers that already hold
+it. Reports wall time and the bytes the controller sent itself, then checks
+the file in every home.
+
+Usage (from backend/):
+    python -m benchmarks.bench_relay --servers 16 --size-mb 20 --fanout 4
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=16, help="Loopback SSH servers")
+    parser.add_argument("--size-mb", type=int, default=20, help="Installer size")
+    parser.add_argument("--fanout", type=int, default=3, help="ARTIFACT_RELAY_FANOUT")
+    args = parser.parse_args()
+
+    # Relative, so every server stores the file in its own home directory
+    os.environ["ARTIFACT_REMOTE_DIR_LINUX"] = "artifacts"
+    os.environ["ARTIFACT_RELAY_FANOUT"] = str(args.fanout)
+    os.chdir(tempfile.mkdtemp(prefix="deploymaster-bench-"))
+    import models
+    import relay
+    from artifacts import Artifact, push_linux, remote_path
+    from benchmarks.ssh_stub import SSHStub
+    from concurrent.futures import ThreadPoolExecutor
+    from crud import encrypt_password
+    from ssh_pool import ssh_pool
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    sha256 = hashlib.sha256(data).hexdigest()
+    with open("installer.bin", "wb") as f:
+        f.write(data)
+    artifact = Artifact(sha256, len(data), "installer.bin", os.path.abspath("installer.bin"))
+
+    stubs = [SSHStub(home=tempfile.mkdtemp(prefix="home-", dir=".")) for _ in range(args.servers)]
+    servers = [
+        models.Server(
+            id=index + 1, hostname=f"bench-{index + 1}", ip_address="127.0.0.1",
+            os_type=models.OSType.LINUX, username="bench", password=encrypt_password("bench"),
+            port=stub.start()
+        )
+        for index, stub in enumerate(stubs)
+    ]
+    failures = []
+
+    def log(server_id, message):
+        if message.startswith(("⚠️", "❌")):
+            failures.append(message.strip())
+
+    def direct():
+        with ThreadPoolExecutor(max_workers=relay.ARTIFACT_RELAY_MAX_TRANSFERS) as pool:
+            list(pool.map(lambda server: push_linux(server, artifact, lambda message: None), servers))
+
+    def relayed():
+        relay.relay_artifact(servers, artifact, log)
+
+    print(f"{args.servers} servers, {args.size_mb} MB installer, fanout {args.fanout}")
+    for name, distribute in (("direct", direct), ("relay", relayed)):
+        for stub in stubs:
+            shutil.rmtree(os.path.join(stub.home, "artifacts"), ignore_errors=True)
+            stub.sftp_bytes_received = 0
+        failures.clear()
+
+        started = time.perf_counter()
+        distribute()
+        elapsed = time.perf_counter() - started
+
+        path = remote_path(artifact, models.OSType.LINUX)
+        verified = 0
+        for stub in stubs:
+            try:
+                with open(os.path.join(stub.home, path), "rb") as f:
+                    verified += hashlib.sha256(f.read()).hexdigest() == sha256
+            except OSError:
+                pass
+        controller_mb = sum(stub.sftp_bytes_received for stub in stubs) / 1024 / 1024
+        print(
+            f"{name:>6}: {elapsed:6.2f}s  controller sent {controller_mb:7.1f} MB  "
+            f"verified {verified}/{len(stubs)}  fallbacks {len(failures)}"
+        )
+        for message in failures[:5]:
+            print(f"        {message}")
+
+    ssh_pool.close_all()
+    for stub in stubs:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
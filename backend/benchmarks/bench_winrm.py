@@ -0,0 +1,81 @@
+"""
+WinRM shell reuse benchmark
+Runs the same PowerShell commands against a local WSMan stub, once with a
+fresh session per command (the old behaviour) and once through the shell cache.
+
+Usage (from backend/):
+    python -m benchmarks.bench_winrm --servers 5 --commands 5 --connect-latency 0.05
+"""
+
+import argparse
+import time
+import winrm
+import crud
+import models
+from winrm_pool import WinRMSessionCache
+from benchmarks.wsman_stub import WSManStub
+
+def make_servers(count: int, port: int) -> list:
+    password = crud.encrypt_password("benchmark")
+    return [
+        models.Server(
+            id=index + 1,
+            hostname=f"win-{index + 1}",
+            ip_address="127.0.0.1",
+            os_type=models.OSType.WINDOWS,
+            username="benchmark",
+            password=password,
+            port=port
+        )
+        for index in range(count)
+    ]
+
+def run_fresh(servers: list, commands: int) -> float:
+    start = time.perf_counter()
+    for server in servers:
+        for index in range(commands):
+            session = winrm.Session(
+                WinRMSessionCache.endpoint(server),
+                auth=(server.username, "benchmark"),
+                transport="plaintext"
+            )
+            session.run_ps(f"Write-Output {index}")
+    return time.perf_counter() - start
+
+def run_cached(servers: list, commands: int) -> float:
+    cache = WinRMSessionCache(transport="plaintext")
+    start = time.perf_counter()
+    for server in servers:
+        for index in range(commands):
+            cache.run_ps(server, f"Write-Output {index}")
+    elapsed = time.perf_counter() - start
+    cache.close_all()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=5)
+    parser.add_argument("--commands", type=int, default=5, help="Commands per server")
+    parser.add_argument("--request-latency", type=float, default=0.002)
+    parser.add_argument("--connect-latency", type=float, default=0.05)
+    parser.add_argument("--shell-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    total = args.servers * args.commands
+    print(f"{'mode':<8} {'seconds':>8} {'ms/cmd':>8} {'shells':>7} {'tcp':>5} {'requests':>9}")
+    for mode, runner in (("fresh", run_fresh), ("cached", run_cached)):
+        stub = WSManStub(
+            request_latency=args.request_latency,
+            connect_latency=args.connect_latency,
+            shell_latency=args.shell_latency
+        )
+        servers = make_servers(args.servers, stub.start())
+        elapsed = runner(servers, args.commands)
+        stub.stop()
+        print(
+            f"{mode:<8} {elapsed:>8.3f} {elapsed / total * 1000:>8.1f} "
+            f"{stub.shells_opened:>7} {stub.connections:>5} {stub.requests:>9}"
+        )
+
+if __name__ == "__main__":
+    main()
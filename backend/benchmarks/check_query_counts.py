@@ -0,0 +1,77 @@
+"""
+SQL statement budget check for read endpoints
+Seeds a scratch database at two sizes and asserts that each endpoint runs the
+same number of SQL statements regardless of page size or targets per deployment.
+
+Usage (from backend/):
+    python -m benchmarks.check_query_counts
+"""
+
+import os
+import sys
+import tempfile
+
+def main():
+    # Point the database at a scratch directory before the app modules load
+    os.chdir(tempfile.mkdtemp(prefix="deploymaster-queries-"))
+    import crud
+    import main as api
+    import models
+    import schemas
+    from database import SessionLocal, count_queries
+
+    db = SessionLocal()
+
+    def seed(deployments: int, targets: int):
+        applications = [
+            models.Application(name=f"app-{deployments}-{i}", version="1", os_type=models.OSType.LINUX, install_command="true")
+            for i in range(targets)
+        ]
+        servers = [
+            models.Server(hostname=f"srv-{deployments}-{i}", ip_address="127.0.0.1", os_type=models.OSType.LINUX, username="u")
+            for i in range(targets)
+        ]
+        for _ in range(deployments):
+            deployment = models.Deployment(applications=applications, servers=servers)
+            db.add(deployment)
+        db.commit()
+        return deployment.id
+
+    def measure(call) -> int:
+        db.expunge_all()
+        with count_queries() as query_count:
+            call()
+        return query_count.count
+
+    def endpoints(deployment_id: int, page_size: int) -> dict:
+        return {
+            "GET /api/deployments": measure(
+                lambda: schemas.DeploymentPage.model_validate(api.list_deployments(limit=page_size, db=db))
+            ),
+            "GET /api/deployments/{id}": measure(
+                lambda: schemas.Deployment.model_validate(api.get_deployment(deployment_id, db=db))
+            ),
+            "GET /api/dashboard": measure(
+                lambda: schemas.DashboardStats.model_validate(api.get_dashboard_stats(db=db))
+            ),
+            "crud.create_deployment": measure(
+                lambda: schemas.Deployment.model_validate(crud.create_deployment(
+                    db, schemas.DeploymentCreate(application_ids=[1], server_ids=[1])
+                ))
+            ),
+        }
+
+    small = endpoints(seed(deployments=2, targets=1), page_size=1)
+    large = endpoints(seed(deployments=200, targets=25), page_size=100)
+
+    failed = False
+    print(f"{'endpoint':<28} {'small':>6} {'large':>6}")
+    for name in small:
+        marker = "" if small[name] == large[name] else "  <-- grows with data"
+        failed = failed or bool(marker)
+        print(f"{name:<28} {small[name]:>6} {large[name]:>6}{marker}")
+    db.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
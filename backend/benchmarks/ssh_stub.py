@@ -0,0 +1,213 @@
+"""
+Loopback SSH server for benchmarks and relay checks.
+Accepts any password or key. Each stub has its own home directory: exec
+requests either run for real with the home as working directory, or return
+canned output, and SFTP resolves relative paths against the home.
+"""
+
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+import paramiko
+
+# Generated once per process; clients use AutoAddPolicy
+HOST_KEY = paramiko.RSAKey.generate(2048)
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+class SSHStub:
+    """Loopback SSH server with optional real command execution and byte counters"""
+
+    def __init__(
+        self,
+        home: Optional[str] = None,
+        execute: bool = True,
+        command_latency: float = 0.0,
+        output_lines: int = 10,
+        failure_rate: float = 0.0,
+        stamp_output: bool = False
+    ):
+        self.home = home or tempfile.mkdtemp(prefix="deploymaster-ssh-stub-")
+        # Run commands in a shell (True) or answer with output_lines of canned output
+        self.execute = execute
+        self.command_latency = command_latency
+        self.output_lines = output_lines
+        self.failure_rate = failure_rate
+        # End canned lines with " @<time.time()>" so consumers can measure delivery lag
+        self.stamp_output = stamp_output
+
+        self.connections = 0
+        self.commands_run = 0
+        self.sftp_bytes_received = 0
+        self._lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._transports = []
+
+    def _path(self, path: str) -> str:
+        return os.path.join(self.home, path)
+
+    def _sftp_interface(self):
+        stub = self
+
+        class Interface(paramiko.SFTPServerInterface):
+            def open(self, path, flags, attr):
+                try:
+                    fd = os.open(stub._path(path), flags, 0o644)
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                writing = flags & (os.O_WRONLY | os.O_RDWR)
+                handle = _SFTPHandle(flags)
+                handle.readfile = handle.writefile = os.fdopen(fd, "wb" if writing else "rb")
+                if writing:
+                    write = handle.write
+
+                    def counted_write(offset, data):
+                        with stub._lock:
+                            stub.sftp_bytes_received += len(data)
+                        return write(offset, data)
+                    handle.write = counted_write
+                return handle
+
+            def stat(self, path):
+                try:
+                    return paramiko.SFTPAttributes.from_stat(os.stat(stub._path(path)))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+
+            lstat = stat
+
+            def mkdir(self, path, attr):
+                try:
+                    os.mkdir(stub._path(path))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                return paramiko.SFTP_OK
+
+            def remove(self, path):
+                try:
+                    os.remove(stub._path(path))
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                return paramiko.SFTP_OK
+
+            def rename(self, old_path, new_path):
+                os.replace(stub._path(old_path), stub._path(new_path))
+                return paramiko.SFTP_OK
+
+            posix_rename = rename
+
+        return Interface
+
+    def _run_command(self, channel: paramiko.Channel, command: bytes):
+        with self._lock:
+            self.commands_run += 1
+        time.sleep(self.command_latency)
+        if not self.execute:
+            for index in range(self.output_lines):
+                stamp = f" @{time.time():.6f}" if self.stamp_output else ""
+                channel.sendall(f"stub output line {index}{stamp}\r\n".encode())
+            failed = self.failure_rate and (hash((time.perf_counter(), id(channel))) % 1000) < self.failure_rate * 1000
+            channel.send_exit_status(1 if failed else 0)
+            channel.close()
+            return
+
+        process = subprocess.Popen(
+            command.decode(), shell=True, cwd=self.home,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
+        )
+
+        def pump(stream, send):
+            for block in iter(lambda: stream.read1(65536), b""):
+                try:
+                    send(block)
+                except (OSError, EOFError):
+                    break
+
+        stderr_thread = threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr), daemon=True)
+        stderr_thread.start()
+
+        # Like sshd, a client closing the channel ends the command
+        def reap_on_close():
+            while process.poll() is None:
+                if channel.closed:
+                    process.kill()
+                    return
+                time.sleep(0.05)
+        threading.Thread(target=reap_on_close, daemon=True).start()
+
+        pump(process.stdout, channel.sendall)
+        stderr_thread.join()
+        returncode = process.wait()
+        try:
+            # Killed processes report 128 + signal, like a shell
+            channel.send_exit_status(returncode if returncode >= 0 else 128 - returncode)
+            channel.close()
+        except (OSError, EOFError):
+            pass
+
+    def _server_interface(self):
+        stub = self
+
+        class Interface(paramiko.ServerInterface):
+            def get_allowed_auths(self, username):
+                return "password,publickey"
+
+            def check_auth_password(self, username, password):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def check_auth_publickey(self, username, key):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def check_channel_request(self, kind, chanid):
+                return paramiko.OPEN_SUCCEEDED
+
+            def check_channel_pty_request(self, *args):
+                return True
+
+            def check_channel_exec_request(self, channel, command):
+                threading.Thread(target=stub._run_command, args=(channel, command), daemon=True).start()
+                return True
+
+        return Interface()
+
+    def start(self) -> int:
+        """Start serving on a free loopback port and return the port"""
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(128)
+
+        def accept():
+            while True:
+                try:
+                    client, _ = self._socket.accept()
+                except OSError:
+                    return
+                with self._lock:
+                    self.connections += 1
+                transport = paramiko.Transport(client)
+                transport.add_server_key(HOST_KEY)
+                transport.set_subsystem_handler("sftp", paramiko.SFTPServer, self._sftp_interface())
+                self._transports.append(transport)
+                try:
+                    transport.start_server(server=self._server_interface())
+                except (paramiko.SSHException, EOFError, OSError):
+                    continue
+
+        threading.Thread(target=accept, daemon=True).start()
+        return self._socket.getsockname()[1]
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+        for transport in self._transports:
+            transport.close()
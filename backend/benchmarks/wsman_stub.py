@@ -0,0 +1,148 @@
+"""
+Minimal WSMan (WinRM) endpoint for benchmarks.
+Speaks just enough of the shell protocol for pywinrm: Create, Command,
+Receive, Signal and Delete. Accepts any Basic credentials, so clients must
+use the 'plaintext' transport.
+"""
+
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACTION_PATTERN = re.compile(rb"Action[^>]*>([^<]+)<")
+MESSAGE_ID_PATTERN = re.compile(rb"MessageID[^>]*>([^<]+)<")
+COMMAND_ID_PATTERN = re.compile(rb'CommandId="([^"]+)"')
+
+ENVELOPE = (
+    '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+    'xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" '
+    'xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" '
+    'xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">'
+    '<s:Header><a:RelatesTo>{relates_to}</a:RelatesTo></s:Header>'
+    '<s:Body>{body}</s:Body></s:Envelope>'
+)
+DONE_STATE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"
+
+class WSManStub:
+    """Loopback WSMan server with configurable latency, output volume and failure rate"""
+
+    def __init__(
+        self,
+        request_latency: float = 0.0,
+        connect_latency: float = 0.0,
+        shell_latency: float = 0.0,
+        output_lines: int = 10,
+        failure_rate: float = 0.0,
+        stamp_output: bool = False
+    ):
+        # Added to every WSMan request
+        self.request_latency = request_latency
+        # Added to the first request on each new TCP connection (stands in for NTLM negotiation)
+        self.connect_latency = connect_latency
+        # Added to shell creation
+        self.shell_latency = shell_latency
+        self.output_lines = output_lines
+        self.failure_rate = failure_rate
+        # End output lines with " @<time.time()>" so consumers can measure delivery lag
+        self.stamp_output = stamp_output
+
+        self.connections = 0
+        self.requests = 0
+        self.shells_opened = 0
+        self.commands_run = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _handle(self, body: bytes) -> str:
+        action = ACTION_PATTERN.search(body).group(1).decode()
+        message_id = MESSAGE_ID_PATTERN.search(body).group(1).decode()
+
+        if action.endswith("transfer/Create"):
+            time.sleep(self.shell_latency)
+            shell_id = str(uuid.uuid4()).upper()
+            with self._lock:
+                self.shells_opened += 1
+            body = (
+                '<w:ResourceCreated><a:ReferenceParameters><w:SelectorSet>'
+                f'<w:Selector Name="ShellId">{shell_id}</w:Selector>'
+                '</w:SelectorSet></a:ReferenceParameters></w:ResourceCreated>'
+            )
+        elif action.endswith("shell/Command"):
+            with self._lock:
+                self.commands_run += 1
+            body = f'<rsp:CommandResponse><rsp:CommandId>{uuid.uuid4()}</rsp:CommandId></rsp:CommandResponse>'
+        elif action.endswith("shell/Receive"):
+            command_id = COMMAND_ID_PATTERN.search(body).group(1).decode()
+            stamp = f" @{time.time():.6f}" if self.stamp_output else ""
+            output = "".join(f"stub output line {i}{stamp}\r\n" for i in range(self.output_lines))
+            exit_code = 1 if random.random() < self.failure_rate else 0
+            body = (
+                '<rsp:ReceiveResponse>'
+                f'<rsp:Stream Name="stdout" CommandId="{command_id}">{b64encode(output.encode()).decode()}</rsp:Stream>'
+                f'<rsp:Stream Name="stdout" CommandId="{command_id}" End="true"></rsp:Stream>'
+                f'<rsp:CommandState CommandId="{command_id}" State="{DONE_STATE}">'
+                f'<rsp:ExitCode>{exit_code}</rsp:ExitCode></rsp:CommandState>'
+                '</rsp:ReceiveResponse>'
+            )
+        elif action.endswith("shell/Signal"):
+            body = '<rsp:SignalResponse/>'
+        elif action.endswith("transfer/Delete"):
+            body = ''
+        else:
+            raise ValueError(f"Unsupported WSMan action: {action}")
+
+        return ENVELOPE.format(relates_to=message_id, body=body)
+
+    def start(self) -> int:
+        """Start serving on a free loopback port and return the port"""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.fresh_connection = True
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not body:
+                    # What a real listener answers an unauthenticated probe
+                    self.send_response(401)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.fresh_connection:
+                    self.fresh_connection = False
+                    time.sleep(stub.connect_latency)
+                time.sleep(stub.request_latency)
+                with stub._lock:
+                    stub.requests += 1
+                response = stub._handle(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/soap+xml;charset=UTF-8")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Set, Tuple
+from fastapi import WebSocket
+
+# Recent frames kept per deployment for late subscribers
+WS_REPLAY_FRAMES = int(os.getenv("WS_REPLAY_FRAMES", "5000"))
+# Frames queued for one client before it is considered too slow and dropped
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "10000"))
+# Deployments whose replay buffers are kept in memory
+WS_MAX_CHANNELS = int(os.getenv("WS_MAX_CHANNELS", "100"))
+
+# Coalescing window bounds: idle streams flush at the minimum, bursty ones grow towards the maximum
+WS_BATCH_MIN_MS = int(os.getenv("WS_BATCH_MIN_MS", "20"))
+WS_BATCH_MAX_MS = int(os.getenv("WS_BATCH_MAX_MS", "500"))
+# Frames with more lines than this widen the window, frames with a single line narrow it
+WS_BURST_LINES = 50
+
+# WebSocket close code for "try again later"
+CLOSE_TRY_AGAIN_LATER = 1013
+
+class Subscriber:
+    """One WebSocket client with its own send queue"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # Always room for a full replay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(WS_CLIENT_QUEUE_SIZE, WS_REPLAY_FRAMES + 1))
+        self.task: Optional[asyncio.Task] = None
+
+class DeploymentChannel:
+    """Subscribers, pending lines and replay buffer for one deployment"""
+
+    def __init__(self):
+        self.frames: Deque[Tuple[int, str]] = deque(maxlen=WS_REPLAY_FRAMES)
+        self.next_offset = 0
+        self.subscribers: Set[Subscriber] = set()
+        # Lines waiting for the current coalescing window: [server_id, application_id, text, line_count]
+        self.pending: List[list] = []
+        self.window = WS_BATCH_MIN_MS / 1000
+        self.last_flush = 0.0
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def add_line(self, server_id: Optional[int], application_id: Optional[int], text: str):
+        last = self.pending[-1] if self.pending else None
+        if last is not None and last[0] == server_id and last[1] == application_id:
+            last[2] += text
+            last[3] += 1
+        else:
+            self.pending.append([server_id, application_id, text, 1])
+
+    def take_frame(self) -> Tuple[int, str]:
+        """Turn pending lines into the next frame and adapt the window to the burst size"""
+        line_count = sum(entry[3] for entry in self.pending)
+        frame = json.dumps({
+            "type": "logs",
+            "offset": self.next_offset,
+            "lines": [
+                {"server_id": server_id, "application_id": application_id, "text": text}
+                for server_id, application_id, text, _ in self.pending
+            ]
+        })
+        offset = self.next_offset
+        self.frames.append((offset, frame))
+        self.next_offset += 1
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+        if line_count > WS_BURST_LINES:
+            self.window = min(self.window * 2, WS_BATCH_MAX_MS / 1000)
+        elif line_count <= 1:
+            self.window = max(self.window / 2, WS_BATCH_MIN_MS / 1000)
+        return offset, frame
+
+class ConnectionManager:
+    """
+    Broadcasts deployment logs to any number of WebSocket clients.
+    Lines are coalesced per time window into JSON frames:
+    {"type": "logs", "offset": N, "lines": [{"server_id", "application_id", "text"}]}
+    """
+
+    def __init__(self):
+        self.channels: "OrderedDict[int, DeploymentChannel]" = OrderedDict()
+
+    def _channel(self, deployment_id: int) -> DeploymentChannel:
+        channel = self.channels.get(deployment_id)
+        if channel is None:
+            channel = self.channels[deployment_id] = DeploymentChannel()
+            self._evict_idle_channels()
+        self.channels.move_to_end(deployment_id)
+        return channel
+
+    def _evict_idle_channels(self):
+        """Drop the oldest replay buffers nobody is watching"""
+        for deployment_id in list(self.channels):
+            if len(self.channels) <= WS_MAX_CHANNELS:
+                break
+            if not self.channels[deployment_id].subscribers:
+                del self.channels[deployment_id]
+
+    async def connect(self, deployment_id: int, websocket: WebSocket, offset: Optional[int] = None) -> Subscriber:
+        """Accept a client and replay buffered frames from offset (default: everything buffered)"""
+        await websocket.accept()
+        channel = self._channel(deployment_id)
+        subscriber = Subscriber(websocket)
+
+        oldest = channel.frames[0][0] if channel.frames else channel.next_offset
+        start = oldest if offset is None else max(offset, 0)
+        if start < oldest:
+            subscriber.queue.put_nowait(json.dumps({
+                "type": "notice",
+                "text": f"… {oldest - start} earlier log frames are no longer buffered, see the deployment log for full output\n"
+            }))
+        for frame_offset, message in channel.frames:
+            if frame_offset >= start:
+                subscriber.queue.put_nowait(message)
+
+        channel.subscribers.add(subscriber)
+        subscriber.task = asyncio.create_task(self._send_loop(deployment_id, subscriber))
+        return subscriber
+
+    def disconnect(self, deployment_id: int, subscriber: Subscriber):
+        channel = self.channels.get(deployment_id)
+        if channel is not None:
+            channel.subscribers.discard(subscriber)
+        if subscriber.task is not None and subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+
+    async def _send_loop(self, deployment_id: int, subscriber: Subscriber):
+        try:
+            while True:
+                message = await subscriber.queue.get()
+                await subscriber.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(deployment_id, subscriber)
+
+    async def send_log(
+        self,
+        deployment_id: int,
+        message: str,
+        server_id: Optional[int] = None,
+        application_id: Optional[int] = None
+    ):
+        """Queue a line for the next frame of a deployment"""
+        channel = self._channel(deployment_id)
+        channel.add_line(server_id, application_id, message)
+        if channel.flush_handle is not None:
+            return
+
+        elapsed = time.monotonic() - channel.last_flush
+        if elapsed >= channel.window:
+            # Idle stream: send right away
+            self._flush(deployment_id, channel)
+        else:
+            channel.flush_handle = asyncio.get_running_loop().call_later(
+                channel.window - elapsed, self._flush, deployment_id, channel
+            )
+
+    def flush(self, deployment_id: int):
+        """Send any lines still waiting in the coalescing window"""
+        channel = self.channels.get(deployment_id)
+        if channel is not None and channel.pending:
+            self._flush(deployment_id, channel)
+
+    def _flush(self, deployment_id: int, channel: DeploymentChannel):
+        if channel.flush_handle is not None:
+            channel.flush_handle.cancel()
+            channel.flush_handle = None
+        if not channel.pending:
+            return
+        _, frame = channel.take_frame()
+        for subscriber in list(channel.subscribers):
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Don't let one slow browser hold up the others; it can reconnect with an offset
+                self.disconnect(deployment_id, subscriber)
+                asyncio.create_task(self._close_slow(subscriber))
+
+    async def _close_slow(self, subscriber: Subscriber):
+        try:
+            await subscriber.websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        except Exception:
+            pass
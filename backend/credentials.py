@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+import time
+from io import StringIO
+from typing import Dict, Optional, Tuple
+import paramiko
+import models
+
+# Seconds decrypted credentials and parsed private keys are kept in memory
+CREDENTIAL_CACHE_TTL = int(os.getenv("CREDENTIAL_CACHE_TTL", "300"))
+
+# Tried in order when parsing a private key; DSSKey is gone from newer paramiko releases
+KEY_TYPES = tuple(
+    key_type for key_type in (
+        getattr(paramiko, name, None) for name in ("Ed25519Key", "ECDSAKey", "RSAKey", "DSSKey")
+    )
+    if key_type is not None
+)
+
+def load_private_key(content: str) -> paramiko.PKey:
+    """Parse a PEM or OpenSSH private key of any type paramiko supports"""
+    errors = []
+    for key_type in KEY_TYPES:
+        try:
+            return key_type.from_private_key(StringIO(content))
+        except paramiko.SSHException as e:
+            errors.append(f"{key_type.__name__}: {e}")
+    raise paramiko.SSHException("Unsupported or invalid private key (" + "; ".join(errors) + ")")
+
+def _zero(buffer: Optional[bytearray]):
+    if buffer is not None:
+        buffer[:] = bytes(len(buffer))
+
+class Credentials:
+    """Decrypted login for one server. The password stays in a bytearray so eviction can wipe it."""
+
+    def __init__(self, username: str, password: Optional[bytearray], pkey: Optional[paramiko.PKey]):
+        self.username = username
+        self._password = password
+        self.pkey = pkey
+
+    def login(self) -> Tuple[str, Optional[str], Optional[paramiko.PKey]]:
+        password = self._password.decode() if self._password is not None else None
+        return self.username, password, self.pkey
+
+    def wipe(self):
+        """Overwrite the decrypted password and drop the parsed key"""
+        _zero(self._password)
+        self._password = None
+        self.pkey = None
+
+class CredentialCache:
+    """
+    Decrypted passwords and parsed private keys by server, so a deployment
+    decrypts and parses each server's key once instead of once per connection.
+    Entries expire after the TTL and are dropped as soon as the stored
+    credentials change. Copies already handed to paramiko or pywinrm cannot
+    be wiped; the cache only guarantees its own buffers are zeroed.
+    """
+
+    def __init__(self, ttl: int = CREDENTIAL_CACHE_TTL):
+        self.ttl = ttl
+        # server id -> (fingerprint of the encrypted fields, expires_at, credentials)
+        self._entries: Dict[int, Tuple[str, float, Credentials]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(server: models.Server) -> str:
+        return hashlib.sha256(
+            f"{server.username}\0{server.password or ''}\0{server.ssh_key_content or ''}".encode()
+        ).hexdigest()
+
+    @staticmethod
+    def _load(server: models.Server) -> Credentials:
+        # crud imports this module to invalidate it
+        import crud
+
+        password = bytearray(crud.cipher.decrypt(server.password.encode())) if server.password else None
+        pkey = None
+        if server.ssh_key_content:
+            key_content = bytearray(crud.cipher.decrypt(server.ssh_key_content.encode()))
+            try:
+                pkey = load_private_key(key_content.decode())
+            finally:
+                _zero(key_content)
+        return Credentials(server.username, password, pkey)
+
+    def get(self, server: models.Server) -> Tuple[str, Optional[str], Optional[paramiko.PKey]]:
+        """(username, password, private key) for a server, decrypting and parsing them on a miss"""
+        fingerprint = self.fingerprint(server)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(server.id)
+            if entry is not None and entry[0] == fingerprint:
+                return entry[2].login()
+
+        credentials = self._load(server)
+        with self._lock:
+            stale = self._entries.get(server.id)
+            self._entries[server.id] = (fingerprint, now + self.ttl, credentials)
+            # Read under the lock so a concurrent eviction cannot wipe it first
+            login = credentials.login()
+        if stale is not None:
+            stale[2].wipe()
+        return login
+
+    def _expire(self, now: float):
+        for server_id in [server_id for server_id, entry in self._entries.items() if entry[1] <= now]:
+            self._entries.pop(server_id)[2].wipe()
+
+    def evict(self, server_id: int):
+        """Forget a server's credentials (e.g. after they change or the server is deleted)"""
+        with self._lock:
+            entry = self._entries.pop(server_id, None)
+        if entry is not None:
+            entry[2].wipe()
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry[2].wipe()
+
+credential_cache = CredentialCache()
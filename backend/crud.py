@@ -1,9 +1,15 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import bindparam, func, insert, select, tuple_
+from sqlalchemy.orm import Session, selectinload
+from typing import Dict, List, Optional, Tuple
 import models
 import schemas
+import stats
+from credentials import credential_cache
+from scheduler import DependencyCycle, plan_waves, topological_order
 from cryptography.fernet import Fernet
 import os
+import base64
+from datetime import datetime
 
 # Simple encryption key (in production, use env variable)
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", Fernet.generate_key())
@@ -18,16 +24,67 @@ def decrypt_password(encrypted_password: str) -> str:
     return cipher.decrypt(encrypted_password.encode()).decode()
 
 # Application CRUD
+APPLICATION_DEPENDENCIES = selectinload(models.Application.dependencies)
+
 def get_applications(db: Session, skip: int = 0, limit: int = 100) -> List[models.Application]:
-    return db.query(models.Application).offset(skip).limit(limit).all()
+    return db.query(models.Application).options(APPLICATION_DEPENDENCIES).offset(skip).limit(limit).all()
 
 def get_application(db: Session, application_id: int) -> Optional[models.Application]:
     return db.query(models.Application).filter(models.Application.id == application_id).first()
 
+def get_application_dependencies(db: Session, application_ids: Optional[List[int]] = None) -> Dict[int, List[int]]:
+    """Application id -> ids of the applications it depends on"""
+    query = select(models.application_dependencies)
+    if application_ids is not None:
+        query = query.where(models.application_dependencies.c.application_id.in_(application_ids))
+    dependencies = {}
+    for application_id, depends_on_id in db.execute(query):
+        dependencies.setdefault(application_id, []).append(depends_on_id)
+    return dependencies
+
+def _set_dependencies(db: Session, db_application: models.Application, dependency_ids: List[int]):
+    """
+    Replace an application's dependencies. Raises ValueError for unknown ids, cycles, or
+    dependencies or dependents targeting another OS type.
+    """
+    dependencies = db.query(models.Application).filter(models.Application.id.in_(dependency_ids)).all()
+    missing = set(dependency_ids) - {dependency.id for dependency in dependencies}
+    if missing:
+        raise ValueError(f"Unknown dependency application ids: {sorted(missing)}")
+    for dependency in dependencies:
+        if dependency.os_type != db_application.os_type:
+            raise ValueError(f"{db_application.name} and its dependency {dependency.name} target different OS types")
+    for dependent in db_application.dependents:
+        if dependent.os_type != db_application.os_type:
+            raise ValueError(f"{db_application.name} and its dependent {dependent.name} target different OS types")
+
+    graph = get_application_dependencies(db)
+    graph[db_application.id] = list(dependency_ids)
+    try:
+        topological_order(graph, graph)
+    except DependencyCycle as e:
+        raise ValueError(_cycle_message(db, e.cycle, {db_application.id: db_application.name}))
+    db_application.dependencies = dependencies
+
+def _cycle_message(db: Session, cycle: List[int], names: Optional[Dict[int, str]] = None) -> str:
+    names = {**dict(db.query(models.Application.id, models.Application.name).filter(
+        models.Application.id.in_(cycle)
+    ).all()), **(names or {})}
+    return "Dependency cycle: " + " -> ".join(names[node] for node in cycle)
+
 def create_application(db: Session, application: schemas.ApplicationCreate) -> models.Application:
-    db_application = models.Application(**application.model_dump())
+    db_application = models.Application(**application.model_dump(exclude={"dependency_ids"}))
     db.add(db_application)
+    if application.dependency_ids:
+        db.flush()
+        try:
+            _set_dependencies(db, db_application, application.dependency_ids)
+        except ValueError:
+            db.rollback()
+            raise
+    stats.bump(db, stats.APPLICATIONS)
     db.commit()
+    stats.dashboard_cache.invalidate()
     db.refresh(db_application)
     return db_application
 
@@ -35,8 +92,18 @@ def update_application(db: Session, application_id: int, application: schemas.Ap
     db_application = get_application(db, application_id)
     if db_application:
         update_data = application.model_dump(exclude_unset=True)
+        dependency_ids = update_data.pop("dependency_ids", None)
+        if dependency_ids is None and "os_type" in update_data:
+            # Check the existing links against the new OS type
+            dependency_ids = db_application.dependency_ids
         for key, value in update_data.items():
             setattr(db_application, key, value)
+        if dependency_ids is not None:
+            try:
+                _set_dependencies(db, db_application, dependency_ids)
+            except ValueError:
+                db.rollback()
+                raise
         db.commit()
         db.refresh(db_application)
     return db_application
@@ -45,7 +112,9 @@ def delete_application(db: Session, application_id: int) -> bool:
     db_application = get_application(db, application_id)
     if db_application:
         db.delete(db_application)
+        stats.bump(db, stats.APPLICATIONS, -1)
         db.commit()
+        stats.dashboard_cache.invalidate()
         return True
     return False
 
@@ -53,6 +122,13 @@ def delete_application(db: Session, application_id: int) -> bool:
 def get_servers(db: Session, skip: int = 0, limit: int = 100) -> List[models.Server]:
     return db.query(models.Server).offset(skip).limit(limit).all()
 
+def get_servers_by_ids(db: Session, server_ids: Optional[List[int]] = None) -> List[models.Server]:
+    """The given servers, or every server when server_ids is None"""
+    query = db.query(models.Server)
+    if server_ids is not None:
+        query = query.filter(models.Server.id.in_(server_ids))
+    return query.order_by(models.Server.id).all()
+
 def get_server(db: Session, server_id: int) -> Optional[models.Server]:
     return db.query(models.Server).filter(models.Server.id == server_id).first()
 
@@ -68,7 +144,9 @@ def create_server(db: Session, server: schemas.ServerCreate) -> models.Server:
     
     db_server = models.Server(**server_data)
     db.add(db_server)
+    stats.bump(db, stats.SERVERS)
     db.commit()
+    stats.dashboard_cache.invalidate()
     db.refresh(db_server)
     return db_server
 
@@ -88,26 +166,112 @@ def update_server(db: Session, server_id: int, server: schemas.ServerUpdate) ->
             setattr(db_server, key, value)
         db.commit()
         db.refresh(db_server)
+        if update_data.keys() & {"username", "password", "ssh_key_content"}:
+            credential_cache.evict(server_id)
     return db_server
 
 def delete_server(db: Session, server_id: int) -> bool:
     db_server = get_server(db, server_id)
     if db_server:
         db.delete(db_server)
+        stats.bump(db, stats.SERVERS, -1)
         db.commit()
+        stats.dashboard_cache.invalidate()
+        credential_cache.evict(server_id)
         return True
     return False
 
 # Deployment CRUD
-def get_deployments(db: Session, skip: int = 0, limit: int = 100) -> List[models.Deployment]:
-    return db.query(models.Deployment).offset(skip).limit(limit).order_by(models.Deployment.started_at.desc()).all()
+# Load targets with one extra query per relationship instead of one per deployment
+DEPLOYMENT_TARGETS = (
+    selectinload(models.Deployment.applications).selectinload(models.Application.dependencies),
+    selectinload(models.Deployment.servers),
+)
+
+def encode_deployment_cursor(started_at: datetime, deployment_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{started_at.isoformat()}|{deployment_id}".encode()).decode()
+
+def decode_deployment_cursor(cursor: str) -> tuple:
+    """Raises ValueError for a malformed cursor"""
+    try:
+        started_at, deployment_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(started_at), int(deployment_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
 
-def get_deployment(db: Session, deployment_id: int) -> Optional[models.Deployment]:
-    return db.query(models.Deployment).filter(models.Deployment.id == deployment_id).first()
+def get_deployment_summaries(db: Session, limit: int = 50, cursor: Optional[str] = None) -> schemas.DeploymentPage:
+    """Newest-first page of deployments, keyset-paginated on (started_at, id)"""
+    deployment = models.Deployment
+    application_count = select(func.count()).where(
+        models.deployment_applications.c.deployment_id == deployment.id
+    ).scalar_subquery()
+    server_count = select(func.count()).where(
+        models.deployment_servers.c.deployment_id == deployment.id
+    ).scalar_subquery()
 
-def create_deployment(db: Session, deployment: schemas.DeploymentCreate) -> models.Deployment:
+    query = db.query(
+        deployment.id,
+        deployment.status,
+        deployment.started_at,
+        deployment.completed_at,
+        deployment.error_message,
+        application_count.label("application_count"),
+        server_count.label("server_count")
+    )
+    if cursor:
+        query = query.filter(tuple_(deployment.started_at, deployment.id) < tuple_(*decode_deployment_cursor(cursor)))
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(deployment.started_at.desc(), deployment.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_deployment_cursor(rows[-1].started_at, rows[-1].id)
+    return schemas.DeploymentPage(
+        items=[schemas.DeploymentSummary.model_validate(row) for row in rows],
+        next_cursor=next_cursor
+    )
+
+def get_deployment(db: Session, deployment_id: int, with_targets: bool = False) -> Optional[models.Deployment]:
+    query = db.query(models.Deployment)
+    if with_targets:
+        query = query.options(*DEPLOYMENT_TARGETS)
+    return query.filter(models.Deployment.id == deployment_id).first()
+
+def get_detached_deployment_targets(db: Session, deployment_id: int) -> tuple:
+    """
+    Load a deployment's servers, applications, max_parallel and max_retries.
+    Targets are detached so executor threads can read them while the session keeps committing.
+    """
+    db_deployment = get_deployment(db, deployment_id, with_targets=True)
+    servers = list(db_deployment.servers)
+    applications = list(db_deployment.applications)
+    for target in servers + applications:
+        db.expunge(target)
+    return servers, applications, db_deployment.max_parallel, db_deployment.max_retries
+
+def create_deployment(
+    db: Session,
+    deployment: schemas.DeploymentCreate,
+    pairs: Optional[List[Tuple[int, int]]] = None,
+    retry_of_id: Optional[int] = None
+) -> models.Deployment:
+    """
+    Create a deployment and one job row per (server_id, application_id) pair.
+    Without pairs every server gets every application. Each job records which of its
+    server's applications it depends on. Raises ValueError on a dependency cycle.
+    """
     # Create deployment
-    db_deployment = models.Deployment()
+    db_deployment = models.Deployment(
+        max_parallel=deployment.max_parallel,
+        max_retries=deployment.max_retries,
+        retry_of_id=retry_of_id,
+        strategy=deployment.strategy,
+        batch_size=deployment.batch_size,
+        batch_percent=deployment.batch_percent,
+        max_failures=deployment.max_failures,
+        current_wave=0
+    )
     
     # Add applications
     applications = db.query(models.Application).filter(
@@ -121,10 +285,178 @@ def create_deployment(db: Session, deployment: schemas.DeploymentCreate) -> mode
     ).all()
     db_deployment.servers = servers
     
+    # Queue the jobs; on each server an application runs after the ones it depends on
+    if pairs is None:
+        pairs = [(server.id, application.id) for server in servers for application in applications]
+    else:
+        # Drop pairs whose server or application has been deleted since
+        server_ids = {server.id for server in servers}
+        application_ids = {application.id for application in applications}
+        pairs = [pair for pair in pairs if pair[0] in server_ids and pair[1] in application_ids]
+    # An application only ever runs on servers of its OS, so other pairs get no job
+    server_os = {server.id: server.os_type for server in servers}
+    application_os = {application.id: application.os_type for application in applications}
+    candidates = pairs
+    pairs = [pair for pair in pairs if server_os[pair[0]] == application_os[pair[1]]]
+    if candidates and not pairs:
+        raise ValueError("None of the selected applications are for the OS of the selected servers")
+    server_applications: Dict[int, List[int]] = {}
+    for server_id, application_id in pairs:
+        server_applications.setdefault(server_id, []).append(application_id)
+    dependencies = get_application_dependencies(db, [application.id for application in applications])
+    try:
+        lanes = {
+            server_id: topological_order(application_ids, dependencies)
+            for server_id, application_ids in server_applications.items()
+        }
+    except DependencyCycle as e:
+        raise ValueError(_cycle_message(db, e.cycle))
+    waves = plan_waves(list(lanes), deployment.strategy, deployment.batch_size, deployment.batch_percent)
+    
     db.add(db_deployment)
+    db.flush()
+    
+    jobs = []
+    for server_id, application_ids in lanes.items():
+        for position, application_id in enumerate(application_ids):
+            jobs.append({
+                "deployment_id": db_deployment.id,
+                "server_id": server_id,
+                "application_id": application_id,
+                "position": position,
+                "wave": waves[server_id],
+                "depends_on": sorted(set(dependencies.get(application_id, ())) & set(application_ids)) or None,
+                "status": models.JobStatus.QUEUED,
+                "attempts": 0,
+                "created_at": datetime.utcnow()
+            })
+    if jobs:
+        db.execute(insert(models.DeploymentJob), jobs)
+    
+    stats.record_transition(db, None, models.DeploymentStatus.PENDING)
     db.commit()
-    db.refresh(db_deployment)
-    return db_deployment
+    stats.dashboard_cache.invalidate()
+    # Reload with targets so serializing the response doesn't lazy-load them
+    return get_deployment(db, db_deployment.id, with_targets=True)
+
+def create_retry_deployment(db: Session, deployment_id: int) -> Optional[models.Deployment]:
+    """
+    Create a deployment that re-runs only the failed and skipped jobs of a finished one.
+    A job skipped because a prerequisite did not succeed is only retried along with that
+    prerequisite, and jobs for another OS (from before those stopped being created) never
+    are. Returns None when there is nothing to retry.
+    """
+    db_deployment = get_deployment(db, deployment_id)
+    jobs = get_deployment_results(db, deployment_id)
+    statuses = {(job.server_id, job.application_id): job.status for job in jobs}
+    server_os = dict(db.query(models.Server.id, models.Server.os_type).filter(
+        models.Server.id.in_({job.server_id for job in jobs})
+    ).all())
+    application_os = dict(db.query(models.Application.id, models.Application.os_type).filter(
+        models.Application.id.in_({job.application_id for job in jobs})
+    ).all())
+    retryable = [
+        job for job in jobs
+        if job.status in (models.JobStatus.FAILED, models.JobStatus.SKIPPED)
+        and job.server_id in server_os and job.application_id in application_os
+        and server_os[job.server_id] == application_os[job.application_id]
+    ]
+    
+    retried = set()
+    changed = True
+    while changed:
+        changed = False
+        for job in retryable:
+            pair = (job.server_id, job.application_id)
+            if pair in retried:
+                continue
+            blocking = [
+                (job.server_id, prerequisite) for prerequisite in job.depends_on or ()
+                if statuses.get((job.server_id, prerequisite)) != models.JobStatus.SUCCESS
+            ]
+            if not blocking or any(prerequisite in retried for prerequisite in blocking):
+                retried.add(pair)
+                changed = True
+    pairs = [(job.server_id, job.application_id) for job in retryable if (job.server_id, job.application_id) in retried]
+    if not pairs:
+        return None
+    retry = schemas.DeploymentCreate(
+        server_ids=sorted({server_id for server_id, _ in pairs}),
+        application_ids=sorted({application_id for _, application_id in pairs}),
+        max_parallel=db_deployment.max_parallel,
+        max_retries=db_deployment.max_retries,
+        strategy=db_deployment.strategy or models.DeploymentStrategy.ALL_AT_ONCE,
+        batch_size=db_deployment.batch_size,
+        batch_percent=db_deployment.batch_percent,
+        max_failures=db_deployment.max_failures
+    )
+    return create_deployment(db, retry, pairs=pairs, retry_of_id=deployment_id)
+
+def get_deployment_results(
+    db: Session,
+    deployment_id: int,
+    statuses: Optional[List[models.JobStatus]] = None
+) -> List[models.DeploymentJob]:
+    """Per server x application results, by server and run order"""
+    query = db.query(models.DeploymentJob).filter(models.DeploymentJob.deployment_id == deployment_id)
+    if statuses:
+        query = query.filter(models.DeploymentJob.status.in_(statuses))
+    return query.order_by(models.DeploymentJob.server_id, models.DeploymentJob.position).all()
+
+def _append_log_chunk_statement():
+    """INSERT ... SELECT that allocates the next sequence number in the same statement"""
+    chunks = models.DeploymentLogChunk.__table__
+    next_sequence = select(
+        bindparam("deployment_id"),
+        func.coalesce(func.max(chunks.c.sequence), -1) + 1,
+        bindparam("server_id"),
+        bindparam("application_id"),
+        bindparam("content"),
+        bindparam("created_at", type_=chunks.c.created_at.type)
+    ).where(chunks.c.deployment_id == bindparam("deployment_id"))
+    return insert(chunks).from_select(
+        ["deployment_id", "sequence", "server_id", "application_id", "content", "created_at"],
+        next_sequence
+    )
+
+def append_deployment_log(
+    db: Session,
+    deployment_id: int,
+    content: str,
+    server_id: Optional[int] = None,
+    application_id: Optional[int] = None
+):
+    """Append a log chunk without rewriting earlier output"""
+    append_deployment_logs(db, [{
+        "deployment_id": deployment_id,
+        "server_id": server_id,
+        "application_id": application_id,
+        "content": content,
+        "created_at": datetime.utcnow()
+    }])
+
+def append_deployment_logs(db: Session, entries: List[dict]):
+    """
+    Append many log chunks in one transaction.
+    Each entry has deployment_id, server_id, application_id, content and created_at;
+    entries are stored in list order. Sequence numbers are allocated per row inside
+    the write transaction, so several processes can append to the same deployment.
+    """
+    if not entries:
+        return
+    db.execute(_append_log_chunk_statement(), entries)
+    db.commit()
+
+def get_deployment_log_chunks(
+    db: Session,
+    deployment_id: int,
+    after_sequence: int = -1,
+    limit: int = 1000
+) -> List[models.DeploymentLogChunk]:
+    return db.query(models.DeploymentLogChunk).filter(
+        models.DeploymentLogChunk.deployment_id == deployment_id,
+        models.DeploymentLogChunk.sequence > after_sequence
+    ).order_by(models.DeploymentLogChunk.sequence).limit(limit).all()
 
 def update_deployment_status(
     db: Session, 
@@ -133,41 +465,57 @@ def update_deployment_status(
     logs: str = "",
     error_message: str = None
 ) -> Optional[models.Deployment]:
+    if logs:
+        append_deployment_log(db, deployment_id, logs)
     db_deployment = get_deployment(db, deployment_id)
     if db_deployment:
+        stats.record_transition(db, db_deployment.status, status)
         db_deployment.status = status
-        if logs:
-            db_deployment.logs += logs + "\n"
         if error_message:
             db_deployment.error_message = error_message
         if status in [models.DeploymentStatus.SUCCESS, models.DeploymentStatus.FAILED]:
-            from datetime import datetime
             db_deployment.completed_at = datetime.utcnow()
         db.commit()
+        stats.dashboard_cache.invalidate()
         db.refresh(db_deployment)
     return db_deployment
 
 # Dashboard Stats
 def get_dashboard_stats(db: Session) -> schemas.DashboardStats:
-    total_servers = db.query(models.Server).count()
-    total_applications = db.query(models.Application).count()
-    total_deployments = db.query(models.Deployment).count()
+    # Counters are maintained on every create/delete and status transition, by this
+    # process or a queue worker; their version keys the cached response
+    generation = stats.dashboard_cache.generation
+    counter = models.StatCounter
+    rows = db.query(counter.name, counter.value, counter.version).all()
+    if not rows:
+        stats.ensure_counters(db)
+        rows = db.query(counter.name, counter.value, counter.version).all()
+    version = sum(row.version for row in rows)
+    cached = stats.dashboard_cache.get(version)
+    if cached is not None:
+        return cached
+    counters = {row.name: row.value for row in rows}
+    total_deployments = counters.get(stats.DEPLOYMENTS, 0)
+    deployments_by_status = {
+        status: counters.get(stats.status_counter(status), 0)
+        for status in models.DeploymentStatus
+    }
     
-    recent_deployments = db.query(models.Deployment).order_by(
-        models.Deployment.started_at.desc()
+    recent_deployments = db.query(models.Deployment).options(*DEPLOYMENT_TARGETS).order_by(
+        models.Deployment.started_at.desc(), models.Deployment.id.desc()
     ).limit(5).all()
     
     # Calculate success rate
-    success_count = db.query(models.Deployment).filter(
-        models.Deployment.status == models.DeploymentStatus.SUCCESS
-    ).count()
-    
+    success_count = deployments_by_status[models.DeploymentStatus.SUCCESS]
     success_rate = (success_count / total_deployments * 100) if total_deployments > 0 else 0
     
-    return schemas.DashboardStats(
-        total_servers=total_servers,
-        total_applications=total_applications,
+    dashboard = schemas.DashboardStats(
+        total_servers=counters.get(stats.SERVERS, 0),
+        total_applications=counters.get(stats.APPLICATIONS, 0),
         total_deployments=total_deployments,
+        deployments_by_status=deployments_by_status,
         recent_deployments=recent_deployments,
         success_rate=success_rate
     )
+    stats.dashboard_cache.set(dashboard, generation, version)
+    return dashboard
@@ -1,21 +1,99 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./deploymaster.db"
+# Same database through aiosqlite, for code running on the event loop
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./deploymaster.db"
+
+# WAL lets the API read while deployments write; NORMAL sync is safe with WAL
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
+    SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False}
 )
 
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+class QueryCount:
+    """Number of SQL statements executed inside count_queries()"""
+    def __init__(self):
+        self.count = 0
+
+_query_count: ContextVar[Optional[QueryCount]] = ContextVar("query_count", default=None)
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    query_count = _query_count.get()
+    if query_count is not None:
+        query_count.count += 1
+
+for _sync_engine in (engine, async_engine.sync_engine):
+    event.listen(_sync_engine, "connect", _set_sqlite_pragmas)
+    event.listen(_sync_engine, "before_cursor_execute", _count_query)
+
+@contextmanager
+def count_queries():
+    """Count SQL statements executed in this context (including threads it spawns)"""
+    query_count = QueryCount()
+    token = _query_count.set(query_count)
+    try:
+        yield query_count
+    finally:
+        _query_count.reset(token)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Use AsyncSession.run_sync(crud_function, ...) to run crud code without blocking the loop
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+def ensure_schema():
+    """
+    Create missing tables, and add the columns and indexes introduced since an
+    existing database was created (create_all leaves existing tables as they are).
+    Added columns are nullable; rows already present get the column's default.
+    Import models before calling.
+    """
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                if column.default is not None and column.default.is_scalar:
+                    connection.execute(table.update().values({column.name: column.default.arg}))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
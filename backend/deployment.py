@@ -1,12 +1,75 @@
 import paramiko
-import winrm
-from typing import Callable, Optional
+import requests
+import winrm.exceptions
+from typing import Callable, Dict, List, NamedTuple, Optional
 import asyncio
+import os
+import random
+import socket
+import time
 from concurrent.futures import ThreadPoolExecutor
 import models
-from crud import decrypt_password
+from artifacts import stage_installer
+from batch import BEGIN, END, BatchOutputSplitter, BatchStep, StepEvent, compile_linux_script, compile_windows_script, new_marker
+from scheduler import MAX_PARALLEL_JOBS, prerequisite_failed_message
+from ssh_pool import ssh_pool
+from winrm_pool import winrm_cache
 
-executor = ThreadPoolExecutor(max_workers=10)
+# Default automatic retries after a transient connection error (0 disables)
+DEPLOYMENT_MAX_RETRIES = int(os.getenv("DEPLOYMENT_MAX_RETRIES", "0"))
+# First retry delay in seconds, doubled on every further attempt up to the maximum
+DEPLOYMENT_RETRY_BACKOFF = float(os.getenv("DEPLOYMENT_RETRY_BACKOFF", "2"))
+DEPLOYMENT_RETRY_BACKOFF_MAX = float(os.getenv("DEPLOYMENT_RETRY_BACKOFF_MAX", "60"))
+
+executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_JOBS)
+
+# Connection-level failures that may succeed when tried again
+TRANSIENT_ERRORS = (
+    socket.timeout,
+    ConnectionError,
+    EOFError,
+    paramiko.ssh_exception.NoValidConnectionsError,
+    paramiko.SSHException,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    winrm.exceptions.WinRMOperationTimeoutError,
+)
+
+def is_transient_error(error: Exception) -> bool:
+    """Timeouts, refused/reset connections and SSH protocol hiccups; never authentication or host key errors"""
+    if isinstance(error, (paramiko.AuthenticationException, paramiko.BadHostKeyException)):
+        return False
+    if isinstance(error, winrm.exceptions.WinRMTransportError):
+        return error.code >= 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter before retry number `attempt` (1-based)"""
+    delay = min(DEPLOYMENT_RETRY_BACKOFF_MAX, DEPLOYMENT_RETRY_BACKOFF * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+class ExecutionResult(NamedTuple):
+    """Outcome of one application install on one server"""
+    status: models.JobStatus
+    output: str
+    exit_code: Optional[int] = None
+    duration: float = 0.0
+    attempts: int = 1
+    # Failed on a connection-level error that a later attempt may get past
+    transient: bool = False
+
+    @property
+    def success(self) -> bool:
+        return self.status == models.JobStatus.SUCCESS
+
+# Callbacks of a batch run, by application id
+StepLogger = Callable[[Optional[int]], Callable[[str], None]]
+StepStarter = Callable[[int], bool]
+StepFinisher = Callable[[int, ExecutionResult], None]
+StepSkipper = Callable[[int, str], None]
+
+class BatchAborted(Exception):
+    """A step could not be marked running (lease lost, or skipped after too many failures)"""
 
 class DeploymentExecutor:
     """Handle remote deployments via SSH (Linux) and WinRM (Windows)"""
@@ -16,117 +79,85 @@ class DeploymentExecutor:
         server: models.Server,
         command: str,
         log_callback: Callable[[str], None]
-    ) -> tuple[bool, str]:
+    ) -> ExecutionResult:
         """Execute command on Linux server via SSH"""
         try:
-            # Decrypt password if using password auth
-            password = decrypt_password(server.password) if server.password else None
-            
-            # Create SSH client
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
             log_callback(f"🔌 Connecting to {server.hostname} ({server.ip_address})...\n")
             
-            # Connect with SSH key or password
-            if server.ssh_key_content:
-                # Decrypt and load SSH key from content
-                decrypted_key_content = decrypt_password(server.ssh_key_content)
-                from io import StringIO
-                key_file = StringIO(decrypted_key_content)
-                key = paramiko.RSAKey.from_private_key(key_file)
-                ssh.connect(
-                    hostname=server.ip_address,
-                    port=server.port,
-                    username=server.username,
-                    pkey=key,
-                    timeout=10
-                )
-            else:
-                ssh.connect(
-                    hostname=server.ip_address,
-                    port=server.port,
-                    username=server.username,
-                    password=password,
-                    timeout=10
-                )
-            
-            log_callback(f"✅ Connected successfully!\n")
-            log_callback(f"📦 Executing installation command...\n")
-            log_callback(f"$ {command}\n\n")
-            
-            # Execute command
-            stdin, stdout, stderr = ssh.exec_command(command, get_pty=True)
-            
-            # Stream output
-            full_output = ""
-            while True:
-                line = stdout.readline()
-                if not line:
-                    break
-                log_callback(line)
-                full_output += line
-            
-            # Check exit status
-            exit_status = stdout.channel.recv_exit_status()
-            
-            # Get error output if any
-            error_output = stderr.read().decode('utf-8')
-            if error_output:
-                log_callback(f"\n⚠️  Errors:\n{error_output}\n")
-                full_output += f"\nERROR: {error_output}"
+            # Check out a pooled connection (reused across applications and deployments)
+            ssh, reused = ssh_pool.acquire(server)
+            healthy = False
             
-            ssh.close()
+            try:
+                if reused:
+                    log_callback(f"♻️  Reusing open connection to {server.hostname}\n")
+                else:
+                    log_callback(f"✅ Connected successfully!\n")
+                log_callback(f"📦 Executing installation command...\n")
+                log_callback(f"$ {command}\n\n")
+                
+                # Execute command
+                stdin, stdout, stderr = ssh.exec_command(command, get_pty=True)
+                
+                # Stream output
+                full_output = ""
+                while True:
+                    line = stdout.readline()
+                    if not line:
+                        break
+                    log_callback(line)
+                    full_output += line
+                
+                # Check exit status
+                exit_status = stdout.channel.recv_exit_status()
+                
+                # Get error output if any
+                error_output = stderr.read().decode('utf-8')
+                if error_output:
+                    log_callback(f"\n⚠️  Errors:\n{error_output}\n")
+                    full_output += f"\nERROR: {error_output}"
+                
+                healthy = True
+            finally:
+                ssh_pool.release(server, ssh, healthy)
             
             if exit_status == 0:
                 log_callback(f"\n✅ Installation completed successfully on {server.hostname}!\n")
-                return True, full_output
+                return ExecutionResult(models.JobStatus.SUCCESS, full_output, exit_status)
             else:
                 log_callback(f"\n❌ Installation failed on {server.hostname} (exit code: {exit_status})\n")
-                return False, full_output
+                return ExecutionResult(models.JobStatus.FAILED, full_output, exit_status)
                 
         except paramiko.AuthenticationException:
             error_msg = f"❌ Authentication failed for {server.hostname}"
             log_callback(f"\n{error_msg}\n")
-            return False, error_msg
+            return ExecutionResult(models.JobStatus.FAILED, error_msg)
         except paramiko.SSHException as e:
             error_msg = f"❌ SSH error on {server.hostname}: {str(e)}"
             log_callback(f"\n{error_msg}\n")
-            return False, error_msg
+            return ExecutionResult(models.JobStatus.FAILED, error_msg, transient=is_transient_error(e))
         except Exception as e:
             error_msg = f"❌ Unexpected error on {server.hostname}: {str(e)}"
             log_callback(f"\n{error_msg}\n")
-            return False, error_msg
+            return ExecutionResult(models.JobStatus.FAILED, error_msg, transient=is_transient_error(e))
     
     @staticmethod
     def execute_windows_deployment(
         server: models.Server,
         command: str,
         log_callback: Callable[[str], None]
-    ) -> tuple[bool, str]:
+    ) -> ExecutionResult:
         """Execute command on Windows server via WinRM"""
         try:
-            # Decrypt password
-            password = decrypt_password(server.password) if server.password else None
-            
             log_callback(f"🔌 Connecting to {server.hostname} ({server.ip_address})...\n")
-            
-            # Create WinRM session
-            # Default WinRM ports: 5985 (HTTP), 5986 (HTTPS)
-            port = server.port if server.port != 22 else 5985
-            
-            session = winrm.Session(
-                f'http://{server.ip_address}:{port}/wsman',
-                auth=(server.username, password),
-                transport='ntlm'
-            )
-            
-            log_callback(f"✅ Connected successfully!\n")
             log_callback(f"📦 Executing installation command...\n")
             log_callback(f"PS> {command}\n\n")
             
-            # Execute PowerShell command
-            result = session.run_ps(command)
+            # Execute PowerShell command in the cached shell for this server
+            result, reused = winrm_cache.run_ps(server, command)
+            
+            if reused:
+                log_callback(f"♻️  Reused open shell on {server.hostname}\n")
             
             # Get output
             stdout_output = result.std_out.decode('utf-8')
@@ -143,24 +174,32 @@ class DeploymentExecutor:
             
             if result.status_code == 0:
                 log_callback(f"\n✅ Installation completed successfully on {server.hostname}!\n")
-                return True, full_output
+                return ExecutionResult(models.JobStatus.SUCCESS, full_output, result.status_code)
             else:
                 log_callback(f"\n❌ Installation failed on {server.hostname} (exit code: {result.status_code})\n")
-                return False, full_output
+                return ExecutionResult(models.JobStatus.FAILED, full_output, result.status_code)
                 
         except Exception as e:
             error_msg = f"❌ WinRM error on {server.hostname}: {str(e)}"
             log_callback(f"\n{error_msg}\n")
-            return False, error_msg
+            return ExecutionResult(models.JobStatus.FAILED, error_msg, transient=is_transient_error(e))
     
     @staticmethod
-    async def execute_deployment_async(
+    def execute_deployment(
         server: models.Server,
         application: models.Application,
-        log_callback: Callable[[str], None]
-    ) -> tuple[bool, str]:
-        """Execute deployment asynchronously"""
-        loop = asyncio.get_event_loop()
+        log_callback: Callable[[str], None],
+        max_retries: Optional[int] = None
+    ) -> ExecutionResult:
+        """
+        Execute deployment in the calling thread.
+        Transient connection errors are retried up to max_retries times with exponential backoff.
+        """
+        # Check OS compatibility
+        if server.os_type != application.os_type:
+            log_msg = f"⚠️  Skipping {application.name} on {server.hostname} - OS type mismatch\n"
+            log_callback(log_msg)
+            return ExecutionResult(models.JobStatus.SKIPPED, log_msg)
         
         log_callback(f"\n{'='*60}\n")
         log_callback(f"🚀 Starting deployment: {application.name} v{application.version}\n")
@@ -168,20 +207,288 @@ class DeploymentExecutor:
         log_callback(f"{'='*60}\n\n")
         
         if server.os_type == models.OSType.LINUX:
-            success, output = await loop.run_in_executor(
-                executor,
-                DeploymentExecutor.execute_linux_deployment,
-                server,
-                application.install_command,
-                log_callback
-            )
+            run = DeploymentExecutor.execute_linux_deployment
         else:  # Windows
-            success, output = await loop.run_in_executor(
-                executor,
-                DeploymentExecutor.execute_windows_deployment,
-                server,
-                application.install_command,
-                log_callback
-            )
+            run = DeploymentExecutor.execute_windows_deployment
         
-        return success, output
+        max_retries = DEPLOYMENT_MAX_RETRIES if max_retries is None else max_retries
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                # Push the installer from the controller cache and point the command at it
+                command = stage_installer(server, application, log_callback)
+            except Exception as e:
+                error_msg = f"❌ Could not stage installer on {server.hostname}: {str(e)}"
+                log_callback(f"\n{error_msg}\n")
+                result = ExecutionResult(models.JobStatus.FAILED, error_msg, transient=is_transient_error(e))
+            else:
+                result = run(server, command, log_callback)
+            if not result.transient or attempt > max_retries:
+                return result._replace(duration=time.monotonic() - started, attempts=attempt)
+            delay = retry_delay(attempt)
+            log_callback(f"🔁 Retrying in {delay:.1f}s (attempt {attempt + 1} of {max_retries + 1})...\n")
+            time.sleep(delay)
+            attempt += 1
+    
+    @staticmethod
+    async def execute_deployment_async(
+        server: models.Server,
+        application: models.Application,
+        log_callback: Callable[[str], None],
+        max_retries: Optional[int] = None
+    ) -> ExecutionResult:
+        """Execute deployment asynchronously"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor,
+            DeploymentExecutor.execute_deployment,
+            server,
+            application,
+            log_callback,
+            max_retries
+        )
+
+    @staticmethod
+    def _run_batch_script(
+        server: models.Server,
+        steps: List[BatchStep],
+        succeeded: List[int],
+        log_for: StepLogger,
+        on_event: Callable[[StepEvent], None],
+        outputs: Dict[int, str]
+    ):
+        """
+        Run steps as one remote script, streaming each line to its step's log and
+        `outputs`, and each marker to on_event.
+        """
+        marker = new_marker()
+
+        def on_output(application_id: Optional[int], text: str):
+            log_for(application_id)(text)
+            if application_id is not None:
+                outputs[application_id] = outputs.get(application_id, "") + text
+
+        splitter = BatchOutputSplitter(marker, on_output, on_event)
+        log = log_for(None)
+        log(f"🔌 Connecting to {server.hostname} ({server.ip_address})...\n")
+
+        if server.os_type == models.OSType.WINDOWS:
+            log(f"📦 Running {len(steps)} installation(s) as one PowerShell script...\n")
+            result, reused = winrm_cache.run_ps(server, compile_windows_script(steps, marker, succeeded))
+            if reused:
+                log(f"♻️  Reused open shell on {server.hostname}\n")
+            # WinRM returns the output once the script has finished
+            for line in result.std_out.decode('utf-8').splitlines(keepends=True):
+                splitter.feed(line)
+            splitter.close()
+            stderr_output = result.std_err.decode('utf-8')
+            if stderr_output:
+                log(f"\n⚠️  Errors:\n{stderr_output}\n")
+            return
+
+        ssh, reused = ssh_pool.acquire(server)
+        healthy = False
+        try:
+            log(f"♻️  Reusing open connection to {server.hostname}\n" if reused else "✅ Connected successfully!\n")
+            log(f"📦 Running {len(steps)} installation(s) as one script...\n")
+            stdin, stdout, stderr = ssh.exec_command(
+                compile_linux_script(steps, marker, succeeded), get_pty=True
+            )
+            try:
+                while True:
+                    line = stdout.readline()
+                    if not line:
+                        break
+                    splitter.feed(line)
+                splitter.close()
+                stdout.channel.recv_exit_status()
+                # Without a PTY on the server side stderr is not merged into the output
+                error_output = stderr.read().decode('utf-8')
+                if error_output:
+                    log(f"\n⚠️  Errors:\n{error_output}\n")
+            finally:
+                # Closing the channel ends the script if a step was aborted
+                stdout.channel.close()
+            healthy = True
+        except BatchAborted:
+            healthy = True
+            raise
+        finally:
+            ssh_pool.release(server, ssh, healthy)
+
+    @staticmethod
+    def execute_batch(
+        server: models.Server,
+        applications: List[models.Application],
+        depends_on: Dict[int, List[int]],
+        log_for: StepLogger,
+        on_start: StepStarter,
+        on_finish: StepFinisher,
+        on_skip: StepSkipper,
+        max_retries: Optional[int] = None
+    ) -> Dict[int, ExecutionResult]:
+        """
+        Install every application on one server with a single remote script
+        (one round trip per host instead of one per application).
+        `applications` must be in dependency order; `depends_on` maps application
+        id -> prerequisites on this server. log_for(application_id) returns the log
+        callback of a step (None for the server as a whole). on_start is called as
+        each step begins and stops the batch if it returns False; on_finish gets each
+        step's result and on_skip each step skipped because a prerequisite did not
+        succeed. Transient connection errors rerun the unfinished steps up to
+        max_retries times. Returns application id -> result.
+        """
+        by_id = {application.id: application for application in applications}
+        results: Dict[int, ExecutionResult] = {}
+        # Steps announced in the log / marked running by an earlier attempt
+        announced, running = set(), set()
+        max_retries = DEPLOYMENT_MAX_RETRIES if max_retries is None else max_retries
+
+        def finish(application_id: int, result: ExecutionResult):
+            results[application_id] = result
+            on_finish(application_id, result)
+
+        def announce(application: models.Application):
+            if application.id in announced:
+                return
+            announced.add(application.id)
+            log = log_for(application.id)
+            log(f"\n{'='*60}\n")
+            log(f"🚀 Starting deployment: {application.name} v{application.version}\n")
+            log(f"🖥️  Target: {server.hostname} ({server.os_type.value})\n")
+            log(f"{'='*60}\n\n")
+
+        def skip(application: models.Application, prerequisite_id: int):
+            reason = prerequisite_failed_message(server, application, by_id[prerequisite_id].name)
+            results[application.id] = ExecutionResult(models.JobStatus.SKIPPED, reason)
+            on_skip(application.id, reason)
+
+        for application in applications:
+            if server.os_type != application.os_type:
+                # Started then skipped, as execute_deployment records it (one attempt)
+                if not on_start(application.id):
+                    return results
+                running.add(application.id)
+                log_msg = f"⚠️  Skipping {application.name} on {server.hostname} - OS type mismatch\n"
+                log_for(application.id)(log_msg)
+                finish(application.id, ExecutionResult(models.JobStatus.SKIPPED, log_msg))
+
+        attempt = 1
+        while True:
+            retrying = False
+            final = attempt > max_retries
+            steps: List[BatchStep] = []
+            for application in applications:
+                if application.id in results:
+                    continue
+                prerequisites = [
+                    prerequisite for prerequisite in depends_on.get(application.id, ()) if prerequisite in by_id
+                ]
+                failed_prerequisite = next(
+                    (prerequisite for prerequisite in prerequisites
+                     if prerequisite in results and not results[prerequisite].success),
+                    None
+                )
+                if failed_prerequisite is not None:
+                    skip(application, failed_prerequisite)
+                    continue
+                batched = {step.application_id for step in steps}
+                if any(prerequisite not in results and prerequisite not in batched for prerequisite in prerequisites):
+                    # Waits for a prerequisite that will be retried
+                    continue
+
+                log = log_for(application.id)
+                try:
+                    # Push the installer from the controller cache and point the command at it
+                    command = stage_installer(server, application, log)
+                except Exception as e:
+                    error_msg = f"❌ Could not stage installer on {server.hostname}: {str(e)}"
+                    announce(application)
+                    log(f"\n{error_msg}\n")
+                    transient = is_transient_error(e)
+                    if transient and not final:
+                        retrying = True
+                    else:
+                        finish(application.id, ExecutionResult(
+                            models.JobStatus.FAILED, error_msg, transient=transient, attempts=attempt
+                        ))
+                    continue
+                steps.append(BatchStep(
+                    application.id, command, [prerequisite for prerequisite in prerequisites if prerequisite in batched]
+                ))
+
+            if steps:
+                commands = {step.application_id: step.command for step in steps}
+                succeeded = [application_id for application_id, result in results.items() if result.success]
+                started: Dict[int, float] = {}
+                outputs: Dict[int, str] = {}
+                done = set()
+
+                def on_event(event: StepEvent):
+                    application_id = event.application_id
+                    if event.kind == BEGIN:
+                        if application_id not in running:
+                            if not on_start(application_id):
+                                raise BatchAborted()
+                            running.add(application_id)
+                        started[application_id] = time.monotonic()
+                        announce(by_id[application_id])
+                        log_for(application_id)(f"$ {commands[application_id]}\n\n")
+                    elif event.kind == END:
+                        done.add(application_id)
+                        exit_status = event.value
+                        log = log_for(application_id)
+                        output = outputs.get(application_id, "")
+                        duration = time.monotonic() - started.get(application_id, time.monotonic())
+                        if exit_status == 0:
+                            log(f"\n✅ Installation completed successfully on {server.hostname}!\n")
+                            status = models.JobStatus.SUCCESS
+                        else:
+                            log(f"\n❌ Installation failed on {server.hostname} (exit code: {exit_status})\n")
+                            status = models.JobStatus.FAILED
+                        finish(application_id, ExecutionResult(status, output, exit_status, duration, attempt))
+                    else:
+                        done.add(application_id)
+                        skip(by_id[application_id], event.value)
+
+                error_msg, transient = None, False
+                try:
+                    DeploymentExecutor._run_batch_script(server, steps, succeeded, log_for, on_event, outputs)
+                except BatchAborted:
+                    return results
+                except paramiko.AuthenticationException:
+                    error_msg = f"❌ Authentication failed for {server.hostname}"
+                except Exception as e:
+                    error_msg = f"❌ Error running batch on {server.hostname}: {str(e)}"
+                    transient = is_transient_error(e)
+
+                unfinished = [step.application_id for step in steps if step.application_id not in done]
+                if unfinished and error_msg is None:
+                    error_msg = f"❌ Batch script on {server.hostname} ended before every step finished"
+                if error_msg is not None:
+                    log_for(None)(f"\n{error_msg}\n")
+                if transient and not final and unfinished:
+                    retrying = True
+                else:
+                    for application_id in unfinished:
+                        finish(application_id, ExecutionResult(
+                            models.JobStatus.FAILED, outputs.get(application_id, "") + error_msg,
+                            transient=transient, attempts=attempt
+                        ))
+
+            if not retrying:
+                return results
+            delay = retry_delay(attempt)
+            log_for(None)(f"🔁 Retrying unfinished installations in {delay:.1f}s (attempt {attempt + 1} of {max_retries + 1})...\n")
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    async def execute_batch_async(*args, **kwargs) -> Dict[int, ExecutionResult]:
+        """Execute a batch in the deployment executor"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor,
+            lambda: DeploymentExecutor.execute_batch(*args, **kwargs)
+        )
@@ -0,0 +1,351 @@
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import exists, func, select, update
+from sqlalchemy.orm import Session, aliased
+import models
+import stats
+from log_writer import log_writer
+from scheduler import DEPLOYMENT_PARALLELISM
+
+# "inline" runs deployments inside the API process, "queue" leaves them to worker.py processes
+DEPLOYMENT_EXECUTION = os.getenv("DEPLOYMENT_EXECUTION", "inline")
+# How long a worker's claim on a server lane lasts without a heartbeat (seconds)
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+Job = models.DeploymentJob
+ACTIVE_JOB_STATUSES = (models.JobStatus.QUEUED, models.JobStatus.RUNNING)
+# Output of jobs skipped because the pre-flight probe could not reach their server
+UNREACHABLE_REASON = "Skipped: server unreachable"
+
+def _lease_deadline() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+def enqueue_deployment(db: Session, deployment_id: int) -> int:
+    """Mark a deployment running so workers pick up its jobs. Returns the job count."""
+    import crud
+
+    crud.update_deployment_status(db, deployment_id, models.DeploymentStatus.RUNNING)
+    job_count, last_wave = db.query(func.count(Job.id), func.max(Job.wave)).filter(
+        Job.deployment_id == deployment_id
+    ).one()
+    if not job_count:
+        finalize_deployment(db, deployment_id)
+    elif last_wave:
+        log_writer.write(deployment_id, f"\n🌊 Starting wave 1 of {last_wave + 1}\n")
+    return job_count
+
+def claim_deployment(db: Session, deployment_id: int, worker_id: str) -> List[models.DeploymentJob]:
+    """Claim every queued job of a deployment without a lease, for running it inside the API process"""
+    db.execute(
+        update(Job)
+        .where(Job.deployment_id == deployment_id, Job.status == models.JobStatus.QUEUED, Job.claimed_by.is_(None))
+        .values(claimed_by=worker_id)
+    )
+    db.commit()
+    return db.query(Job).filter(
+        Job.deployment_id == deployment_id,
+        Job.claimed_by == worker_id,
+        Job.status == models.JobStatus.QUEUED
+    ).order_by(Job.server_id, Job.position).all()
+
+def requeue_expired_leases(db: Session) -> int:
+    """Return lanes of workers that stopped heartbeating to the queue"""
+    result = db.execute(
+        update(Job)
+        .where(Job.claimed_by.isnot(None), Job.status.in_(ACTIVE_JOB_STATUSES), Job.lease_expires_at < datetime.utcnow())
+        .values(status=models.JobStatus.QUEUED, claimed_by=None, lease_expires_at=None)
+    )
+    db.commit()
+    return result.rowcount
+
+def claim_lane(db: Session, worker_id: str) -> Optional[Tuple[int, int]]:
+    """
+    Claim every queued job of one (deployment, server) lane for a worker.
+    Respects each deployment's max_parallel. Returns (deployment_id, server_id) or None.
+    """
+    requeue_expired_leases(db)
+
+    candidates = db.execute(
+        select(Job.deployment_id, Job.server_id)
+        .join(models.Deployment, models.Deployment.id == Job.deployment_id)
+        # Pending deployments are still being prepared (e.g. installers relayed to targets),
+        # and servers of later rollout waves wait until their wave starts
+        .where(
+            Job.status == models.JobStatus.QUEUED,
+            Job.claimed_by.is_(None),
+            models.Deployment.status == models.DeploymentStatus.RUNNING,
+            Job.wave == models.Deployment.current_wave
+        )
+        .group_by(Job.deployment_id, Job.server_id)
+        .order_by(func.min(Job.id))
+        .limit(20)
+    ).all()
+
+    other = aliased(Job)
+    for deployment_id, server_id in candidates:
+        max_parallel = db.query(models.Deployment.max_parallel).filter(
+            models.Deployment.id == deployment_id
+        ).scalar() or DEPLOYMENT_PARALLELISM
+        claimed_lanes = select(func.count(func.distinct(other.server_id))).where(
+            other.deployment_id == deployment_id,
+            other.claimed_by.isnot(None),
+            other.status.in_(ACTIVE_JOB_STATUSES)
+        ).scalar_subquery()
+        lane_taken = exists().where(
+            other.deployment_id == deployment_id,
+            other.server_id == server_id,
+            other.claimed_by.isnot(None),
+            other.status.in_(ACTIVE_JOB_STATUSES)
+        )
+        # One statement, so concurrent workers can't both take the lane or exceed max_parallel
+        result = db.execute(
+            update(Job)
+            .where(
+                Job.deployment_id == deployment_id,
+                Job.server_id == server_id,
+                Job.status == models.JobStatus.QUEUED,
+                Job.claimed_by.is_(None),
+                ~lane_taken,
+                claimed_lanes < max_parallel
+            )
+            .values(claimed_by=worker_id, lease_expires_at=_lease_deadline())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if result.rowcount:
+            return deployment_id, server_id
+    return None
+
+def get_lane_jobs(db: Session, worker_id: str, deployment_id: int, server_id: int) -> List[models.DeploymentJob]:
+    return db.query(Job).filter(
+        Job.deployment_id == deployment_id,
+        Job.server_id == server_id,
+        Job.claimed_by == worker_id,
+        Job.status == models.JobStatus.QUEUED
+    ).order_by(Job.position).all()
+
+def get_lane_outcomes(db: Session, deployment_id: int, server_id: int) -> Dict[int, bool]:
+    """Application id -> whether it succeeded, for a lane's finished jobs (e.g. by a worker that died since)"""
+    rows = db.query(Job.application_id, Job.status).filter(
+        Job.deployment_id == deployment_id,
+        Job.server_id == server_id,
+        Job.status.notin_(ACTIVE_JOB_STATUSES)
+    )
+    return {application_id: status == models.JobStatus.SUCCESS for application_id, status in rows}
+
+def renew_leases(db: Session, worker_id: str) -> int:
+    """Heartbeat: extend the lease on every lane a worker holds"""
+    result = db.execute(
+        update(Job)
+        .where(Job.claimed_by == worker_id, Job.status.in_(ACTIVE_JOB_STATUSES))
+        .values(lease_expires_at=_lease_deadline())
+    )
+    db.commit()
+    return result.rowcount
+
+def release_lane(db: Session, worker_id: str, deployment_id: int, server_id: int):
+    """Give the unstarted jobs of a lane back to the queue"""
+    db.execute(
+        update(Job)
+        .where(
+            Job.deployment_id == deployment_id,
+            Job.server_id == server_id,
+            Job.claimed_by == worker_id,
+            Job.status == models.JobStatus.QUEUED
+        )
+        .values(claimed_by=None, lease_expires_at=None)
+    )
+    db.commit()
+
+def skip_server_jobs(db: Session, deployment_id: int, server_ids: List[int], reason: str) -> int:
+    """Skip the queued jobs of servers that won't be deployed to (e.g. unreachable). Returns the job count."""
+    if not server_ids:
+        return 0
+    result = db.execute(
+        update(Job)
+        .where(
+            Job.deployment_id == deployment_id,
+            Job.server_id.in_(server_ids),
+            Job.status == models.JobStatus.QUEUED
+        )
+        .values(status=models.JobStatus.SKIPPED, output=reason, finished_at=datetime.utcnow(), lease_expires_at=None)
+    )
+    db.commit()
+    return result.rowcount
+
+def start_job(db: Session, job_id: int, worker_id: str) -> bool:
+    """Mark a claimed job running. False if the worker no longer holds it."""
+    result = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.claimed_by == worker_id, Job.status == models.JobStatus.QUEUED)
+        .values(
+            status=models.JobStatus.RUNNING,
+            started_at=datetime.utcnow(),
+            attempts=Job.attempts + 1
+        )
+    )
+    db.commit()
+    return bool(result.rowcount)
+
+def finish_job(
+    db: Session,
+    job_id: int,
+    worker_id: str,
+    status: models.JobStatus,
+    output: str = "",
+    exit_code: Optional[int] = None,
+    duration: Optional[float] = None,
+    retries: int = 0
+) -> bool:
+    """Record a job's outcome. False if the worker no longer holds it."""
+    result = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.claimed_by == worker_id, Job.status.in_(ACTIVE_JOB_STATUSES))
+        .values(
+            status=status,
+            output=output,
+            exit_code=exit_code,
+            duration=duration,
+            attempts=Job.attempts + retries,
+            finished_at=datetime.utcnow(),
+            lease_expires_at=None
+        )
+    )
+    db.commit()
+    return bool(result.rowcount)
+
+def _failed_servers(db: Session, deployment_id: int) -> int:
+    return db.query(func.count(func.distinct(Job.server_id))).filter(
+        Job.deployment_id == deployment_id,
+        Job.status == models.JobStatus.FAILED
+    ).scalar()
+
+def check_failure_threshold(
+    db: Session,
+    deployment_id: int,
+    log_callback: Optional[Callable[[str], None]] = None
+) -> bool:
+    """
+    Skip every job that hasn't started once more servers failed than the deployment's
+    max_failures allows. Returns True if the deployment is (now) over its threshold.
+    """
+    max_failures = db.query(models.Deployment.max_failures).filter(
+        models.Deployment.id == deployment_id
+    ).scalar()
+    if max_failures is None:
+        return False
+    failed_servers = _failed_servers(db, deployment_id)
+    if failed_servers <= max_failures:
+        return False
+
+    result = db.execute(
+        update(Job)
+        .where(Job.deployment_id == deployment_id, Job.status == models.JobStatus.QUEUED)
+        .values(
+            status=models.JobStatus.SKIPPED,
+            output=f"Skipped: {failed_servers} servers failed (max_failures={max_failures})",
+            finished_at=datetime.utcnow(),
+            lease_expires_at=None
+        )
+    )
+    db.commit()
+    if result.rowcount:
+        message = (
+            f"\n🛑 {failed_servers} servers failed (max_failures={max_failures}), "
+            f"skipping {result.rowcount} remaining jobs\n"
+        )
+        if log_callback is not None:
+            log_callback(message)
+        else:
+            log_writer.write(deployment_id, message)
+    return True
+
+def start_wave(db: Session, deployment_id: int, wave: int):
+    db.execute(
+        update(models.Deployment)
+        .where(models.Deployment.id == deployment_id)
+        .values(current_wave=wave)
+    )
+    db.commit()
+
+def _advance_wave(db: Session, deployment_id: int) -> bool:
+    """
+    Move a rollout to its next wave once the current one has finished.
+    Returns True while the deployment still has a wave running or starting.
+    """
+    current_wave = db.query(models.Deployment.current_wave).filter(
+        models.Deployment.id == deployment_id
+    ).scalar() or 0
+    waves = dict(db.query(Job.wave, func.count(Job.id)).filter(
+        Job.deployment_id == deployment_id,
+        Job.status.in_(ACTIVE_JOB_STATUSES)
+    ).group_by(Job.wave).all())
+    if not waves:
+        return False
+    if any(wave <= current_wave for wave in waves):
+        return True
+
+    next_wave = min(waves)
+    result = db.execute(
+        update(models.Deployment)
+        .where(models.Deployment.id == deployment_id, models.Deployment.current_wave == current_wave)
+        .values(current_wave=next_wave)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    if result.rowcount:
+        total_waves = db.query(func.max(Job.wave)).filter(Job.deployment_id == deployment_id).scalar() + 1
+        log_writer.write(deployment_id, f"\n🌊 Starting wave {next_wave + 1} of {total_waves}\n")
+    return True
+
+def finalize_deployment(db: Session, deployment_id: int) -> Optional[models.DeploymentStatus]:
+    """
+    Start the next rollout wave, or set the final deployment status once no job is
+    queued or running. Safe to call from several workers: only one of them moves
+    the wave or the status.
+    """
+    halted = check_failure_threshold(db, deployment_id)
+    if _advance_wave(db, deployment_id):
+        return None
+
+    counts = dict(db.query(Job.status, func.count(Job.id)).filter(
+        Job.deployment_id == deployment_id
+    ).group_by(Job.status).all())
+    unreachable = db.query(func.count(func.distinct(Job.server_id))).filter(
+        Job.deployment_id == deployment_id,
+        Job.status == models.JobStatus.SKIPPED,
+        Job.output.startswith(UNREACHABLE_REASON)
+    ).scalar()
+    failed = counts.get(models.JobStatus.FAILED, 0)
+    finished = failed + counts.get(models.JobStatus.SUCCESS, 0)
+    final_status = models.DeploymentStatus.FAILED if failed or unreachable else models.DeploymentStatus.SUCCESS
+    problems = []
+    if failed:
+        problems.append(f"{failed} of {finished} deployments failed")
+    if unreachable:
+        problems.append(f"{unreachable} servers unreachable")
+    if halted:
+        problems.append("remaining jobs skipped after too many server failures")
+    error_message = "; ".join(problems) or None
+
+    old_status = db.query(models.Deployment.status).filter(models.Deployment.id == deployment_id).scalar()
+    if old_status not in (models.DeploymentStatus.PENDING, models.DeploymentStatus.RUNNING):
+        return None
+    result = db.execute(
+        update(models.Deployment)
+        .where(models.Deployment.id == deployment_id, models.Deployment.status == old_status)
+        .values(
+            status=final_status,
+            completed_at=datetime.utcnow(),
+            error_message=error_message
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        db.rollback()
+        return None
+    stats.record_transition(db, old_status, final_status)
+    db.commit()
+    stats.dashboard_cache.invalidate()
+    return final_status
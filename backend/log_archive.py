@@ -0,0 +1,250 @@
+"""
+DeployMaster Log Archival
+Compacts the logs of finished deployments: once a deployment has been finished
+for LOG_ARCHIVE_AFTER_HOURS, its log chunks are compressed into one
+deployment_log_archives row and deleted. After LOG_RETENTION_DAYS the archive is
+moved out of the database into LOG_ARCHIVE_DIR or pruned. Reads decompress
+transparently, and archived chunks stay searchable until they are pruned
+(see log_search.py). The API runs a pass every LOG_ARCHIVE_INTERVAL seconds; run this
+module to do one pass by hand (e.g. from cron with LOG_ARCHIVE_INTERVAL=0).
+
+Usage (from backend/):
+    python log_archive.py
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import log_search
+import models
+
+try:
+    import zstandard
+except ImportError:  # Optional: pip install zstandard
+    zstandard = None
+
+# Seconds between background archival passes in the API process (0 disables them)
+LOG_ARCHIVE_INTERVAL = int(os.getenv("LOG_ARCHIVE_INTERVAL", "300"))
+# Hours a deployment has to be finished before its logs are compressed
+LOG_ARCHIVE_AFTER_HOURS = float(os.getenv("LOG_ARCHIVE_AFTER_HOURS", "24"))
+# gzip, or zstd when the zstandard package is installed
+LOG_ARCHIVE_CODEC = os.getenv("LOG_ARCHIVE_CODEC", "gzip").lower()
+# Deployments archived per pass
+LOG_ARCHIVE_BATCH = int(os.getenv("LOG_ARCHIVE_BATCH", "50"))
+# Days an archive stays in the database (0 keeps it forever)
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "0"))
+# What happens after LOG_RETENTION_DAYS: "file" moves the archive to LOG_ARCHIVE_DIR, "prune" deletes it
+LOG_RETENTION_ACTION = os.getenv("LOG_RETENTION_ACTION", "file").lower()
+# Where retention moves archives with LOG_RETENTION_ACTION=file
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "./log_archive")
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = (models.DeploymentStatus.SUCCESS, models.DeploymentStatus.FAILED)
+FILE_EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+def archive_codec() -> str:
+    if LOG_ARCHIVE_CODEC == "zstd" and zstandard is None:
+        logger.warning("LOG_ARCHIVE_CODEC=zstd but the zstandard package is not installed, using gzip")
+        return "gzip"
+    return "zstd" if LOG_ARCHIVE_CODEC == "zstd" else "gzip"
+
+class _Compressor:
+    """Incremental gzip or zstd compression into memory"""
+
+    def __init__(self, codec: str):
+        if codec == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=10).compressobj()
+        else:
+            self._compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._parts: List[bytes] = []
+
+    def write(self, data: bytes):
+        self._parts.append(self._compressor.compress(data))
+
+    def finish(self) -> bytes:
+        self._parts.append(self._compressor.flush())
+        return b"".join(self._parts)
+
+def _open_reader(codec: str, raw: io.BufferedIOBase) -> io.BufferedIOBase:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This archive is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return gzip.GzipFile(fileobj=raw, mode="rb")
+
+def iter_records(archive: models.DeploymentLogArchive) -> Iterator[dict]:
+    """
+    Decompress an archive incrementally. Yields one dict per original chunk:
+    q (sequence), s (server id), a (application id), t (created_at, ISO) and c (content).
+    Yields nothing for a pruned archive.
+    """
+    if archive.path:
+        raw = open(archive.path, "rb")
+    elif archive.data is not None:
+        raw = io.BytesIO(archive.data)
+    else:
+        return
+    with raw, _open_reader(archive.codec, raw) as reader:
+        for line in io.TextIOWrapper(reader, encoding="utf-8"):
+            yield json.loads(line)
+
+def archived_chunks(
+    db: Session,
+    deployment_id: int,
+    after_sequence: int = -1,
+    limit: int = 1000
+) -> List[models.DeploymentLogChunk]:
+    """Chunks of an archived deployment, rebuilt from the archive (not attached to the session)"""
+    archive = db.get(models.DeploymentLogArchive, deployment_id)
+    if archive is None:
+        return []
+    chunks = []
+    for record in iter_records(archive):
+        if record["q"] <= after_sequence:
+            continue
+        chunks.append(models.DeploymentLogChunk(
+            deployment_id=deployment_id,
+            sequence=record["q"],
+            server_id=record["s"],
+            application_id=record["a"],
+            content=record["c"],
+            created_at=datetime.fromisoformat(record["t"]) if record["t"] else None
+        ))
+        if len(chunks) >= limit:
+            break
+    return chunks
+
+def archive_deployment(db: Session, deployment_id: int, codec: Optional[str] = None) -> Optional[models.DeploymentLogArchive]:
+    """
+    Compress a deployment's chunks (and pre-chunk logs) into an archive row and delete
+    them, in one transaction. None if another process archived it first.
+    """
+    codec = codec or archive_codec()
+    compressor = _Compressor(codec)
+    chunk_count = size = 0
+    # Archived chunks stay searchable through the archive index
+    unindexed: List[dict] = []
+
+    def add(record: dict):
+        nonlocal chunk_count, size
+        compressor.write((json.dumps(record, separators=(",", ":")) + "\n").encode())
+        chunk_count += 1
+        size += len(record["c"].encode())
+        unindexed.append(record)
+        if len(unindexed) >= 1000:
+            log_search.index_archived(db, deployment_id, unindexed)
+            unindexed.clear()
+
+    deployment = db.get(models.Deployment, deployment_id)
+    if deployment.legacy_logs:
+        add({"q": -1, "s": None, "a": None, "t": None, "c": deployment.legacy_logs})
+    chunks = db.query(models.DeploymentLogChunk).filter(
+        models.DeploymentLogChunk.deployment_id == deployment_id
+    ).order_by(models.DeploymentLogChunk.sequence).yield_per(1000)
+    for chunk in chunks:
+        add({
+            "q": chunk.sequence,
+            "s": chunk.server_id,
+            "a": chunk.application_id,
+            "t": chunk.created_at.isoformat() if chunk.created_at else None,
+            "c": chunk.content
+        })
+    data = compressor.finish()
+    log_search.index_archived(db, deployment_id, unindexed)
+
+    archive = models.DeploymentLogArchive(
+        deployment_id=deployment_id, codec=codec, data=data,
+        chunk_count=chunk_count, size=size, compressed_size=len(data)
+    )
+    db.add(archive)
+    db.execute(delete(models.DeploymentLogChunk).where(models.DeploymentLogChunk.deployment_id == deployment_id))
+    db.execute(update(models.Deployment).where(models.Deployment.id == deployment_id).values(legacy_logs=""))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return archive
+
+def apply_retention(db: Session, archive: models.DeploymentLogArchive):
+    """Move an archive's data to a file in LOG_ARCHIVE_DIR, or prune it (LOG_RETENTION_ACTION)"""
+    if LOG_RETENTION_ACTION == "prune":
+        log_search.unindex_archived(db, archive.deployment_id, iter_records(archive))
+        path = archive.path
+        archive.data = None
+        archive.path = None
+        archive.pruned_at = datetime.utcnow()
+        db.commit()
+        if path:
+            os.remove(path)
+        return
+
+    if archive.path or archive.data is None:
+        return
+    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(LOG_ARCHIVE_DIR, f"{archive.deployment_id}{FILE_EXTENSIONS[archive.codec]}"))
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(archive.data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    archive.path = path
+    archive.data = None
+    db.commit()
+
+def run_archival(db: Session, now: Optional[datetime] = None) -> dict:
+    """One archival pass. Returns how many deployments were archived, moved and pruned."""
+    now = now or datetime.utcnow()
+    counts = {"archived": 0, "moved": 0, "pruned": 0, "bytes_before": 0, "bytes_after": 0}
+
+    archived_ids = db.query(models.DeploymentLogArchive.deployment_id)
+    due = db.query(models.Deployment.id).filter(
+        models.Deployment.status.in_(FINISHED_STATUSES),
+        models.Deployment.completed_at <= now - timedelta(hours=LOG_ARCHIVE_AFTER_HOURS),
+        models.Deployment.id.not_in(archived_ids)
+    ).order_by(models.Deployment.completed_at).limit(LOG_ARCHIVE_BATCH).all()
+    for (deployment_id,) in due:
+        archive = archive_deployment(db, deployment_id)
+        if archive is not None:
+            counts["archived"] += 1
+            counts["bytes_before"] += archive.size
+            counts["bytes_after"] += archive.compressed_size
+
+    if LOG_RETENTION_DAYS > 0:
+        expired = db.query(models.DeploymentLogArchive).filter(
+            models.DeploymentLogArchive.archived_at <= now - timedelta(days=LOG_RETENTION_DAYS),
+            models.DeploymentLogArchive.pruned_at.is_(None)
+        )
+        if LOG_RETENTION_ACTION != "prune":
+            expired = expired.filter(models.DeploymentLogArchive.path.is_(None))
+        for archive in expired.limit(LOG_ARCHIVE_BATCH).all():
+            apply_retention(db, archive)
+            counts["pruned" if LOG_RETENTION_ACTION == "prune" else "moved"] += 1
+    return counts
+
+def main():
+    from database import SessionLocal, ensure_schema
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    ensure_schema()
+    with SessionLocal() as db:
+        log_search.ensure_index(db)
+        counts = run_archival(db)
+    ratio = counts["bytes_after"] / counts["bytes_before"] if counts["bytes_before"] else 0
+    logger.info(
+        f"🗜️  Archived {counts['archived']} deployment logs ({counts['bytes_before']} -> {counts['bytes_after']} bytes, "
+        f"{ratio:.0%}), moved {counts['moved']} to {LOG_ARCHIVE_DIR}, pruned {counts['pruned']}"
+    )
+
+if __name__ == "__main__":
+    main()
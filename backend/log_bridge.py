@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+from log_writer import log_writer
+
+logger = logging.getLogger(__name__)
+
+class LogBridge:
+    """
+    Carries log lines from executor threads to the event loop.
+    Lines are buffered for persistence in the calling thread and handed to the
+    loop with call_soon_threadsafe, where a single consumer delivers them in order.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        deliver: Callable[[int, str, Optional[int], Optional[int]], Awaitable[None]]
+    ):
+        self.loop = loop
+        self.deliver = deliver
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.monotonic()
+        self.lines_delivered = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._started_at = time.monotonic()
+            self._task = self.loop.create_task(self._run())
+
+    async def stop(self):
+        """Deliver what is queued, then stop the consumer"""
+        await self.drain()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def emit(
+        self,
+        deployment_id: int,
+        message: str,
+        server_id: Optional[int] = None,
+        application_id: Optional[int] = None
+    ):
+        """Persist and broadcast a log line. Safe to call from any thread, including the loop's."""
+        log_writer.write(deployment_id, message, server_id, application_id)
+        self.loop.call_soon_threadsafe(
+            self._queue.put_nowait,
+            (deployment_id, message, server_id, application_id, time.monotonic())
+        )
+
+    def callback(
+        self,
+        deployment_id: int,
+        server_id: Optional[int] = None,
+        application_id: Optional[int] = None
+    ) -> Callable[[str], None]:
+        """Synchronous log callback for one deployment target"""
+        def log_callback(message: str):
+            self.emit(deployment_id, message, server_id, application_id)
+        return log_callback
+
+    async def drain(self):
+        """Wait until every line emitted so far has been delivered"""
+        # Let call_soon_threadsafe callbacks that are already scheduled enqueue first
+        await asyncio.sleep(0)
+        await self._queue.join()
+
+    async def _run(self):
+        while True:
+            deployment_id, message, server_id, application_id, emitted_at = await self._queue.get()
+            try:
+                await self.deliver(deployment_id, message, server_id, application_id)
+            except Exception:
+                logger.exception("Failed to deliver log line for deployment %s", deployment_id)
+            finally:
+                latency = time.monotonic() - emitted_at
+                self.lines_delivered += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """Throughput and delivery latency since start"""
+        elapsed = time.monotonic() - self._started_at
+        return {
+            "lines_delivered": self.lines_delivered,
+            "lines_per_second": self.lines_delivered / elapsed if elapsed > 0 else 0.0,
+            "avg_latency_ms": self.total_latency / self.lines_delivered * 1000 if self.lines_delivered else 0.0,
+            "max_latency_ms": self.max_latency * 1000,
+            "queue_depth": self._queue.qsize(),
+        }
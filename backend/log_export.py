@@ -0,0 +1,293 @@
+"""
+DeployMaster Log Export
+Streams one deployment's log for GET /api/deployments/{id}/logs without
+materializing it: chunks are read LOG_EXPORT_BATCH at a time (archived logs are
+decompressed incrementally), optionally for one server and/or application.
+"""
+
+import json
+import os
+import zlib
+from collections import deque
+from datetime import datetime
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from sqlalchemy import LargeBinary, cast, func
+from sqlalchemy.orm import Session
+import log_archive
+import models
+
+# Log chunks read per query while streaming
+LOG_EXPORT_BATCH = int(os.getenv("LOG_EXPORT_BATCH", "500"))
+
+# Bytes collected before a piece of the response is sent
+STREAM_BUFFER_BYTES = 64 * 1024
+
+class LogRecord(NamedTuple):
+    sequence: int  # -1 for logs written before chunking (Deployment.legacy_logs)
+    server_id: Optional[int]
+    application_id: Optional[int]
+    created_at: Optional[datetime]
+    content: str
+
+class RangeNotSatisfiable(ValueError):
+    """A Range header entirely past the end of the log"""
+
+class LogReader:
+    """
+    Reads one deployment's log in order, from its chunks or from its archive once
+    log_archive.py compacted it. With a server or application filter, only chunks
+    tagged with them are read (pre-chunk legacy logs carry no tags and are left out).
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        deployment_id: int,
+        server_id: Optional[int] = None,
+        application_id: Optional[int] = None
+    ):
+        self.db = db
+        self.deployment_id = deployment_id
+        self.server_id = server_id
+        self.application_id = application_id
+        self.filtered = server_id is not None or application_id is not None
+        # Archiving inserts the archive and deletes the chunks in one transaction
+        self.archive = db.get(models.DeploymentLogArchive, deployment_id)
+
+    def _chunks(self, *columns):
+        query = self.db.query(*columns).filter(models.DeploymentLogChunk.deployment_id == self.deployment_id)
+        if self.server_id is not None:
+            query = query.filter(models.DeploymentLogChunk.server_id == self.server_id)
+        if self.application_id is not None:
+            query = query.filter(models.DeploymentLogChunk.application_id == self.application_id)
+        return query
+
+    def _legacy(self) -> str:
+        if self.filtered:
+            return ""
+        return self.db.query(models.Deployment.legacy_logs).filter(
+            models.Deployment.id == self.deployment_id
+        ).scalar() or ""
+
+    def _archived(self) -> Iterator[LogRecord]:
+        for record in log_archive.iter_records(self.archive):
+            if self.server_id is not None and record["s"] != self.server_id:
+                continue
+            if self.application_id is not None and record["a"] != self.application_id:
+                continue
+            created_at = datetime.fromisoformat(record["t"]) if record["t"] else None
+            yield LogRecord(record["q"], record["s"], record["a"], created_at, record["c"])
+
+    def records(self, after_sequence: Optional[int] = None) -> Iterator[LogRecord]:
+        """Log records in order; after_sequence skips the legacy logs and chunks up to it"""
+        if self.archive is not None:
+            for record in self._archived():
+                if after_sequence is None or record.sequence > after_sequence:
+                    yield record
+            return
+
+        if after_sequence is None:
+            legacy = self._legacy()
+            if legacy:
+                yield LogRecord(-1, None, None, None, legacy)
+            after_sequence = -1
+        chunk = models.DeploymentLogChunk
+        while True:
+            # Keyset batches: each query is short, so the log can keep growing meanwhile
+            batch = self._chunks(
+                chunk.sequence, chunk.server_id, chunk.application_id, chunk.created_at, chunk.content
+            ).filter(chunk.sequence > after_sequence).order_by(chunk.sequence).limit(LOG_EXPORT_BATCH).all()
+            for row in batch:
+                yield LogRecord(*row)
+            if len(batch) < LOG_EXPORT_BATCH:
+                return
+            after_sequence = batch[-1].sequence
+
+    def tail_records(self, count: int) -> List[LogRecord]:
+        """The last `count` records"""
+        if self.archive is not None:
+            return list(deque(self._archived(), maxlen=count))
+        chunk = models.DeploymentLogChunk
+        rows = self._chunks(
+            chunk.sequence, chunk.server_id, chunk.application_id, chunk.created_at, chunk.content
+        ).order_by(chunk.sequence.desc()).limit(count).all()
+        records = [LogRecord(*row) for row in reversed(rows)]
+        if len(records) < count:
+            legacy = self._legacy()
+            if legacy:
+                records.insert(0, LogRecord(-1, None, None, None, legacy))
+        return records
+
+    def text_size(self) -> int:
+        """Length of the plain-text log in bytes (UTF-8)"""
+        if self.archive is not None:
+            if self.archive.pruned_at is not None:
+                return 0
+            if not self.filtered:
+                return self.archive.size
+            return sum(len(record.content.encode()) for record in self._archived())
+        size = self._chunks(
+            func.sum(func.length(cast(models.DeploymentLogChunk.content, LargeBinary)))
+        ).scalar() or 0
+        return size + len(self._legacy().encode())
+
+    def _locate(self, start: int) -> Tuple[Optional[int], int]:
+        """
+        Last chunk sequence ending at or before byte `start`, and the byte position
+        after it, from the chunk sizes alone (None, 0 when `start` is in the legacy logs)
+        """
+        position = len(self._legacy().encode())
+        if start < position:
+            return None, 0
+        chunk = models.DeploymentLogChunk
+        after_sequence = last = -1
+        while True:
+            batch = self._chunks(
+                chunk.sequence, func.length(cast(chunk.content, LargeBinary))
+            ).filter(chunk.sequence > last).order_by(chunk.sequence).limit(LOG_EXPORT_BATCH * 10).all()
+            for sequence, size in batch:
+                if position + size > start:
+                    return after_sequence, position
+                position += size
+                after_sequence = sequence
+            if not batch:
+                return after_sequence, position
+            last = batch[-1].sequence
+
+    def text(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """The plain-text log from byte `start` up to (not including) byte `end`"""
+        after_sequence, position = None, 0
+        if start > 0 and self.archive is None:
+            after_sequence, position = self._locate(start)
+
+        def pieces():
+            nonlocal position
+            for record in self.records(after_sequence):
+                data = record.content.encode()
+                record_start = position
+                position += len(data)
+                if position <= start:
+                    continue
+                yield data[max(start - record_start, 0):None if end is None else end - record_start]
+                if end is not None and position >= end:
+                    return
+
+        return coalesce(pieces())
+
+    def tail_text(self, lines: int) -> Iterator[bytes]:
+        """The last `lines` lines of the plain-text log"""
+        if self.archive is not None:
+            kept = deque(maxlen=lines)
+            partial = ""
+            for record in self._archived():
+                parts = (partial + record.content).split("\n")
+                partial = parts.pop()
+                kept.extend(part + "\n" for part in parts)
+            if partial:
+                kept.append(partial)
+            return coalesce(line.encode() for line in kept)
+
+        # Read backwards, newest chunk first, until enough lines are collected
+        chunk = models.DeploymentLogChunk
+        contents, newlines = [], 0
+        before = None
+        while newlines <= lines:
+            query = self._chunks(chunk.sequence, chunk.content)
+            if before is not None:
+                query = query.filter(chunk.sequence < before)
+            batch = query.order_by(chunk.sequence.desc()).limit(LOG_EXPORT_BATCH).all()
+            for sequence, content in batch:
+                contents.append(content)
+                newlines += content.count("\n")
+                if newlines > lines:
+                    break
+            if len(batch) < LOG_EXPORT_BATCH:
+                if newlines <= lines:
+                    contents.append(self._legacy())
+                break
+            before = batch[-1].sequence
+        text = "".join(reversed(contents))
+        return coalesce([last_lines(text, lines).encode()])
+
+    def ndjson(self, tail: Optional[int] = None) -> Iterator[bytes]:
+        """One JSON object per record: sequence, server_id, application_id, created_at, content"""
+        records = self.tail_records(tail) if tail is not None else self.records()
+        return coalesce(
+            (json.dumps({
+                "sequence": record.sequence,
+                "server_id": record.server_id,
+                "application_id": record.application_id,
+                "created_at": record.created_at.isoformat() if record.created_at else None,
+                "content": record.content
+            }) + "\n").encode()
+            for record in records
+        )
+
+def last_lines(text: str, count: int) -> str:
+    """The last `count` lines of a text, like tail -n (a final unterminated line counts)"""
+    cut = len(text) - 1 if text.endswith("\n") else len(text)
+    for _ in range(count):
+        cut = text.rfind("\n", 0, cut)
+        if cut < 0:
+            return text
+    return text[cut + 1:]
+
+def coalesce(pieces: Iterable[bytes], size: int = STREAM_BUFFER_BYTES) -> Iterator[bytes]:
+    """Join small pieces into writes of about `size` bytes"""
+    buffer, buffered = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffered:
+        yield b"".join(buffer)
+
+def gzip_stream(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip (and does not give it q=0)"""
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            quality = params.strip().lower()
+            try:
+                return not (quality.startswith("q=") and float(quality[2:]) == 0)
+            except ValueError:
+                return False
+    return False
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    The (start, end) bytes of a single-range `Range: bytes=...` header, end exclusive.
+    None for headers that are to be ignored (other units, several ranges, malformed);
+    raises RangeNotSatisfiable when the range starts past the end of the log.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first or last):
+        return None
+    try:
+        start = int(first) if first else None
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start is None:
+        # Suffix range: the last N bytes
+        if end == 1:
+            raise RangeNotSatisfiable(header)
+        return max(size - end + 1, 0), size
+    if last and end <= start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size)
@@ -0,0 +1,287 @@
+import os
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+from sqlalchemy import func, insert, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+import models
+import schemas
+
+# Tokens of context around the matched terms in a search snippet
+LOG_SEARCH_SNIPPET_TOKENS = int(os.getenv("LOG_SEARCH_SNIPPET_TOKENS", "24"))
+
+# Marks the matched terms in snippets; the rest of a snippet is raw log output
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# External-content FTS5 index over deployment_log_chunks: the chunk text is not
+# stored twice, and triggers keep the index in step with every insert and delete,
+# whichever process writes the chunk
+INDEX_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS deployment_log_search USING fts5(
+        content, content='deployment_log_chunks', content_rowid='id', tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS deployment_log_chunks_search_insert
+    AFTER INSERT ON deployment_log_chunks BEGIN
+        INSERT INTO deployment_log_search (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS deployment_log_chunks_search_delete
+    AFTER DELETE ON deployment_log_chunks BEGIN
+        INSERT INTO deployment_log_search (deployment_log_search, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS deployment_log_chunks_search_update
+    AFTER UPDATE OF content ON deployment_log_chunks BEGIN
+        INSERT INTO deployment_log_search (deployment_log_search, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO deployment_log_search (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    # Chunks archived by log_archive.py: the text lives compressed in the archive, so
+    # this index is contentless; deployment_log_archive_entries says where a row came from
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS deployment_log_archive_search USING fts5(
+        content, content='', tokenize='unicode61'
+    )
+    """,
+)
+
+# Cursors of the second phase of a search (archived logs) start with this
+ARCHIVE_CURSOR_PREFIX = "a"
+
+def _table_exists(db: Session, name: str) -> bool:
+    return db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+    ).first() is not None
+
+def ensure_index(db: Session):
+    """Create the search indexes and their triggers, indexing existing logs the first time"""
+    chunks_indexed = _table_exists(db, "deployment_log_search")
+    archives_indexed = _table_exists(db, "deployment_log_archive_search")
+    for statement in INDEX_DDL:
+        db.execute(text(statement))
+    if not chunks_indexed:
+        db.execute(text("INSERT INTO deployment_log_search (deployment_log_search) VALUES ('rebuild')"))
+    if not archives_indexed:
+        # Archives written before the archive index existed
+        import log_archive
+        
+        archives = db.query(models.DeploymentLogArchive).filter(models.DeploymentLogArchive.pruned_at.is_(None))
+        for archive in archives.all():
+            index_archived(db, archive.deployment_id, log_archive.iter_records(archive))
+    db.commit()
+
+def index_archived(db: Session, deployment_id: int, records: Iterable[dict]):
+    """
+    Make a deployment's archived chunks searchable; `records` as stored by log_archive.py.
+    Runs in the caller's transaction. Pre-chunk logs (sequence -1) are not indexed, as before archiving.
+    """
+    entries, rows = [], []
+    next_id = (db.query(func.max(models.DeploymentLogArchiveEntry.id)).scalar() or 0) + 1
+
+    def flush():
+        if entries:
+            db.execute(insert(models.DeploymentLogArchiveEntry), entries)
+            db.execute(text("INSERT INTO deployment_log_archive_search (rowid, content) VALUES (:id, :content)"), rows)
+            entries.clear()
+            rows.clear()
+
+    for record in records:
+        if record["q"] < 0:
+            continue
+        entries.append({
+            "id": next_id,
+            "deployment_id": deployment_id,
+            "sequence": record["q"],
+            "server_id": record["s"],
+            "application_id": record["a"],
+            "created_at": datetime.fromisoformat(record["t"]) if record["t"] else None
+        })
+        rows.append({"id": next_id, "content": record["c"]})
+        next_id += 1
+        if len(entries) >= 1000:
+            flush()
+    flush()
+
+def unindex_archived(db: Session, deployment_id: int, records: Iterable[dict]):
+    """
+    Remove a deployment's archived chunks from search (before retention prunes them).
+    A contentless index needs the original text to delete a row, hence `records`.
+    """
+    entry_ids = dict(db.query(models.DeploymentLogArchiveEntry.sequence, models.DeploymentLogArchiveEntry.id).filter(
+        models.DeploymentLogArchiveEntry.deployment_id == deployment_id
+    ).all())
+    rows = [
+        {"id": entry_ids[record["q"]], "content": record["c"]}
+        for record in records if record["q"] in entry_ids
+    ]
+    if rows:
+        db.execute(text(
+            "INSERT INTO deployment_log_archive_search (deployment_log_archive_search, rowid, content) "
+            "VALUES ('delete', :id, :content)"
+        ), rows)
+    db.query(models.DeploymentLogArchiveEntry).filter(
+        models.DeploymentLogArchiveEntry.deployment_id == deployment_id
+    ).delete(synchronize_session=False)
+
+def _stored_time(value: datetime) -> str:
+    """Chunk timestamps are naive UTC, stored as text"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=" ")
+
+def phrase_query(terms: str) -> str:
+    """FTS5 query matching the text literally, as one phrase"""
+    return '"' + terms.replace('"', '""') + '"'
+
+def _search(
+    db: Session,
+    archived: bool,
+    filters: List[str],
+    params: dict,
+    before: Optional[int],
+    limit: int,
+    syntax: str
+) -> List[dict]:
+    """Newest-first hits from the live or the archive index"""
+    index = "deployment_log_archive_search" if archived else "deployment_log_search"
+    source = "deployment_log_archive_entries" if archived else "deployment_log_chunks"
+    # Archived text is highlighted afterwards (see _archived_snippets)
+    snippet = "''" if archived else f"snippet({index}, 0, :start, :end, '…', :tokens)"
+    conditions = [f"{index} MATCH :match", *filters]
+    params = dict(params, limit=limit)
+    if before is not None:
+        conditions.append(f"{index}.rowid < :before")
+        params["before"] = before
+    if not archived:
+        params.update(start=HIGHLIGHT_START, end=HIGHLIGHT_END, tokens=min(max(LOG_SEARCH_SNIPPET_TOKENS, 1), 64))
+
+    statement = text(f"""
+        SELECT chunk.id AS chunk_id, chunk.deployment_id, chunk.sequence, chunk.server_id,
+               servers.hostname AS server_hostname, chunk.application_id,
+               applications.name AS application_name, chunk.created_at,
+               {snippet} AS snippet
+        FROM {index}
+        JOIN {source} AS chunk ON chunk.id = {index}.rowid
+        LEFT JOIN servers ON servers.id = chunk.server_id
+        LEFT JOIN applications ON applications.id = chunk.application_id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {index}.rowid DESC
+        LIMIT :limit
+    """)
+    try:
+        rows = db.execute(statement, params).mappings().all()
+    except OperationalError as e:
+        db.rollback()
+        # FTS5 reports query syntax errors as operational errors
+        if syntax == "fts" and "locked" not in str(e.orig):
+            raise ValueError(f"Invalid search query: {e.orig}") from e
+        raise
+    return [dict(row, archived=archived) for row in rows]
+
+def _archived_snippets(db: Session, hits: List[dict], match: str):
+    """
+    Highlight archived hits like live ones: their chunks are decompressed into a
+    temporary FTS5 table, so snippet() sees the same text and query.
+    """
+    import log_archive
+    
+    wanted = {}
+    for hit in hits:
+        wanted.setdefault(hit["deployment_id"], {})[hit["sequence"]] = hit["chunk_id"]
+    contents = []
+    for deployment_id, entry_ids in wanted.items():
+        archive = db.get(models.DeploymentLogArchive, deployment_id)
+        if archive is None:
+            continue
+        for record in log_archive.iter_records(archive):
+            entry_id = entry_ids.pop(record["q"], None)
+            if entry_id is not None:
+                contents.append({"id": entry_id, "content": record["c"]})
+            if not entry_ids:
+                break
+
+    db.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS temp.deployment_log_snippets USING fts5(content, tokenize='unicode61')"
+    ))
+    if contents:
+        db.execute(text("INSERT INTO temp.deployment_log_snippets (rowid, content) VALUES (:id, :content)"), contents)
+    snippets = dict(db.execute(text("""
+        SELECT rowid, snippet(deployment_log_snippets, 0, :start, :end, '…', :tokens)
+        FROM temp.deployment_log_snippets WHERE deployment_log_snippets MATCH :match
+    """), {
+        "match": match,
+        "start": HIGHLIGHT_START,
+        "end": HIGHLIGHT_END,
+        "tokens": min(max(LOG_SEARCH_SNIPPET_TOKENS, 1), 64),
+    }).all())
+    db.execute(text("DELETE FROM temp.deployment_log_snippets"))
+    for hit in hits:
+        hit["snippet"] = snippets.get(hit["chunk_id"], "")
+
+def search_logs(
+    db: Session,
+    query: str,
+    syntax: str = "phrase",
+    deployment_id: Optional[int] = None,
+    server_id: Optional[int] = None,
+    application_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> schemas.LogSearchPage:
+    """
+    Page of log chunks matching a query, with highlighted snippets: newest first
+    among the current logs, then newest first among archived ones (log_archive.py).
+    syntax "phrase" matches the query text literally; "fts" passes it to FTS5 as is
+    (AND/OR/NOT, "phrases", prefix*). Keyset-paginated on the index rowids.
+    Raises ValueError for a malformed query or cursor.
+    """
+    filters = []
+    params = {"match": phrase_query(query) if syntax == "phrase" else query}
+    for column, value in (
+        ("deployment_id", deployment_id), ("server_id", server_id), ("application_id", application_id)
+    ):
+        if value is not None:
+            filters.append(f"chunk.{column} = :{column}")
+            params[column] = value
+    if since is not None:
+        filters.append("chunk.created_at >= :since")
+        params["since"] = _stored_time(since)
+    if until is not None:
+        filters.append("chunk.created_at < :until")
+        params["until"] = _stored_time(until)
+    in_archive, before = False, None
+    if cursor:
+        in_archive = cursor.startswith(ARCHIVE_CURSOR_PREFIX)
+        try:
+            before = int(cursor[len(ARCHIVE_CURSOR_PREFIX):] if in_archive else cursor)
+        except ValueError as e:
+            raise ValueError("Invalid cursor") from e
+
+    hits = [] if in_archive else _search(db, False, filters, params, before, limit + 1, syntax)
+    if len(hits) <= limit:
+        hits += _search(
+            db, True, filters, params, before if in_archive else None, limit + 1 - len(hits), syntax
+        )
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last = hits[-1]
+        next_cursor = (ARCHIVE_CURSOR_PREFIX if last["archived"] else "") + str(last["chunk_id"])
+    archived = [hit for hit in hits if hit["archived"]]
+    if archived:
+        _archived_snippets(db, archived, params["match"])
+    return schemas.LogSearchPage(
+        items=[schemas.LogSearchHit.model_validate(hit) for hit in hits],
+        next_cursor=next_cursor
+    )
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+import crud
+from database import SessionLocal
+
+# Flush buffered log lines at least this often (milliseconds)
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "250"))
+# Flush early once this much output is buffered (KB)
+LOG_FLUSH_KB = int(os.getenv("LOG_FLUSH_KB", "64"))
+# Block writers once this much output is waiting to be flushed (KB)
+LOG_BUFFER_MAX_KB = int(os.getenv("LOG_BUFFER_MAX_KB", "4096"))
+
+logger = logging.getLogger(__name__)
+
+def _on_event_loop() -> bool:
+    """Whether the calling thread is running an asyncio event loop (including AsyncSession.run_sync)"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+class BatchedLogWriter:
+    """
+    Collects log lines from all running jobs and writes them to the database
+    in bulk transactions. Consecutive lines from the same server/application
+    are coalesced into one chunk.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: int = LOG_FLUSH_INTERVAL_MS,
+        flush_bytes: int = LOG_FLUSH_KB * 1024,
+        max_buffer_bytes: int = LOG_BUFFER_MAX_KB * 1024
+    ):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        self._pending: List[dict] = []
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+        # Serializes flushes so chunks are written in the order they were buffered
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def _start(self):
+        """Start the background flusher. Caller holds the condition lock."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def write(
+        self,
+        deployment_id: int,
+        content: str,
+        server_id: Optional[int] = None,
+        application_id: Optional[int] = None
+    ):
+        """
+        Buffer a log line. Blocks while the buffer is full, except on an event loop
+        thread, where waiting for a flush would stall every request and WebSocket:
+        those few lines (pre-flight, skips, waves) may overrun the limit instead.
+        """
+        if not content:
+            return
+        size = len(content.encode())
+        block = not _on_event_loop()
+        with self._condition:
+            self._start()
+            while block and self._pending_bytes >= self.max_buffer_bytes:
+                self._condition.notify_all()
+                self._condition.wait()
+
+            last = self._pending[-1] if self._pending else None
+            if (
+                last is not None
+                and last["deployment_id"] == deployment_id
+                and last["server_id"] == server_id
+                and last["application_id"] == application_id
+            ):
+                last["content"] += content
+            else:
+                self._pending.append({
+                    "deployment_id": deployment_id,
+                    "server_id": server_id,
+                    "application_id": application_id,
+                    "content": content,
+                    "created_at": datetime.utcnow()
+                })
+            self._pending_bytes += size
+            if self._pending_bytes >= self.flush_bytes:
+                self._condition.notify_all()
+
+    def flush(self):
+        """Write everything buffered so far. Returns once it is committed."""
+        with self._flush_lock:
+            with self._condition:
+                entries = self._pending
+                self._pending = []
+                self._pending_bytes = 0
+            if not entries:
+                return
+
+            db = SessionLocal()
+            try:
+                crud.append_deployment_logs(db, entries)
+            except Exception:
+                db.rollback()
+                # Put the entries back in front of anything buffered meanwhile
+                with self._condition:
+                    self._pending = entries + self._pending
+                    self._pending_bytes += sum(len(entry["content"].encode()) for entry in entries)
+                raise
+            finally:
+                db.close()
+
+            with self._condition:
+                # Wake writers blocked on a full buffer
+                self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and self._pending_bytes < self.flush_bytes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush deployment logs, retrying")
+                time.sleep(self.flush_interval)
+            if stopping:
+                return
+
+    def stop(self):
+        """Flush remaining lines and stop the background flusher"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+log_writer = BatchedLogWriter()
@@ -1,18 +1,42 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import asyncio
 import json
+import logging
+import os
+from datetime import datetime
 
 import models
 import schemas
 import crud
-from database import engine, get_db
-from deployment import DeploymentExecutor
-
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+import job_queue
+import stats
+from database import ensure_schema, get_db, get_async_db, count_queries, SessionLocal, AsyncSessionLocal
+from deployment import DeploymentExecutor, ExecutionResult
+from batch import DEPLOYMENT_BATCH_SCRIPTS
+from scheduler import run_batched_fan_out, run_fan_out
+from ssh_pool import ssh_pool
+from winrm_pool import winrm_cache
+from log_writer import log_writer
+from log_bridge import LogBridge
+import log_archive
+import log_export
+import log_search
+import probe
+import relay
+from broadcast import ConnectionManager
+
+# Create database tables, and columns and indexes added since the database was created
+ensure_schema()
+
+# Backfill dashboard counters and the log search index for databases created before they existed
+with SessionLocal() as db:
+    stats.ensure_counters(db)
+    log_search.ensure_index(db)
 
 app = FastAPI(title="DeployMaster", version="1.0.0")
 
@@ -25,27 +49,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Report the number of SQL statements each request ran (X-SQL-Query-Count header)
+if os.getenv("DEBUG_SQL_QUERY_COUNT"):
+    @app.middleware("http")
+    async def add_query_count_header(request, call_next):
+        with count_queries() as query_count:
+            response = await call_next(request)
+        response.headers["X-SQL-Query-Count"] = str(query_count.count)
+        return response
+
 # WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, WebSocket] = {}
+manager = ConnectionManager()
 
-    async def connect(self, deployment_id: int, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[deployment_id] = websocket
+# Carries log lines from executor threads to the WebSocket broadcaster (bound on startup)
+log_bridge: LogBridge = None
 
-    def disconnect(self, deployment_id: int):
-        if deployment_id in self.active_connections:
-            del self.active_connections[deployment_id]
+# Seconds between database polls when relaying logs written by queue workers
+LOG_RELAY_INTERVAL = float(os.getenv("LOG_RELAY_INTERVAL", "0.25"))
 
-    async def send_log(self, deployment_id: int, message: str):
-        if deployment_id in self.active_connections:
-            try:
-                await self.active_connections[deployment_id].send_text(message)
-            except:
-                self.disconnect(deployment_id)
+# Deployment id -> task relaying its worker-written logs to WebSocket clients
+log_relays: dict = {}
 
-manager = ConnectionManager()
+# Claims the jobs of deployments run inside this API process (inline mode)
+INLINE_WORKER_ID = f"api:{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+@app.on_event("startup")
+async def start_log_bridge():
+    global log_bridge
+    log_bridge = LogBridge(asyncio.get_running_loop(), manager.send_log)
+    log_bridge.start()
+
+@app.on_event("startup")
+async def start_log_archival():
+    if log_archive.LOG_ARCHIVE_INTERVAL > 0:
+        asyncio.create_task(run_log_archival())
+
+async def run_log_archival():
+    """Compress and expire the logs of old finished deployments in the background (see log_archive.py)"""
+    def archive_pass():
+        with SessionLocal() as db:
+            return log_archive.run_archival(db)
+    
+    while True:
+        await asyncio.sleep(log_archive.LOG_ARCHIVE_INTERVAL)
+        try:
+            counts = await asyncio.to_thread(archive_pass)
+        except Exception:
+            logger.exception("Log archival pass failed")
+            continue
+        if counts["archived"] or counts["moved"] or counts["pruned"]:
+            logger.info(
+                f"🗜️  Archived {counts['archived']} deployment logs "
+                f"({counts['bytes_before']} -> {counts['bytes_after']} bytes), "
+                f"moved {counts['moved']}, pruned {counts['pruned']}"
+            )
+
+@app.on_event("shutdown")
+async def close_background_resources():
+    """Close pooled remote connections and flush buffered logs on shutdown"""
+    await log_bridge.stop()
+    ssh_pool.close_all()
+    winrm_cache.close_all()
+    log_writer.stop()
 
 # ==================== Applications ====================
 
@@ -65,7 +132,10 @@ def get_application(application_id: int, db: Session = Depends(get_db)):
 @app.post("/api/applications", response_model=schemas.Application, status_code=201)
 def create_application(application: schemas.ApplicationCreate, db: Session = Depends(get_db)):
     """Create new application"""
-    return crud.create_application(db, application)
+    try:
+        return crud.create_application(db, application)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/api/applications/{application_id}", response_model=schemas.Application)
 def update_application(
@@ -74,7 +144,10 @@ def update_application(
     db: Session = Depends(get_db)
 ):
     """Update application"""
-    updated = crud.update_application(db, application_id, application)
+    try:
+        updated = crud.update_application(db, application_id, application)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not updated:
         raise HTTPException(status_code=404, detail="Application not found")
     return updated
@@ -93,6 +166,16 @@ def list_servers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db))
     """Get all servers"""
     return crud.get_servers(db, skip=skip, limit=limit)
 
+@app.post("/api/servers/probe", response_model=List[schemas.ServerProbe])
+async def probe_servers(request: schemas.ServerProbeRequest, db: AsyncSession = Depends(get_async_db)):
+    """Check SSH/WinRM reachability of servers concurrently (every server when no ids are given)"""
+    servers = await db.run_sync(crud.get_servers_by_ids, request.server_ids)
+    results = await probe.probe_servers(servers, refresh=request.refresh)
+    return [
+        schemas.ServerProbe(hostname=server.hostname, **results[server.id]._asdict())
+        for server in servers
+    ]
+
 @app.get("/api/servers/{server_id}", response_model=schemas.Server)
 def get_server(server_id: int, db: Session = Depends(get_db)):
     """Get specific server"""
@@ -116,6 +199,10 @@ def update_server(
     updated = crud.update_server(db, server_id, server)
     if not updated:
         raise HTTPException(status_code=404, detail="Server not found")
+    # Drop pooled connections and probe results for the old address or credentials
+    ssh_pool.evict(server_id)
+    winrm_cache.evict(server_id)
+    probe.probe_cache.evict(server_id)
     return updated
 
 @app.delete("/api/servers/{server_id}")
@@ -123,109 +210,490 @@ def delete_server(server_id: int, db: Session = Depends(get_db)):
     """Delete server"""
     if not crud.delete_server(db, server_id):
         raise HTTPException(status_code=404, detail="Server not found")
+    ssh_pool.evict(server_id)
+    winrm_cache.evict(server_id)
+    probe.probe_cache.evict(server_id)
     return {"message": "Server deleted successfully"}
 
 # ==================== Deployments ====================
 
-@app.get("/api/deployments", response_model=List[schemas.Deployment])
-def list_deployments(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all deployments"""
-    return crud.get_deployments(db, skip=skip, limit=limit)
+@app.get("/api/deployments", response_model=schemas.DeploymentPage)
+def list_deployments(
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """Get deployment summaries, newest first, one page at a time"""
+    try:
+        return crud.get_deployment_summaries(db, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/deployments/{deployment_id}", response_model=schemas.Deployment)
 def get_deployment(deployment_id: int, db: Session = Depends(get_db)):
     """Get specific deployment"""
-    deployment = crud.get_deployment(db, deployment_id)
+    deployment = crud.get_deployment(db, deployment_id, with_targets=True)
     if not deployment:
         raise HTTPException(status_code=404, detail="Deployment not found")
     return deployment
 
+@app.get("/api/deployments/{deployment_id}/log-chunks", response_model=List[schemas.DeploymentLogChunk])
+def get_deployment_log_chunks(
+    deployment_id: int,
+    after_sequence: int = -1,
+    limit: int = Query(default=1000, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """Get a range of deployment log chunks, in order, after a sequence number"""
+    deployment = crud.get_deployment(db, deployment_id)
+    if not deployment:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    chunks = crud.get_deployment_log_chunks(db, deployment_id, after_sequence=after_sequence, limit=limit)
+    if not chunks and deployment.completed_at is not None:
+        # Old finished deployments keep their chunks in a compressed archive
+        chunks = log_archive.archived_chunks(db, deployment_id, after_sequence=after_sequence, limit=limit)
+    return chunks
+
+@app.get("/api/deployments/{deployment_id}/logs")
+def download_deployment_logs(
+    deployment_id: int,
+    request: Request,
+    format: str = Query(default="text", pattern="^(text|ndjson)$"),
+    offset: Optional[int] = Query(default=None, ge=0),
+    tail: Optional[int] = Query(default=None, ge=1),
+    server_id: Optional[int] = None,
+    application_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Stream a deployment's log as plain text or NDJSON: whole, from a byte offset or Range, or its last lines"""
+    if not crud.get_deployment(db, deployment_id):
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    if offset is not None and (format != "text" or tail is not None):
+        raise HTTPException(status_code=400, detail="offset applies to format=text without tail")
+    
+    filters = {"server_id": server_id, "application_id": application_id}
+    extension = "ndjson" if format == "ndjson" else "log"
+    headers = {"Content-Disposition": f'inline; filename="deployment-{deployment_id}.{extension}"'}
+    status_code = 200
+    if format == "ndjson":
+        produce = lambda reader: reader.ndjson(tail=tail)
+    elif tail is not None:
+        produce = lambda reader: reader.tail_text(tail)
+    else:
+        headers["Accept-Ranges"] = "bytes"
+        start, end = offset or 0, None
+        range_header = request.headers.get("range")
+        if range_header and offset is None:
+            size = log_export.LogReader(db, deployment_id, **filters).text_size()
+            try:
+                byte_range = log_export.parse_range(range_header, size)
+            except log_export.RangeNotSatisfiable:
+                raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = 206
+                headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+                headers["Content-Length"] = str(end - start)
+        produce = lambda reader: reader.text(start, end)
+    
+    def stream():
+        # The request's session is closed before the body is sent
+        with SessionLocal() as session:
+            yield from produce(log_export.LogReader(session, deployment_id, **filters))
+    
+    body = stream()
+    # Byte ranges refer to the uncompressed log, so partial responses are never compressed
+    if status_code == 200 and log_export.accepts_gzip(request.headers.get("accept-encoding")):
+        body = log_export.gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/plain"
+    return StreamingResponse(body, status_code=status_code, media_type=media_type, headers=headers)
+
+@app.get("/api/logs/search", response_model=schemas.LogSearchPage)
+def search_logs(
+    q: str = Query(min_length=1),
+    syntax: str = Query(default="phrase", pattern="^(phrase|fts)$"),
+    deployment_id: Optional[int] = None,
+    server_id: Optional[int] = None,
+    application_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Search stored deployment logs, newest match first, one page at a time"""
+    try:
+        return log_search.search_logs(
+            db, q, syntax=syntax, deployment_id=deployment_id, server_id=server_id,
+            application_id=application_id, since=since, until=until, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/api/deployments", response_model=schemas.Deployment, status_code=201)
 async def create_deployment(
     deployment: schemas.DeploymentCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create and execute new deployment"""
-    # Create deployment record
-    db_deployment = crud.create_deployment(db, deployment)
+    # Create deployment record (serialized inside run_sync, where lazy loads are allowed)
+    try:
+        db_deployment = await db.run_sync(
+            lambda session: schemas.Deployment.model_validate(crud.create_deployment(session, deployment))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    await start_deployment(db, db_deployment.id)
+    return db_deployment
+
+@app.get("/api/deployments/{deployment_id}/results", response_model=List[schemas.DeploymentResult])
+def get_deployment_results(
+    deployment_id: int,
+    status: Optional[models.JobStatus] = None,
+    db: Session = Depends(get_db)
+):
+    """Get the per server x application results of a deployment"""
+    if not crud.get_deployment(db, deployment_id):
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    return crud.get_deployment_results(db, deployment_id, statuses=[status] if status else None)
+
+@app.post("/api/deployments/{deployment_id}/retry", response_model=schemas.Deployment, status_code=201)
+async def retry_deployment(deployment_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Create and execute a deployment of only the failed and skipped targets of a finished one"""
+    original = await db.run_sync(crud.get_deployment, deployment_id)
+    if not original:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    if original.status in (models.DeploymentStatus.PENDING, models.DeploymentStatus.RUNNING):
+        raise HTTPException(status_code=409, detail="Deployment is still running")
     
-    # Start deployment in background
-    asyncio.create_task(execute_deployment_background(db_deployment.id, db_deployment))
+    def create_retry(session: Session):
+        retry = crud.create_retry_deployment(session, deployment_id)
+        return schemas.Deployment.model_validate(retry) if retry else None
     
+    try:
+        db_deployment = await db.run_sync(create_retry)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if db_deployment is None:
+        raise HTTPException(status_code=400, detail="No failed or skipped targets that can be retried")
+    
+    await start_deployment(db, db_deployment.id)
     return db_deployment
 
-async def execute_deployment_background(deployment_id: int, deployment: models.Deployment):
+async def start_deployment(db: AsyncSession, deployment_id: int):
+    """Run a newly created deployment's jobs in this process or hand them to workers"""
+    if job_queue.DEPLOYMENT_EXECUTION == "queue":
+        # Hand the jobs to worker processes and follow their output from the database
+        if probe.DEPLOYMENT_PREFLIGHT or relay.ARTIFACT_DISTRIBUTION == "relay":
+            asyncio.create_task(prepare_and_enqueue(deployment_id))
+        else:
+            await db.run_sync(job_queue.enqueue_deployment, deployment_id)
+        ensure_log_relay(deployment_id)
+    else:
+        # Start deployment in background
+        asyncio.create_task(execute_deployment_background(deployment_id))
+
+def deployment_logger(deployment_id: int):
+    """Log function (server_id, message) for deployment-level lines outside of jobs"""
+    if job_queue.DEPLOYMENT_EXECUTION == "queue":
+        # The log relay forwards persisted lines, so only persist them here
+        return lambda server_id, message: log_writer.write(deployment_id, message, server_id)
+    return lambda server_id, message: log_bridge.emit(deployment_id, message, server_id)
+
+async def preflight(deployment_id: int, servers: list, jobs: list) -> set:
+    """Probe every server with queued jobs and skip the jobs of unreachable ones. Returns their ids."""
+    targets = [server for server in servers if any(job.server_id == server.id for job in jobs)]
+    try:
+        results = await probe.probe_servers(targets)
+    except Exception as e:
+        # Skip the jobs rather than run them unprobed or leave them queued
+        results = {
+            server.id: probe.ProbeResult(server.id, False, None, f"pre-flight failed: {e}", datetime.utcnow())
+            for server in targets
+        }
+    unreachable = [server for server in targets if not results[server.id].reachable]
+    
+    log = deployment_logger(deployment_id)
+    log(None, f"📡 Pre-flight: {len(targets) - len(unreachable)} of {len(targets)} servers reachable\n")
+    reasons = {}
+    for server in unreachable:
+        error = results[server.id].error
+        log(server.id, f"⛔ {server.hostname} is unreachable ({error}), skipping its applications\n")
+        reasons.setdefault(f"{job_queue.UNREACHABLE_REASON} ({error})", []).append(server.id)
+    if reasons:
+        async with AsyncSessionLocal() as db:
+            for reason, server_ids in reasons.items():
+                await db.run_sync(job_queue.skip_server_jobs, deployment_id, server_ids, reason)
+    return {server.id for server in unreachable}
+
+async def relay_installers(deployment_id: int, servers: list, applications: list, jobs: list):
+    """Pre-stage a deployment's installers on its Linux targets through relay trees"""
+    servers_by_id = {server.id: server for server in servers}
+    applications_by_id = {application.id: application for application in applications}
+    pairs = [
+        (servers_by_id[job.server_id], applications_by_id[job.application_id])
+        for job in jobs
+        if job.server_id in servers_by_id and job.application_id in applications_by_id
+    ]
+    await asyncio.to_thread(relay.distribute_installers, pairs, deployment_logger(deployment_id))
+
+async def prepare_and_enqueue(deployment_id: int):
+    """
+    Queue mode: probe targets and relay installers while the deployment is pending,
+    then release its jobs to workers
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            servers, applications, _, _ = await db.run_sync(crud.get_detached_deployment_targets, deployment_id)
+            jobs = await db.run_sync(crud.get_deployment_results, deployment_id)
+            if probe.DEPLOYMENT_PREFLIGHT:
+                unreachable = await preflight(deployment_id, servers, jobs)
+                jobs = [job for job in jobs if job.server_id not in unreachable]
+            if relay.ARTIFACT_DISTRIBUTION == "relay":
+                await relay_installers(deployment_id, servers, applications, jobs)
+        finally:
+            await asyncio.to_thread(log_writer.flush)
+            await db.run_sync(job_queue.enqueue_deployment, deployment_id)
+
+def ensure_log_relay(deployment_id: int):
+    """Start relaying a queued deployment's logs unless a relay is already running"""
+    if deployment_id not in log_relays:
+        log_relays[deployment_id] = asyncio.create_task(relay_worker_logs(deployment_id))
+
+async def relay_worker_logs(deployment_id: int):
+    """Forward log chunks written by queue workers to WebSocket clients until the deployment finishes"""
+    after_sequence = -1
+    try:
+        while True:
+            # A fresh session per poll, so each read sees the workers' latest commits
+            async with AsyncSessionLocal() as db:
+                # Status first: workers flush their logs before finishing, so a finished
+                # deployment's chunks are all visible to the read that follows
+                db_deployment = await db.run_sync(crud.get_deployment, deployment_id)
+                if db_deployment is None:
+                    return
+                finished = db_deployment.status in (models.DeploymentStatus.SUCCESS, models.DeploymentStatus.FAILED)
+                chunks = await db.run_sync(
+                    crud.get_deployment_log_chunks, deployment_id, after_sequence=after_sequence, limit=1000
+                )
+            for chunk in chunks:
+                await manager.send_log(deployment_id, chunk.content, chunk.server_id, chunk.application_id)
+                after_sequence = chunk.sequence
+            if len(chunks) == 1000:
+                continue
+            if finished:
+                await manager.send_log(
+                    deployment_id,
+                    f"\n{'='*60}\n✅ Deployment completed! ({db_deployment.status.value})\n{'='*60}\n"
+                )
+                manager.flush(deployment_id)
+                return
+            await asyncio.sleep(LOG_RELAY_INTERVAL)
+    finally:
+        log_relays.pop(deployment_id, None)
+
+async def execute_deployment_background(deployment_id: int):
     """Execute deployment in background with live logging"""
-    from database import SessionLocal
-    db = SessionLocal()
+    # Database work runs through aiosqlite so commits don't block the event loop
+    db = AsyncSessionLocal()
     
     try:
         # Update status to running
-        crud.update_deployment_status(db, deployment_id, models.DeploymentStatus.RUNNING)
+        await db.run_sync(crud.update_deployment_status, deployment_id, models.DeploymentStatus.RUNNING)
+        
+        servers, applications, max_parallel, max_retries = await db.run_sync(
+            crud.get_detached_deployment_targets, deployment_id
+        )
+        jobs = await db.run_sync(job_queue.claim_deployment, deployment_id, INLINE_WORKER_ID)
+        if probe.DEPLOYMENT_PREFLIGHT:
+            unreachable = await preflight(deployment_id, servers, jobs)
+            jobs = [job for job in jobs if job.server_id not in unreachable]
+        job_ids = {(job.server_id, job.application_id): job.id for job in jobs}
+        prerequisites = {(job.server_id, job.application_id): job.depends_on or [] for job in jobs}
+        applications_by_id = {application.id: application for application in applications}
+        server_waves = {job.server_id: job.wave for job in jobs}
+        lanes = [
+            (server, [applications_by_id[job.application_id] for job in jobs if job.server_id == server.id])
+            for server in servers
+            if server.id in server_waves
+        ]
+        waves = sorted(set(server_waves.values()))
+        
+        if relay.ARTIFACT_DISTRIBUTION == "relay":
+            await relay_installers(deployment_id, servers, applications, jobs)
         
-        all_success = True
+        async def record_job(call, *args, **kwargs):
+            # Lanes run concurrently, so each result write gets its own session
+            async with AsyncSessionLocal() as session:
+                return await session.run_sync(call, *args, **kwargs)
         
-        # Execute for each server x application combination
-        for server in deployment.servers:
-            for application in deployment.applications:
-                # Check OS compatibility
-                if server.os_type != application.os_type:
-                    log_msg = f"⚠️  Skipping {application.name} on {server.hostname} - OS type mismatch\n"
-                    await manager.send_log(deployment_id, log_msg)
-                    crud.update_deployment_status(db, deployment_id, models.DeploymentStatus.RUNNING, log_msg)
-                    continue
-                
-                # Create log callback
-                async def log_callback(message: str):
-                    await manager.send_log(deployment_id, message)
-                    crud.update_deployment_status(db, deployment_id, models.DeploymentStatus.RUNNING, message)
-                
-                # Execute deployment
-                success, output = await DeploymentExecutor.execute_deployment_async(
-                    server, application, log_callback
+        async def run_job(server: models.Server, application: models.Application):
+            job_id = job_ids[(server.id, application.id)]
+            if not await record_job(job_queue.start_job, job_id, INLINE_WORKER_ID):
+                # Skipped after too many server failures
+                return None
+            
+            # Called from executor threads; persists and forwards lines to the event loop
+            log_callback = log_bridge.callback(deployment_id, server.id, application.id)
+            
+            # Execute deployment
+            try:
+                result = await DeploymentExecutor.execute_deployment_async(
+                    server, application, log_callback, max_retries
                 )
-                
-                if not success:
-                    all_success = False
+            except Exception as e:
+                result = ExecutionResult(models.JobStatus.FAILED, str(e))
+            return await record_result(server, application, result)
         
-        # Update final status
-        final_status = models.DeploymentStatus.SUCCESS if all_success else models.DeploymentStatus.FAILED
-        crud.update_deployment_status(
-            db, 
-            deployment_id, 
-            final_status,
-            error_message=None if all_success else "Some deployments failed"
-        )
+        async def record_result(server: models.Server, application: models.Application, result: ExecutionResult):
+            await record_job(
+                job_queue.finish_job, job_ids[(server.id, application.id)], INLINE_WORKER_ID, result.status,
+                result.output, exit_code=result.exit_code, duration=result.duration, retries=result.attempts - 1
+            )
+            if result.status == models.JobStatus.FAILED and await record_job(
+                job_queue.check_failure_threshold, deployment_id,
+                log_callback=log_bridge.callback(deployment_id)
+            ):
+                halted.set()
+            
+            if result.status == models.JobStatus.SKIPPED:
+                return None
+            return schemas.DeploymentLog(
+                server_id=server.id,
+                server_hostname=server.hostname,
+                application_id=application.id,
+                application_name=application.name,
+                output=result.output,
+                success=result.success
+            )
+        
+        async def skip_job(server: models.Server, application: models.Application, reason: str):
+            # Jobs already skipped after too many failures are left as they are
+            if await record_job(
+                job_queue.finish_job, job_ids[(server.id, application.id)], INLINE_WORKER_ID,
+                models.JobStatus.SKIPPED, reason
+            ):
+                log_bridge.emit(deployment_id, f"⏭️  {reason}\n", server.id, application.id)
+        
+        async def run_lane(server: models.Server, lane_applications: List[models.Application]):
+            # All of a server's applications as one remote script; the executor thread
+            # records each step through the event loop as its markers arrive
+            loop = asyncio.get_running_loop()
+            lane_results = []
+            
+            def call(coroutine):
+                return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+            
+            def on_start(application_id: int) -> bool:
+                return call(record_job(job_queue.start_job, job_ids[(server.id, application_id)], INLINE_WORKER_ID))
+            
+            def on_finish(application_id: int, result: ExecutionResult):
+                log = call(record_result(server, applications_by_id[application_id], result))
+                if log is not None:
+                    lane_results.append(log)
+            
+            def on_skip(application_id: int, reason: str):
+                call(skip_job(server, applications_by_id[application_id], reason))
+            
+            try:
+                await DeploymentExecutor.execute_batch_async(
+                    server, lane_applications,
+                    {application.id: prerequisites[(server.id, application.id)] for application in lane_applications},
+                    lambda application_id: log_bridge.callback(deployment_id, server.id, application_id),
+                    on_start, on_finish, on_skip, max_retries
+                )
+            except Exception as e:
+                recorded = {result.application_id for result in lane_results}
+                lane_results.extend(
+                    schemas.DeploymentLog(
+                        server_id=server.id,
+                        server_hostname=server.hostname,
+                        application_id=application.id,
+                        application_name=application.name,
+                        output=str(e),
+                        success=False
+                    )
+                    for application in lane_applications
+                    if application.id not in recorded
+                )
+            return lane_results
+        
+        # Rollout waves run one after another; within a wave servers run in parallel
+        # and applications on the same server follow their dependencies
+        results = []
+        halted = asyncio.Event()
+        for index, wave in enumerate(waves):
+            if halted.is_set():
+                # The remaining waves' jobs have been skipped
+                break
+            if len(waves) > 1:
+                await db.run_sync(job_queue.start_wave, deployment_id, wave)
+                log_bridge.emit(deployment_id, f"\n🌊 Starting wave {index + 1} of {len(waves)}\n")
+            wave_lanes = [(server, lane) for server, lane in lanes if server_waves[server.id] == wave]
+            if DEPLOYMENT_BATCH_SCRIPTS:
+                results.extend(await run_batched_fan_out(wave_lanes, run_lane, max_parallel))
+            else:
+                results.extend(await run_fan_out(wave_lanes, run_job, max_parallel, prerequisites, skip_job))
+        
+        # Deliver and persist every line before the deployment is marked finished
+        await log_bridge.drain()
+        await asyncio.to_thread(log_writer.flush)
+        
+        failed = [result for result in results if not result.success]
+        
+        # Final status and error message from the recorded job results
+        if await db.run_sync(job_queue.finalize_deployment, deployment_id) is None:
+            # A job was left unfinished by an unexpected error
+            await db.run_sync(
+                crud.update_deployment_status,
+                deployment_id,
+                models.DeploymentStatus.FAILED,
+                error_message=f"{len(failed)} of {len(results)} deployments failed"
+            )
         
         # Send completion message
         await manager.send_log(
             deployment_id, 
-            f"\n{'='*60}\n✅ Deployment completed!\n{'='*60}\n"
+            f"\n{'='*60}\n✅ Deployment completed! "
+            f"({len(results) - len(failed)} succeeded, {len(failed)} failed)\n{'='*60}\n"
         )
+        manager.flush(deployment_id)
         
     except Exception as e:
         error_msg = f"Deployment error: {str(e)}"
-        crud.update_deployment_status(
-            db, 
-            deployment_id, 
+        await log_bridge.drain()
+        await asyncio.to_thread(log_writer.flush)
+        await db.run_sync(
+            crud.update_deployment_status,
+            deployment_id,
             models.DeploymentStatus.FAILED,
             error_message=error_msg
         )
         await manager.send_log(deployment_id, f"\n❌ {error_msg}\n")
+        manager.flush(deployment_id)
     
     finally:
-        db.close()
+        await db.close()
 
 @app.websocket("/ws/deployments/{deployment_id}")
-async def deployment_websocket(websocket: WebSocket, deployment_id: int):
-    """WebSocket endpoint for live deployment logs"""
-    await manager.connect(deployment_id, websocket)
+async def deployment_websocket(websocket: WebSocket, deployment_id: int, offset: Optional[int] = None):
+    """WebSocket endpoint for live deployment logs, replaying buffered output from offset"""
+    subscriber = await manager.connect(deployment_id, websocket, offset)
+    if job_queue.DEPLOYMENT_EXECUTION == "queue" and deployment_id not in log_relays:
+        # Pick up deployments queued before this API process started
+        async with AsyncSessionLocal() as db:
+            db_deployment = await db.run_sync(crud.get_deployment, deployment_id)
+        if db_deployment is not None and db_deployment.status in (models.DeploymentStatus.PENDING, models.DeploymentStatus.RUNNING):
+            ensure_log_relay(deployment_id)
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(deployment_id)
+        manager.disconnect(deployment_id, subscriber)
 
 # ==================== Dashboard ====================
 
@@ -243,4 +711,5 @@ def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=9090, reload=True)
+    # The websockets implementation negotiates permessage-deflate for the log stream
+    uvicorn.run("main:app", host="0.0.0.0", port=9090, reload=True, ws="websockets", ws_per_message_deflate=True)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Enum, Index, Float, JSON, LargeBinary
+from sqlalchemy.orm import deferred, relationship, object_session
 from datetime import datetime
 import enum
 from database import Base
@@ -14,18 +14,38 @@ class DeploymentStatus(str, enum.Enum):
     SUCCESS = "success"
     FAILED = "failed"
 
+class DeploymentStrategy(str, enum.Enum):
+    ALL_AT_ONCE = "all_at_once"
+    ROLLING = "rolling"
+    CANARY = "canary"
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
 # Association table for many-to-many relationship
 deployment_applications = Table(
     'deployment_applications',
     Base.metadata,
-    Column('deployment_id', Integer, ForeignKey('deployments.id')),
+    Column('deployment_id', Integer, ForeignKey('deployments.id'), index=True),
     Column('application_id', Integer, ForeignKey('applications.id'))
 )
 
+# Application -> applications that must be installed on a server before it
+application_dependencies = Table(
+    'application_dependencies',
+    Base.metadata,
+    Column('application_id', Integer, ForeignKey('applications.id'), primary_key=True),
+    Column('depends_on_id', Integer, ForeignKey('applications.id'), primary_key=True)
+)
+
 deployment_servers = Table(
     'deployment_servers',
     Base.metadata,
-    Column('deployment_id', Integer, ForeignKey('deployments.id')),
+    Column('deployment_id', Integer, ForeignKey('deployments.id'), index=True),
     Column('server_id', Integer, ForeignKey('servers.id'))
 )
 
@@ -37,6 +57,7 @@ class Application(Base):
     version = Column(String)
     os_type = Column(Enum(OSType))
     installer_url = Column(String, nullable=True)
+    installer_sha256 = Column(String, nullable=True)  # Expected checksum of the installer_url download
     description = Column(Text, nullable=True)
     install_command = Column(Text)
     install_parameters = Column(Text, nullable=True)
@@ -44,6 +65,17 @@ class Application(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     deployments = relationship("Deployment", secondary=deployment_applications, back_populates="applications")
+    dependencies = relationship(
+        "Application",
+        secondary=application_dependencies,
+        primaryjoin=lambda: Application.id == application_dependencies.c.application_id,
+        secondaryjoin=lambda: Application.id == application_dependencies.c.depends_on_id,
+        backref="dependents"
+    )
+
+    @property
+    def dependency_ids(self) -> list:
+        return sorted(application.id for application in self.dependencies)
 
 class Server(Base):
     __tablename__ = "servers"
@@ -67,10 +99,120 @@ class Deployment(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     status = Column(Enum(DeploymentStatus), default=DeploymentStatus.PENDING)
-    logs = Column(Text, default="")
+    # Logs written before chunked storage; new output goes to deployment_log_chunks
+    legacy_logs = Column("logs", Text, default="")
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     error_message = Column(Text, nullable=True)
+    max_parallel = Column(Integer, nullable=True)  # Servers deployed at once (None = server default)
+    max_retries = Column(Integer, nullable=True)  # Retries after transient errors (None = server default)
+    retry_of_id = Column(Integer, ForeignKey('deployments.id'), nullable=True)  # Deployment this one retries
+    strategy = Column(Enum(DeploymentStrategy), default=DeploymentStrategy.ALL_AT_ONCE)
+    batch_size = Column(Integer, nullable=True)  # Servers per rolling wave / canary servers
+    batch_percent = Column(Integer, nullable=True)  # Same, as a percentage of the servers
+    max_failures = Column(Integer, nullable=True)  # Failed servers tolerated before the rest is skipped (None = no limit)
+    current_wave = Column(Integer, default=0)  # Wave whose servers may run now
     
     applications = relationship("Application", secondary=deployment_applications, back_populates="deployments")
     servers = relationship("Server", secondary=deployment_servers, back_populates="deployments")
+    
+    __table_args__ = (
+        # Keyset pagination of the deployment list (crud.get_deployment_summaries)
+        Index('ix_deployments_started_at_id', 'started_at', 'id'),
+    )
+
+    @property
+    def logs(self) -> str:
+        """Full log text, reassembled from the stored chunks on access"""
+        session = object_session(self)
+        if session is None:
+            return self.legacy_logs or ""
+        chunks = session.query(DeploymentLogChunk.content).filter(
+            DeploymentLogChunk.deployment_id == self.id
+        ).order_by(DeploymentLogChunk.sequence)
+        text = "".join(content for (content,) in chunks)
+        if not text and self.completed_at is not None:
+            # Finished deployments may have been compacted (see log_archive.py)
+            archive = session.get(DeploymentLogArchive, self.id)
+            if archive is not None:
+                import log_archive
+                return "".join(record["c"] for record in log_archive.iter_records(archive))
+        return (self.legacy_logs or "") + text
+
+class DeploymentLogChunk(Base):
+    __tablename__ = "deployment_log_chunks"
+    
+    id = Column(Integer, primary_key=True)
+    deployment_id = Column(Integer, ForeignKey('deployments.id'), nullable=False)
+    sequence = Column(Integer, nullable=False)  # Order within the deployment, starting at 0
+    server_id = Column(Integer, ForeignKey('servers.id'), nullable=True)
+    application_id = Column(Integer, ForeignKey('applications.id'), nullable=True)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_deployment_log_chunks_deployment_sequence', 'deployment_id', 'sequence', unique=True),
+    )
+
+class DeploymentLogArchive(Base):
+    """Compressed logs of a finished deployment, replacing its chunks (see log_archive.py)"""
+    __tablename__ = "deployment_log_archives"
+    
+    deployment_id = Column(Integer, ForeignKey('deployments.id'), primary_key=True)
+    codec = Column(String, nullable=False)  # gzip or zstd
+    # The chunks as compressed NDJSON; None once retention moved them to `path` or pruned them
+    data = deferred(Column(LargeBinary, nullable=True))
+    path = Column(String, nullable=True)
+    chunk_count = Column(Integer, nullable=False, default=0)
+    size = Column(Integer, nullable=False, default=0)  # Uncompressed log bytes
+    compressed_size = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    pruned_at = Column(DateTime, nullable=True)  # When retention deleted the logs
+
+class DeploymentLogArchiveEntry(Base):
+    """An archived chunk indexed in deployment_log_archive_search, by rowid (see log_search.py)"""
+    __tablename__ = "deployment_log_archive_entries"
+    
+    id = Column(Integer, primary_key=True)
+    deployment_id = Column(Integer, ForeignKey('deployments.id'), nullable=False, index=True)
+    sequence = Column(Integer, nullable=False)
+    server_id = Column(Integer, ForeignKey('servers.id'), nullable=True)
+    application_id = Column(Integer, ForeignKey('applications.id'), nullable=True)
+    created_at = Column(DateTime)
+
+class StatCounter(Base):
+    """Incrementally maintained dashboard counters (see stats.py)"""
+    __tablename__ = "stat_counters"
+    
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+    # Times the counter changed; their sum tells every process the dashboard changed
+    version = Column(Integer, nullable=False, default=0)
+
+class DeploymentJob(Base):
+    """One server x application install and its result, run inline or by a worker (see job_queue.py)"""
+    __tablename__ = "deployment_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    deployment_id = Column(Integer, ForeignKey('deployments.id'), nullable=False)
+    server_id = Column(Integer, ForeignKey('servers.id'), nullable=False)
+    application_id = Column(Integer, ForeignKey('applications.id'), nullable=False)
+    position = Column(Integer, nullable=False)  # Run order among the jobs of the same server
+    wave = Column(Integer, default=0, nullable=False)  # Rollout wave of the server (see scheduler.plan_waves)
+    depends_on = Column(JSON, nullable=True)  # Application ids that must succeed on the server first
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED, nullable=False)
+    # Worker holding the server's lane and until when, set together for all jobs of the lane
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    exit_code = Column(Integer, nullable=True)  # None when the command never ran to completion
+    duration = Column(Float, nullable=True)  # Seconds, including automatic retries
+    output = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_deployment_jobs_lane', 'deployment_id', 'server_id', 'position'),
+        Index('ix_deployment_jobs_status', 'status', 'claimed_by'),
+    )
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlparse
+import models
+from winrm_pool import WinRMSessionCache
+
+# Probe every target before a deployment installs anything, and skip the unreachable ones
+DEPLOYMENT_PREFLIGHT = os.getenv("DEPLOYMENT_PREFLIGHT", "true").lower() in ("1", "true", "yes")
+# Seconds a single probe may take (connect plus SSH banner / WinRM response)
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "3"))
+# Seconds a probe result is reused
+PROBE_CACHE_TTL = int(os.getenv("PROBE_CACHE_TTL", "60"))
+# Probes running at once
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "100"))
+
+PROBE_SSH_BANNER = b"SSH-2.0-DeployMaster_probe\r\n"
+
+class ProbeResult(NamedTuple):
+    server_id: int
+    reachable: bool
+    latency_ms: Optional[float]
+    error: Optional[str]
+    checked_at: datetime
+    cached: bool = False
+
+class ReachabilityCache:
+    """Recent probe results by server, dropped when they expire or the server's address changes"""
+
+    def __init__(self, ttl: int = PROBE_CACHE_TTL):
+        self.ttl = ttl
+        self._results: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(server: models.Server) -> tuple:
+        return (server.ip_address, server.port, server.os_type)
+
+    def get(self, server: models.Server) -> Optional[ProbeResult]:
+        with self._lock:
+            entry = self._results.get(server.id)
+        if entry is None:
+            return None
+        key, expires_at, result = entry
+        if key != self.cache_key(server) or time.monotonic() >= expires_at:
+            return None
+        return result._replace(cached=True)
+
+    def put(self, server: models.Server, result: ProbeResult):
+        with self._lock:
+            self._results[server.id] = (self.cache_key(server), time.monotonic() + self.ttl, result)
+
+    def evict(self, server_id: int):
+        with self._lock:
+            self._results.pop(server_id, None)
+
+async def _probe_ssh(server: models.Server):
+    """Connect and exchange SSH identification banners, without authenticating"""
+    reader, writer = await asyncio.open_connection(server.ip_address, server.port)
+    try:
+        banner = await reader.readline()
+        if not banner.startswith(b"SSH-"):
+            raise ConnectionError(f"Not an SSH server (got {banner[:40]!r})")
+        # Lets sshd log a closed connection rather than a missing identification string
+        writer.write(PROBE_SSH_BANNER)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def _probe_winrm(server: models.Server):
+    """Connect to the WinRM listener and check that it answers HTTP (an unauthenticated 401 is fine)"""
+    endpoint = urlparse(WinRMSessionCache.endpoint(server))
+    reader, writer = await asyncio.open_connection(endpoint.hostname, endpoint.port)
+    try:
+        writer.write(
+            f"POST {endpoint.path} HTTP/1.1\r\nHost: {endpoint.netloc}\r\n"
+            f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode()
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line.startswith(b"HTTP/"):
+            raise ConnectionError(f"Not a WinRM listener (got {status_line[:40]!r})")
+    finally:
+        writer.close()
+
+async def probe_server(server: models.Server, timeout: float = PROBE_TIMEOUT) -> ProbeResult:
+    """Probe one server over the protocol deployments use for it"""
+    probe = _probe_winrm if server.os_type == models.OSType.WINDOWS else _probe_ssh
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(probe(server), timeout)
+    except asyncio.TimeoutError:
+        return ProbeResult(server.id, False, None, f"No response within {timeout:g}s", datetime.utcnow())
+    except OSError as e:
+        return ProbeResult(server.id, False, None, e.strerror or str(e), datetime.utcnow())
+    except Exception as e:
+        # E.g. an invalid hostname (UnicodeError) or a peer sending a line over the stream limit (ValueError)
+        return ProbeResult(server.id, False, None, str(e) or type(e).__name__, datetime.utcnow())
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    return ProbeResult(server.id, True, latency_ms, None, datetime.utcnow())
+
+async def probe_servers(servers: List[models.Server], refresh: bool = False) -> Dict[int, ProbeResult]:
+    """Probe servers concurrently, reusing cached results unless refresh is set. Returns server id -> result."""
+    slots = asyncio.Semaphore(PROBE_CONCURRENCY)
+    results = {}
+
+    async def probe(server: models.Server):
+        cached = None if refresh else probe_cache.get(server)
+        if cached is not None:
+            results[server.id] = cached
+            return
+        async with slots:
+            result = await probe_server(server)
+        probe_cache.put(server, result)
+        results[server.id] = result
+
+    await asyncio.gather(*(probe(server) for server in servers))
+    return results
+
+probe_cache = ReachabilityCache()
@@ -0,0 +1,212 @@
+import os
+import posixpath
+import shlex
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import models
+from artifacts import (
+    Artifact, ChecksumMismatch, artifact_cache, linux_sha256, push_linux,
+    remote_path, rewrite_install_command
+)
+from ssh_pool import ssh_pool
+
+# "direct" pushes installers from the controller to every target;
+# "relay" lets Linux targets that already have an installer serve the next wave
+ARTIFACT_DISTRIBUTION = os.getenv("ARTIFACT_DISTRIBUTION", "direct")
+# Targets each holder (and the controller) serves per wave
+ARTIFACT_RELAY_FANOUT = int(os.getenv("ARTIFACT_RELAY_FANOUT", "3"))
+# Transfers running at once within a wave
+ARTIFACT_RELAY_MAX_TRANSFERS = int(os.getenv("ARTIFACT_RELAY_MAX_TRANSFERS", "32"))
+# Seconds a relay source keeps serving, and a target keeps downloading, before giving up
+ARTIFACT_RELAY_TIMEOUT = int(os.getenv("ARTIFACT_RELAY_TIMEOUT", "600"))
+
+# (source server id or None for the controller, target server id)
+Transfer = Tuple[Optional[int], int]
+LogFunction = Callable[[Optional[int], str], None]
+
+# One-file HTTP server started on a relay source; serves the path only under a random token
+SOURCE_SCRIPT = """
+import http.server, os, sys, time
+path, token, deadline = sys.argv[1], sys.argv[2], time.time() + float(sys.argv[3])
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/" + token:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(1 << 20)
+                if not block:
+                    break
+                self.wfile.write(block)
+    def log_message(self, *args):
+        pass
+server = http.server.ThreadingHTTPServer(("0.0.0.0", 0), Handler)
+server.timeout = 1
+print("PORT", server.server_address[1], flush=True)
+while time.time() < deadline:
+    server.handle_request()
+"""
+
+def plan_relay_waves(server_ids: List[int], fanout: int = ARTIFACT_RELAY_FANOUT) -> List[List[Transfer]]:
+    """
+    Plan a fan-out tree as waves of transfers.
+    In every wave the controller and each server that received the file earlier
+    send it to up to `fanout` new servers, so the number of holders grows
+    geometrically while the controller only ever sends `fanout` copies per wave.
+    """
+    fanout = max(1, fanout)
+    holders: List[Optional[int]] = [None]
+    remaining = list(server_ids)
+    waves = []
+    while remaining:
+        wave = []
+        for source in holders:
+            for _ in range(fanout):
+                if not remaining:
+                    break
+                wave.append((source, remaining.pop(0)))
+        holders.extend(target for _, target in wave)
+        waves.append(wave)
+    return waves
+
+class RelaySource:
+    """A running one-file HTTP server on a server that holds the artifact"""
+
+    def __init__(self, server: models.Server, artifact: Artifact):
+        self.server = server
+        self.token = uuid.uuid4().hex
+        path = remote_path(artifact, models.OSType.LINUX)
+        self.ssh, _ = ssh_pool.acquire(server)
+        try:
+            command = (
+                f"python3 -c {shlex.quote(SOURCE_SCRIPT)} "
+                f"{shlex.quote(path)} {self.token} {ARTIFACT_RELAY_TIMEOUT}"
+            )
+            # With a pty the server dies with the channel when the source is stopped
+            _, self.stdout, _ = self.ssh.exec_command(command, get_pty=True)
+            first_line = self.stdout.readline().split()
+            if len(first_line) != 2 or first_line[0] != "PORT":
+                raise RuntimeError(f"Relay source on {server.hostname} did not start: {' '.join(first_line)}")
+            self.url = f"http://{server.ip_address}:{first_line[1]}/{self.token}"
+        except Exception:
+            ssh_pool.release(server, self.ssh, healthy=False)
+            raise
+
+    def stop(self):
+        self.stdout.channel.close()
+        ssh_pool.release(self.server, self.ssh, healthy=True)
+
+def pull_from_source(target: models.Server, source: RelaySource, artifact: Artifact):
+    """Have a Linux target download the artifact from a relay source, then verify it"""
+    path = remote_path(artifact, models.OSType.LINUX)
+    part_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+    quoted_part, url = shlex.quote(part_path), shlex.quote(source.url)
+    command = (
+        f"mkdir -p {shlex.quote(posixpath.dirname(path))} && "
+        f"(curl -fsS --max-time {ARTIFACT_RELAY_TIMEOUT} -o {quoted_part} {url} || "
+        f"wget -q -T {ARTIFACT_RELAY_TIMEOUT} -O {quoted_part} {url})"
+    )
+    ssh, _ = ssh_pool.acquire(target)
+    healthy = False
+    try:
+        _, stdout, stderr = ssh.exec_command(command)
+        exit_status = stdout.channel.recv_exit_status()
+        error_output = stderr.read().decode("utf-8", errors="replace").strip()
+        if exit_status != 0:
+            raise RuntimeError(f"Download from {source.server.hostname} failed ({exit_status}): {error_output}")
+        remote_sha256 = linux_sha256(ssh, part_path)
+        if remote_sha256 != artifact.sha256:
+            ssh.exec_command(f"rm -f {quoted_part}")[1].channel.recv_exit_status()
+            raise ChecksumMismatch(f"{artifact.filename} from {source.server.hostname} has SHA-256 {remote_sha256}")
+        ssh.exec_command(f"mv -f {quoted_part} {shlex.quote(path)}")[1].channel.recv_exit_status()
+        healthy = True
+    finally:
+        ssh_pool.release(target, ssh, healthy)
+
+def relay_artifact(servers: List[models.Server], artifact: Artifact, log: LogFunction) -> Dict[int, bool]:
+    """
+    Distribute an artifact to Linux servers in waves. A failed relay transfer falls
+    back to a direct push from the controller. Returns server id -> success.
+    """
+    servers_by_id = {server.id: server for server in servers}
+    fanout = max(1, ARTIFACT_RELAY_FANOUT)
+    # Each source group holds one connection to its source and one per target being served
+    group_limit = max(1, min(ARTIFACT_RELAY_MAX_TRANSFERS // fanout, ssh_pool.max_connections // (fanout + 1)))
+    holders: Dict[int, bool] = {}
+    waves = plan_relay_waves(list(servers_by_id), fanout)
+    log(None, f"🌳 Relaying {artifact.filename} to {len(servers)} servers in {len(waves)} waves\n")
+
+    def transfer(source: Optional[RelaySource], target_id: int) -> bool:
+        target = servers_by_id[target_id]
+        if source is not None:
+            try:
+                pull_from_source(target, source, artifact)
+                log(target_id, f"🔗 Received {artifact.filename} from {source.server.hostname} (verified)\n")
+                return True
+            except Exception as e:
+                log(target_id, f"⚠️  Relay from {source.server.hostname} failed, pushing directly: {e}\n")
+        try:
+            push_linux(target, artifact, lambda message: log(target_id, message))
+            return True
+        except Exception as e:
+            log(target_id, f"❌ Could not push {artifact.filename} to {target.hostname}: {e}\n")
+            return False
+
+    def serve_group(source_id: Optional[int], target_ids: List[int]) -> List[bool]:
+        """Send the artifact from one holder (or the controller) to its targets of the wave"""
+        source = None
+        if source_id is not None and holders.get(source_id):
+            try:
+                source = RelaySource(servers_by_id[source_id], artifact)
+            except Exception as e:
+                log(source_id, f"⚠️  Could not serve {artifact.filename} from {servers_by_id[source_id].hostname}: {e}\n")
+        try:
+            with ThreadPoolExecutor(max_workers=len(target_ids)) as targets_pool:
+                return list(targets_pool.map(lambda target_id: transfer(source, target_id), target_ids))
+        finally:
+            if source is not None:
+                source.stop()
+
+    with ThreadPoolExecutor(max_workers=group_limit) as pool:
+        for wave in waves:
+            groups: Dict[Optional[int], List[int]] = {}
+            for source_id, target_id in wave:
+                groups.setdefault(source_id, []).append(target_id)
+            group_results = pool.map(lambda group: serve_group(*group), groups.items())
+            for (_, target_ids), results in zip(groups.items(), group_results):
+                holders.update(zip(target_ids, results))
+    return holders
+
+def distribute_installers(
+    pairs: List[Tuple[models.Server, models.Application]],
+    log: LogFunction
+):
+    """
+    Pre-stage the installers of a deployment on its Linux targets through relay trees.
+    Jobs later find the file in place and skip their own push; Windows targets and
+    anything that failed here still get the direct push when their job runs.
+    """
+    targets: Dict[Tuple[str, Optional[str]], Dict[int, models.Server]] = {}
+    for server, application in pairs:
+        if server.os_type != models.OSType.LINUX or server.os_type != application.os_type:
+            continue
+        if not application.installer_url:
+            continue
+        if rewrite_install_command(application.install_command, application.installer_url, "", server.os_type) is None:
+            continue
+        key = (application.installer_url, application.installer_sha256)
+        targets.setdefault(key, {})[server.id] = server
+
+    for (url, expected_sha256), servers in targets.items():
+        try:
+            artifact = artifact_cache.fetch(url, expected_sha256)
+        except Exception as e:
+            # The jobs report the error themselves
+            log(None, f"⚠️  Could not fetch {url} for relay: {e}\n")
+            continue
+        relay_artifact(list(servers.values()), artifact, log)
@@ -0,0 +1,185 @@
+import asyncio
+import math
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import models
+import schemas
+
+# Maximum number of jobs running at once across all deployments
+MAX_PARALLEL_JOBS = int(os.getenv("MAX_PARALLEL_JOBS", "10"))
+# Default maximum number of servers deployed at once within a single deployment
+DEPLOYMENT_PARALLELISM = int(os.getenv("DEPLOYMENT_PARALLELISM", "10"))
+# Independent applications installed at once on the same server. Defaults to one after
+# another: concurrent installs each take their own SSH connection and fight over package
+# manager locks (apt/dpkg, msiexec), so only raise it for commands known to run side by side
+SERVER_JOB_PARALLELISM = int(os.getenv("SERVER_JOB_PARALLELISM", "1"))
+
+JobRunner = Callable[[models.Server, models.Application], Awaitable[Optional[schemas.DeploymentLog]]]
+# Runs every application of one server together (batched execution)
+LaneRunner = Callable[[models.Server, List[models.Application]], Awaitable[List[schemas.DeploymentLog]]]
+# Records a job that won't run because a prerequisite did not succeed
+JobSkipper = Callable[[models.Server, models.Application, str], Awaitable[None]]
+# (server id, application id) -> ids of the applications that must succeed on that server first
+Prerequisites = Dict[Tuple[int, int], List[int]]
+
+class DependencyCycle(ValueError):
+    def __init__(self, cycle: List[int]):
+        super().__init__(" -> ".join(str(node) for node in cycle))
+        self.cycle = cycle
+
+def topological_order(nodes: Iterable[int], prerequisites: Dict[int, Iterable[int]]) -> List[int]:
+    """
+    Order nodes so every node comes after its prerequisites, lowest id first among
+    nodes that are ready together. Prerequisites outside `nodes` are ignored.
+    Raises DependencyCycle with the nodes of one cycle.
+    """
+    nodes = set(nodes)
+    remaining = {node: {p for p in prerequisites.get(node, ()) if p in nodes} for node in nodes}
+    order = []
+    while remaining:
+        ready = sorted(node for node, waiting_for in remaining.items() if not waiting_for)
+        if not ready:
+            raise DependencyCycle(_find_cycle(remaining))
+        for node in ready:
+            del remaining[node]
+        for waiting_for in remaining.values():
+            waiting_for.difference_update(ready)
+        order.extend(ready)
+    return order
+
+def _find_cycle(graph: Dict[int, set]) -> List[int]:
+    """Follow prerequisites from any node of a graph where every node has one, until a node repeats"""
+    path = [min(graph)]
+    while True:
+        node = min(graph[path[-1]])
+        if node in path:
+            return path[path.index(node):] + [node]
+        path.append(node)
+
+def prerequisite_failed_message(server: models.Server, application: models.Application, prerequisite: str) -> str:
+    return f"Skipped {application.name} on {server.hostname}: prerequisite {prerequisite} did not succeed"
+
+_global_slots: Optional[asyncio.Semaphore] = None
+
+def plan_waves(
+    server_ids: List[int],
+    strategy: models.DeploymentStrategy,
+    batch_size: Optional[int] = None,
+    batch_percent: Optional[int] = None
+) -> Dict[int, int]:
+    """
+    Assign servers (in the given order) to rollout waves. Returns server id -> wave.
+    Rolling waves hold batch_size servers, or batch_percent of them (default
+    DEPLOYMENT_PARALLELISM); a canary wave holds batch_size servers (default 1)
+    and every other server goes into the second wave.
+    """
+    if strategy == models.DeploymentStrategy.ALL_AT_ONCE or not server_ids:
+        return {server_id: 0 for server_id in server_ids}
+
+    if batch_size is None and batch_percent is not None:
+        batch_size = math.ceil(len(server_ids) * batch_percent / 100)
+    if batch_size is None:
+        batch_size = 1 if strategy == models.DeploymentStrategy.CANARY else DEPLOYMENT_PARALLELISM
+    batch_size = max(1, batch_size)
+
+    if strategy == models.DeploymentStrategy.CANARY:
+        return {server_id: 0 if index < batch_size else 1 for index, server_id in enumerate(server_ids)}
+    return {server_id: index // batch_size for index, server_id in enumerate(server_ids)}
+
+def get_global_slots() -> asyncio.Semaphore:
+    """Semaphore shared by every deployment running in this process"""
+    global _global_slots
+    if _global_slots is None:
+        _global_slots = asyncio.Semaphore(MAX_PARALLEL_JOBS)
+    return _global_slots
+
+async def run_server_lane(
+    server: models.Server,
+    applications: List[models.Application],
+    run_job: JobRunner,
+    deployment_slots: asyncio.Semaphore,
+    prerequisites: Optional[Prerequisites] = None,
+    skip_job: Optional[JobSkipper] = None
+) -> List[schemas.DeploymentLog]:
+    """
+    Run every application on one server. Applications start once their prerequisites
+    have succeeded, up to SERVER_JOB_PARALLELISM at a time; an application whose
+    prerequisite failed or was skipped is skipped too.
+    `applications` must be in dependency order.
+    """
+    prerequisites = prerequisites or {}
+    names = {application.id: application.name for application in applications}
+    lane_slots = asyncio.Semaphore(SERVER_JOB_PARALLELISM)
+    runs: Dict[int, asyncio.Task] = {}
+
+    async def run(application: models.Application) -> Optional[schemas.DeploymentLog]:
+        for prerequisite_id in prerequisites.get((server.id, application.id), ()):
+            if prerequisite_id not in runs:
+                continue
+            prerequisite = await runs[prerequisite_id]
+            if prerequisite is None or not prerequisite.success:
+                if skip_job is not None:
+                    await skip_job(server, application, prerequisite_failed_message(
+                        server, application, names[prerequisite_id]
+                    ))
+                return None
+        async with lane_slots, get_global_slots():
+            try:
+                return await run_job(server, application)
+            except Exception as e:
+                return schemas.DeploymentLog(
+                    server_id=server.id,
+                    server_hostname=server.hostname,
+                    application_id=application.id,
+                    application_name=application.name,
+                    output=str(e),
+                    success=False
+                )
+
+    async with deployment_slots:
+        for application in applications:
+            runs[application.id] = asyncio.create_task(run(application))
+        results = await asyncio.gather(*runs.values())
+    return [result for result in results if result is not None]
+
+async def run_fan_out(
+    lanes: List[Tuple[models.Server, List[models.Application]]],
+    run_job: JobRunner,
+    max_parallel: Optional[int] = None,
+    prerequisites: Optional[Prerequisites] = None,
+    skip_job: Optional[JobSkipper] = None
+) -> List[schemas.DeploymentLog]:
+    """
+    Run (server, applications) lanes concurrently.
+    Servers run in parallel (bounded by the global and per-deployment limits),
+    applications on the same server follow their dependencies (see run_server_lane).
+    """
+    deployment_slots = asyncio.Semaphore(max_parallel or DEPLOYMENT_PARALLELISM)
+    lane_runs = [
+        run_server_lane(server, applications, run_job, deployment_slots, prerequisites, skip_job)
+        for server, applications in lanes
+    ]
+    results = []
+    for lane_results in await asyncio.gather(*lane_runs):
+        results.extend(lane_results)
+    return results
+
+async def run_batched_fan_out(
+    lanes: List[Tuple[models.Server, List[models.Application]]],
+    run_lane: LaneRunner,
+    max_parallel: Optional[int] = None
+) -> List[schemas.DeploymentLog]:
+    """
+    Run (server, applications) lanes concurrently with one runner call per server,
+    which takes one deployment slot and one global slot for the whole lane.
+    """
+    deployment_slots = asyncio.Semaphore(max_parallel or DEPLOYMENT_PARALLELISM)
+
+    async def run(server: models.Server, applications: List[models.Application]):
+        async with deployment_slots, get_global_slots():
+            return await run_lane(server, applications)
+
+    results = []
+    for lane_results in await asyncio.gather(*(run(server, applications) for server, applications in lanes)):
+        results.extend(lane_results)
+    return results
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
-from models import OSType, DeploymentStatus
+from models import OSType, DeploymentStatus, DeploymentStrategy, JobStatus
 
 # Application Schemas
 class ApplicationBase(BaseModel):
@@ -9,9 +9,12 @@ class ApplicationBase(BaseModel):
     version: str
     os_type: OSType
     installer_url: Optional[str] = None
+    installer_sha256: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{64}$")
     description: Optional[str] = None
     install_command: str
     install_parameters: Optional[str] = None
+    # Applications installed on a server before this one, when deployed together
+    dependency_ids: List[int] = []
 
 class ApplicationCreate(ApplicationBase):
     pass
@@ -21,9 +24,11 @@ class ApplicationUpdate(BaseModel):
     version: Optional[str] = None
     os_type: Optional[OSType] = None
     installer_url: Optional[str] = None
+    installer_sha256: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{64}$")
     description: Optional[str] = None
     install_command: Optional[str] = None
     install_parameters: Optional[str] = None
+    dependency_ids: Optional[List[int]] = None
 
 class Application(ApplicationBase):
     id: int
@@ -66,10 +71,34 @@ class Server(ServerBase):
     class Config:
         from_attributes = True
 
+class ServerProbeRequest(BaseModel):
+    server_ids: Optional[List[int]] = None  # None probes every server
+    refresh: bool = False  # Probe again instead of reusing recent results
+
+class ServerProbe(BaseModel):
+    """SSH/WinRM reachability of one server"""
+    server_id: int
+    hostname: str
+    reachable: bool
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+    checked_at: datetime
+    cached: bool = False
+
 # Deployment Schemas
 class DeploymentCreate(BaseModel):
     application_ids: List[int]
     server_ids: List[int]
+    max_parallel: Optional[int] = Field(default=None, ge=1)
+    # Automatic retries after transient SSH/WinRM connection errors
+    max_retries: Optional[int] = Field(default=None, ge=0, le=10)
+    # Rollout: all servers at once, rolling waves of batch_size servers (or batch_percent
+    # of them), or a canary wave of batch_size servers (default 1) followed by the rest
+    strategy: DeploymentStrategy = DeploymentStrategy.ALL_AT_ONCE
+    batch_size: Optional[int] = Field(default=None, ge=1)
+    batch_percent: Optional[int] = Field(default=None, ge=1, le=100)
+    # Failed servers tolerated; once exceeded, jobs that haven't started are skipped
+    max_failures: Optional[int] = Field(default=None, ge=0)
 
 class DeploymentLog(BaseModel):
     server_id: int
@@ -79,23 +108,102 @@ class DeploymentLog(BaseModel):
     output: str
     success: bool
 
-class Deployment(BaseModel):
+class DeploymentLogChunk(BaseModel):
+    sequence: int
+    server_id: Optional[int] = None
+    application_id: Optional[int] = None
+    content: str
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class DeploymentResult(BaseModel):
+    """Outcome of one application on one server"""
+    id: int
+    deployment_id: int
+    server_id: int
+    application_id: int
+    wave: int
+    depends_on: Optional[List[int]] = None
+    status: JobStatus
+    exit_code: Optional[int] = None
+    duration: Optional[float] = None
+    attempts: int
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class DeploymentOverview(BaseModel):
+    """Deployment with its targets but without logs"""
     id: int
     status: DeploymentStatus
-    logs: str
     started_at: datetime
     completed_at: Optional[datetime] = None
     error_message: Optional[str] = None
+    max_parallel: Optional[int] = None
+    max_retries: Optional[int] = None
+    retry_of_id: Optional[int] = None
+    strategy: DeploymentStrategy = DeploymentStrategy.ALL_AT_ONCE
+    batch_size: Optional[int] = None
+    batch_percent: Optional[int] = None
+    max_failures: Optional[int] = None
+    current_wave: int = 0
     applications: List[Application]
     servers: List[Server]
     
     class Config:
         from_attributes = True
 
+class Deployment(DeploymentOverview):
+    logs: str
+
+class DeploymentSummary(BaseModel):
+    """Deployment list entry without logs or nested objects"""
+    id: int
+    status: DeploymentStatus
+    started_at: datetime
+    completed_at: Optional[datetime] = None
+    error_message: Optional[str] = None
+    application_count: int
+    server_count: int
+    
+    class Config:
+        from_attributes = True
+
+class DeploymentPage(BaseModel):
+    items: List[DeploymentSummary]
+    # Pass as ?cursor= to get the next (older) page; None on the last page
+    next_cursor: Optional[str] = None
+
+# Log search
+class LogSearchHit(BaseModel):
+    """A stored log chunk matching a search, with the matches highlighted in a snippet"""
+    # For archived hits, the id of the chunk's archive index entry
+    chunk_id: int
+    deployment_id: int
+    sequence: int
+    server_id: Optional[int] = None
+    server_hostname: Optional[str] = None
+    application_id: Optional[int] = None
+    application_name: Optional[str] = None
+    created_at: datetime
+    snippet: str
+    # From a deployment whose logs were compressed by log_archive.py
+    archived: bool = False
+
+class LogSearchPage(BaseModel):
+    items: List[LogSearchHit]
+    # Pass as ?cursor= to get the next (older) page; None on the last page
+    next_cursor: Optional[str] = None
+
 # Dashboard Stats
 class DashboardStats(BaseModel):
     total_servers: int
     total_applications: int
     total_deployments: int
-    recent_deployments: List[Deployment]
+    deployments_by_status: Dict[DeploymentStatus, int] = {}
+    recent_deployments: List[DeploymentOverview]
     success_rate: float
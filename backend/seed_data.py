@@ -4,7 +4,7 @@ Run this script to populate the database with sample applications and servers
 """
 
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+from database import SessionLocal, ensure_schema
 import models
 import crud
 import schemas
@@ -12,8 +12,8 @@ import schemas
 def seed_data():
     """Seed the database with sample data"""
     
-    # Create tables if they don't exist
-    models.Base.metadata.create_all(bind=engine)
+    # Create tables if they don't exist, and columns added since
+    ensure_schema()
     
     db: Session = SessionLocal()
     
@@ -38,6 +38,7 @@ def seed_data():
                 name="Docker Engine",
                 version="24.0",
                 os_type=models.OSType.LINUX,
+                installer_url="https://get.docker.com",
                 install_command="curl -fsSL https://get.docker.com -o get-docker.sh && sudo sh get-docker.sh && sudo systemctl enable docker && sudo systemctl start docker"
             ),
             schemas.ApplicationCreate(
@@ -54,6 +55,7 @@ def seed_data():
                 name="Google Chrome",
                 version="Latest",
                 os_type=models.OSType.WINDOWS,
+                installer_url="https://dl.google.com/chrome/install/latest/chrome_installer.exe",
                 install_command="""$url = "https://dl.google.com/chrome/install/latest/chrome_installer.exe"
 $output = "$env:TEMP\\chrome_installer.exe"
 Invoke-WebRequest -Uri $url -OutFile $output
@@ -64,6 +66,7 @@ Remove-Item $output"""
                 name="Git for Windows",
                 version="2.43",
                 os_type=models.OSType.WINDOWS,
+                installer_url="https://github.com/git-for-windows/git/releases/download/v2.43.0.windows.1/Git-2.43.0-64-bit.exe",
                 install_command="""$url = "https://github.com/git-for-windows/git/releases/download/v2.43.0.windows.1/Git-2.43.0-64-bit.exe"
 $output = "$env:TEMP\\git-installer.exe"
 Invoke-WebRequest -Uri $url -OutFile $output
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import paramiko
+import models
+from credentials import credential_cache
+
+# Close pooled connections that have been idle for longer than this (seconds)
+SSH_IDLE_TIMEOUT = int(os.getenv("SSH_IDLE_TIMEOUT", "300"))
+# Maximum open SSH connections (idle + in use) across all servers
+SSH_POOL_MAX_CONNECTIONS = int(os.getenv("SSH_POOL_MAX_CONNECTIONS", "50"))
+# Interval between SSH keepalive packets on pooled transports (seconds)
+SSH_KEEPALIVE_INTERVAL = int(os.getenv("SSH_KEEPALIVE_INTERVAL", "30"))
+SSH_CONNECT_TIMEOUT = 10
+
+class SSHConnectionPool:
+    """Pool of authenticated SSH clients keyed by server id and credentials"""
+
+    def __init__(
+        self,
+        max_connections: int = SSH_POOL_MAX_CONNECTIONS,
+        idle_timeout: int = SSH_IDLE_TIMEOUT,
+        keepalive_interval: int = SSH_KEEPALIVE_INTERVAL
+    ):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        # key -> list of (client, last_used) waiting to be reused
+        self._idle: Dict[tuple, List[Tuple[paramiko.SSHClient, float]]] = {}
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def pool_key(server: models.Server) -> tuple:
+        """Key that changes whenever the address or credentials of a server change"""
+        credentials = hashlib.sha256(
+            f"{server.username}\0{server.password or ''}\0{server.ssh_key_content or ''}".encode()
+        ).hexdigest()
+        return (server.id, server.ip_address, server.port, credentials)
+
+    def _idle_count(self) -> int:
+        return sum(len(clients) for clients in self._idle.values())
+
+    def _is_healthy(self, client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _reap_idle(self) -> List[paramiko.SSHClient]:
+        """Take idle connections past the idle timeout out of the pool. Caller holds the lock and closes them."""
+        now = time.monotonic()
+        expired = []
+        for key in list(self._idle):
+            fresh = []
+            for client, last_used in self._idle[key]:
+                if now - last_used > self.idle_timeout:
+                    expired.append(client)
+                else:
+                    fresh.append((client, last_used))
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+        return expired
+
+    def _evict_oldest_idle(self) -> Optional[paramiko.SSHClient]:
+        """Take the least recently used idle connection out of the pool. Caller holds the lock and closes it."""
+        oldest = None
+        for key, clients in self._idle.items():
+            for index, (client, last_used) in enumerate(clients):
+                if oldest is None or last_used < oldest[2]:
+                    oldest = (key, index, last_used)
+        if oldest is None:
+            return None
+        key, index, _ = oldest
+        client, _ = self._idle[key].pop(index)
+        if not self._idle[key]:
+            del self._idle[key]
+        return client
+
+    @staticmethod
+    def _close(clients: List[paramiko.SSHClient]):
+        """Close connections, outside the lock: closing joins the transport thread"""
+        for client in clients:
+            client.close()
+
+    def _connect(self, server: models.Server) -> paramiko.SSHClient:
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        # Connect with SSH key or password, decrypted and parsed once per server by the credential cache
+        username, password, key = credential_cache.get(server)
+        ssh.connect(
+            hostname=server.ip_address,
+            port=server.port,
+            username=username,
+            pkey=key,
+            password=None if key else password,
+            timeout=SSH_CONNECT_TIMEOUT
+        )
+
+        transport = ssh.get_transport()
+        if transport is not None and self.keepalive_interval > 0:
+            transport.set_keepalive(self.keepalive_interval)
+        return ssh
+
+    def _reserve(self, key: tuple) -> Tuple[Optional[paramiko.SSHClient], bool, List[paramiko.SSHClient]]:
+        """
+        Take an idle connection for `key`, or room for a new one, waiting while the
+        pool is full. Returns the idle client (None for a new connection), whether a
+        slot was taken (False when stale connections must be closed before waiting)
+        and the connections to close.
+        """
+        stale = []
+        with self._condition:
+            while True:
+                stale.extend(self._reap_idle())
+                clients = self._idle.get(key)
+                if clients:
+                    client, _ = clients.pop()
+                    if not clients:
+                        del self._idle[key]
+                    self._in_use += 1
+                    return client, True, stale
+                if self._in_use + self._idle_count() < self.max_connections:
+                    self._in_use += 1
+                    return None, True, stale
+                evicted = self._evict_oldest_idle()
+                if evicted is not None:
+                    stale.append(evicted)
+                elif stale:
+                    return None, False, stale
+                else:
+                    self._condition.wait()
+
+    def _unreserve(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    def acquire(self, server: models.Server) -> Tuple[paramiko.SSHClient, bool]:
+        """
+        Check out a connection for a server.
+        Returns the client and whether it was reused from the pool.
+        The lock only guards the bookkeeping: health checks and closes, which can
+        block on a slow host, run outside it.
+        """
+        key = self.pool_key(server)
+        while True:
+            client, reserved, stale = self._reserve(key)
+            self._close(stale)
+            if not reserved:
+                continue
+            if client is None:
+                break
+            # Reuse a warm connection if one is still healthy
+            if self._is_healthy(client):
+                return client, True
+            client.close()
+            self._unreserve()
+
+        try:
+            return self._connect(server), False
+        except Exception:
+            self._unreserve()
+            raise
+
+    def release(self, server: models.Server, client: paramiko.SSHClient, healthy: bool = True):
+        """Return a connection to the pool, or close it if it is no longer usable"""
+        healthy = healthy and self._is_healthy(client)
+        with self._condition:
+            self._in_use -= 1
+            if healthy:
+                self._idle.setdefault(self.pool_key(server), []).append((client, time.monotonic()))
+            self._condition.notify()
+        if not healthy:
+            client.close()
+
+    def evict(self, server_id: int):
+        """Close all idle connections to a server (e.g. after its credentials change)"""
+        with self._condition:
+            evicted = [
+                client for key in [key for key in self._idle if key[0] == server_id]
+                for client, _ in self._idle.pop(key)
+            ]
+            self._condition.notify_all()
+        self._close(evicted)
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._condition:
+            idle = [client for clients in self._idle.values() for client, _ in clients]
+            self._idle.clear()
+            self._condition.notify_all()
+        self._close(idle)
+
+ssh_pool = SSHConnectionPool()
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+import models
+import schemas
+
+# Seconds an assembled dashboard response may be served from memory
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "2"))
+
+SERVERS = "servers"
+APPLICATIONS = "applications"
+DEPLOYMENTS = "deployments"
+
+def status_counter(status: models.DeploymentStatus) -> str:
+    return f"deployments.{status.value}"
+
+def bump(db: Session, name: str, delta: int = 1):
+    """Adjust a counter in the caller's transaction"""
+    statement = insert(models.StatCounter).values(name=name, value=delta, version=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.StatCounter.name],
+        set_={"value": models.StatCounter.value + delta, "version": models.StatCounter.version + 1}
+    ))
+
+def record_transition(
+    db: Session,
+    old_status: Optional[models.DeploymentStatus],
+    new_status: models.DeploymentStatus
+):
+    """Move a deployment between status counters (old_status None for a new deployment)"""
+    if old_status == new_status:
+        return
+    if old_status is None:
+        bump(db, DEPLOYMENTS)
+    else:
+        bump(db, status_counter(old_status), -1)
+    bump(db, status_counter(new_status))
+
+def ensure_counters(db: Session):
+    """Backfill counters from the tables the first time they are needed"""
+    if db.query(models.StatCounter).first() is not None:
+        return
+    counts = {
+        SERVERS: db.query(func.count(models.Server.id)).scalar(),
+        APPLICATIONS: db.query(func.count(models.Application.id)).scalar(),
+        DEPLOYMENTS: db.query(func.count(models.Deployment.id)).scalar(),
+    }
+    for status in models.DeploymentStatus:
+        counts[status_counter(status)] = 0
+    for status, count in db.query(models.Deployment.status, func.count(models.Deployment.id)).group_by(models.Deployment.status):
+        counts[status_counter(status)] = count
+    db.add_all(models.StatCounter(name=name, value=value) for name, value in counts.items())
+    db.commit()
+
+class DashboardCache:
+    """
+    Last assembled dashboard response, valid for a short TTL while the counters'
+    version is unchanged (queue workers move deployments between statuses in other
+    processes) and until invalidated in this process
+    """
+
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._value: Optional[schemas.DashboardStats] = None
+        self._version: Optional[int] = None
+        self._expires_at = 0.0
+        # Bumped on invalidation so a response assembled before it is not cached
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, version: int) -> Optional[schemas.DashboardStats]:
+        with self._lock:
+            if self._value is not None and self._version == version and time.monotonic() < self._expires_at:
+                return self._value
+            return None
+
+    def set(self, value: schemas.DashboardStats, generation: int, version: int):
+        with self._lock:
+            if generation == self.generation:
+                self._value = value
+                self._version = version
+                self._expires_at = time.monotonic() + self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self.generation += 1
+
+dashboard_cache = DashboardCache()
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import threading
+import time
+from base64 import b64encode
+from typing import Dict, Iterable, List, Optional, Tuple
+import winrm
+from winrm.exceptions import WinRMError, WinRMTransportError
+import models
+from credentials import credential_cache
+
+# Close cached shells that have been idle for longer than this (seconds)
+WINRM_IDLE_TIMEOUT = int(os.getenv("WINRM_IDLE_TIMEOUT", "300"))
+# WinRM authentication transport (ntlm, kerberos, credssp, ssl, plaintext)
+WINRM_TRANSPORT = os.getenv("WINRM_TRANSPORT", "ntlm")
+# Default WinRM ports: 5985 (HTTP), 5986 (HTTPS)
+WINRM_DEFAULT_PORT = 5985
+
+class CachedShell:
+    """An authenticated WinRM session with one remote shell kept open"""
+
+    def __init__(self, session: winrm.Session, shell_id: str):
+        self.session = session
+        self.shell_id = shell_id
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def close(self):
+        """Delete the remote shell and drop the HTTP session"""
+        try:
+            self.session.protocol.close_shell(self.shell_id)
+        except Exception:
+            # The shell may already be gone (server restart, idle timeout)
+            self.session.protocol.transport.close_session()
+
+class WinRMSessionCache:
+    """Cache of WinRM sessions and open shells keyed by server id and credentials"""
+
+    def __init__(self, idle_timeout: int = WINRM_IDLE_TIMEOUT, transport: str = WINRM_TRANSPORT):
+        self.idle_timeout = idle_timeout
+        self.transport = transport
+        self._shells: Dict[tuple, CachedShell] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(server: models.Server) -> tuple:
+        """Key that changes whenever the address or credentials of a server change"""
+        credentials = hashlib.sha256(
+            f"{server.username}\0{server.password or ''}".encode()
+        ).hexdigest()
+        return (server.id, server.ip_address, server.port, credentials)
+
+    @staticmethod
+    def endpoint(server: models.Server) -> str:
+        port = server.port if server.port != 22 else WINRM_DEFAULT_PORT
+        return f'http://{server.ip_address}:{port}/wsman'
+
+    def _open(self, server: models.Server) -> CachedShell:
+        username, password, _ = credential_cache.get(server)
+        session = winrm.Session(
+            self.endpoint(server),
+            auth=(username, password),
+            transport=self.transport
+        )
+        # Let the server reap the shell too if we never get to close it
+        shell_id = session.protocol.open_shell(idle_timeout=f"PT{self.idle_timeout}S")
+        return CachedShell(session, shell_id)
+
+    def _reap_idle(self):
+        """Close shells idle past the timeout that nobody is using"""
+        now = time.monotonic()
+        expired: List[CachedShell] = []
+        with self._lock:
+            for key, shell in list(self._shells.items()):
+                if now - shell.last_used > self.idle_timeout and not shell.lock.locked():
+                    expired.append(self._shells.pop(key))
+        for shell in expired:
+            shell.close()
+
+    def _checkout(self, server: models.Server) -> Tuple[CachedShell, bool]:
+        """Get the shell for a server, holding its lock. Returns the shell and whether it was reused."""
+        self._reap_idle()
+        key = self.cache_key(server)
+        with self._lock:
+            shell = self._shells.get(key)
+        if shell is not None:
+            shell.lock.acquire()
+            with self._lock:
+                if self._shells.get(key) is shell:
+                    return shell, True
+            # Evicted while we were waiting for it
+            shell.lock.release()
+
+        shell = self._open(server)
+        shell.lock.acquire()
+        with self._lock:
+            previous = self._shells.get(key)
+            self._shells[key] = shell
+        if previous is not None and previous is not shell:
+            with previous.lock:
+                previous.close()
+        return shell, False
+
+    def _release_broken(self, server: models.Server, shell: CachedShell):
+        """Release and close a shell that failed mid-use"""
+        with self._lock:
+            key = self.cache_key(server)
+            if self._shells.get(key) is shell:
+                del self._shells[key]
+        shell.close()
+        shell.lock.release()
+
+    def run_ps(
+        self,
+        server: models.Server,
+        script: str,
+        stdin_chunks: Optional[Iterable[bytes]] = None
+    ) -> Tuple[winrm.Response, bool]:
+        """
+        Run a PowerShell script inside the cached shell for a server, optionally
+        streaming stdin_chunks to its standard input.
+        Returns the response and whether an existing shell was reused.
+        """
+        # must use utf16 little endian on windows
+        encoded_ps = b64encode(script.encode('utf_16_le')).decode('ascii')
+        command = f'powershell -encodedcommand {encoded_ps}'
+
+        shell, reused = self._checkout(server)
+        try:
+            command_id = shell.session.protocol.run_command(shell.shell_id, command)
+        except (WinRMError, WinRMTransportError):
+            self._release_broken(server, shell)
+            if not reused:
+                raise
+            # The warm shell went away on the server side; the command never started
+            shell, reused = self._checkout(server)
+            try:
+                command_id = shell.session.protocol.run_command(shell.shell_id, command)
+            except Exception:
+                self._release_broken(server, shell)
+                raise
+        except Exception:
+            self._release_broken(server, shell)
+            raise
+
+        try:
+            protocol = shell.session.protocol
+            if stdin_chunks is not None:
+                for chunk in stdin_chunks:
+                    protocol.send_command_input(shell.shell_id, command_id, chunk)
+                protocol.send_command_input(shell.shell_id, command_id, b"", end=True)
+            result = winrm.Response(protocol.get_command_output(shell.shell_id, command_id))
+            protocol.cleanup_command(shell.shell_id, command_id)
+        except Exception:
+            self._release_broken(server, shell)
+            raise
+
+        shell.last_used = time.monotonic()
+        shell.lock.release()
+
+        if len(result.std_err):
+            # Convert PowerShell CLIXML errors to readable text
+            result.std_err = shell.session._clean_error_msg(result.std_err)
+        return result, reused
+
+    def evict(self, server_id: int):
+        """Close the cached shell of a server (e.g. after its credentials change)"""
+        with self._lock:
+            shells = [self._shells.pop(key) for key in list(self._shells) if key[0] == server_id]
+        for shell in shells:
+            with shell.lock:
+                shell.close()
+
+    def close_all(self):
+        """Close every cached shell"""
+        with self._lock:
+            shells = list(self._shells.values())
+            self._shells.clear()
+        for shell in shells:
+            with shell.lock:
+                shell.close()
+
+winrm_cache = WinRMSessionCache()
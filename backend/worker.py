@@ -0,0 +1,297 @@
+"""
+DeployMaster Deployment Worker
+Claims queued server x application jobs from the database and runs them.
+Start one or more workers next to the API when DEPLOYMENT_EXECUTION=queue;
+a worker that dies mid-deployment loses its lease and its lanes are picked
+up again by another worker.
+
+Usage (from backend/):
+    python worker.py --concurrency 10
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Optional
+
+import crud
+import job_queue
+import log_search
+import models
+import stats
+from batch import DEPLOYMENT_BATCH_SCRIPTS
+from database import ensure_schema, SessionLocal
+from deployment import DeploymentExecutor, ExecutionResult
+from log_writer import log_writer
+from scheduler import SERVER_JOB_PARALLELISM, prerequisite_failed_message
+from ssh_pool import ssh_pool
+from winrm_pool import winrm_cache
+
+# Seconds an idle worker waits before looking for queued jobs again
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+# Server lanes one worker process runs at the same time
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "10"))
+
+logger = logging.getLogger("worker")
+
+class DeploymentWorker:
+    """Runs claimed server lanes in a thread pool and heartbeats their leases"""
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, poll_interval: float = WORKER_POLL_INTERVAL):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._slots = threading.Semaphore(concurrency)
+        self._stopping = threading.Event()
+
+    def stop(self, *args):
+        if not self._stopping.is_set():
+            logger.info("🛑 Stopping: finishing running lanes, not claiming new ones")
+        self._stopping.set()
+
+    def run(self):
+        logger.info(f"👷 Worker {self.worker_id} started ({self.concurrency} lanes)")
+        heartbeat = threading.Thread(target=self._heartbeat, name="heartbeat", daemon=True)
+        heartbeat.start()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="lane") as pool:
+            db = SessionLocal()
+            try:
+                while not self._stopping.is_set():
+                    if not self._slots.acquire(timeout=self.poll_interval):
+                        continue
+                    lane = None
+                    try:
+                        lane = job_queue.claim_lane(db, self.worker_id)
+                    except Exception:
+                        logger.exception("Failed to claim a lane")
+                        db.rollback()
+                    if lane is None:
+                        self._slots.release()
+                        self._stopping.wait(self.poll_interval)
+                        continue
+                    pool.submit(self._run_lane, *lane)
+            finally:
+                db.close()
+
+        log_writer.stop()
+        ssh_pool.close_all()
+        winrm_cache.close_all()
+        logger.info(f"👋 Worker {self.worker_id} stopped")
+
+    def _heartbeat(self):
+        """Extend the leases of held lanes well before they expire"""
+        while True:
+            time.sleep(job_queue.JOB_LEASE_SECONDS / 3)
+            db = SessionLocal()
+            try:
+                job_queue.renew_leases(db, self.worker_id)
+            except Exception:
+                logger.exception("Failed to renew leases")
+            finally:
+                db.close()
+
+    def _run_lane(self, deployment_id: int, server_id: int):
+        """Run the jobs of one server, then finalize the deployment if it is done"""
+        db = SessionLocal()
+        try:
+            jobs = job_queue.get_lane_jobs(db, self.worker_id, deployment_id, server_id)
+            finished = job_queue.get_lane_outcomes(db, deployment_id, server_id)
+            servers, applications, _, max_retries = crud.get_detached_deployment_targets(db, deployment_id)
+            server = next((server for server in servers if server.id == server_id), None)
+            applications = {application.id: application for application in applications}
+            if DEPLOYMENT_BATCH_SCRIPTS and server is not None:
+                self._run_batch(db, deployment_id, server, jobs, finished, applications, max_retries)
+            else:
+                self._run_jobs(db, deployment_id, server, jobs, finished, applications, max_retries)
+
+            # Persist the lane's output before the deployment can be marked finished
+            # or its next rollout wave starts
+            log_writer.flush()
+            job_queue.finalize_deployment(db, deployment_id)
+        except Exception:
+            logger.exception(f"Lane {deployment_id}/{server_id} failed")
+            db.rollback()
+            job_queue.release_lane(db, self.worker_id, deployment_id, server_id)
+        finally:
+            db.close()
+            self._slots.release()
+
+    def _run_jobs(
+        self,
+        db,
+        deployment_id: int,
+        server: Optional[models.Server],
+        jobs: list,
+        finished: Dict[int, bool],
+        applications: dict,
+        max_retries: Optional[int]
+    ):
+        """
+        Run a lane's jobs one remote command each. A job starts once the jobs it
+        depends on have succeeded, up to SERVER_JOB_PARALLELISM at a time; it is
+        skipped if one of them failed or was skipped. `finished` holds the outcomes
+        of the lane's jobs that finished before it was claimed.
+        """
+        # Prerequisites outside the lane are not part of the deployment (already installed)
+        lane_application_ids = {job.application_id for job in jobs} | set(finished)
+
+        # Application id -> whether it succeeded, for the jobs that have finished
+        succeeded = dict(finished)
+        running = {}
+        pending = list(jobs)  # In position (dependency) order
+        with ThreadPoolExecutor(max_workers=SERVER_JOB_PARALLELISM, thread_name_prefix="job") as jobs_pool:
+            while pending or running:
+                for job in list(pending):
+                    prerequisites = [
+                        application_id for application_id in job.depends_on or []
+                        if application_id in lane_application_ids
+                    ]
+                    failed_prerequisite = next(
+                        (application_id for application_id in prerequisites if succeeded.get(application_id) is False),
+                        None
+                    )
+                    if failed_prerequisite is not None:
+                        pending.remove(job)
+                        succeeded[job.application_id] = False
+                        self._skip_job(db, deployment_id, server, job, applications, failed_prerequisite)
+                    elif len(running) < SERVER_JOB_PARALLELISM and all(
+                        succeeded.get(application_id) for application_id in prerequisites
+                    ):
+                        pending.remove(job)
+                        if not job_queue.start_job(db, job.id, self.worker_id):
+                            # Lease lost to another worker, or skipped after too many failures
+                            pending.clear()
+                            break
+                        future = jobs_pool.submit(
+                            self._run_job, deployment_id, server, applications.get(job.application_id), max_retries
+                        )
+                        running[future] = job
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    result = future.result()
+                    succeeded[job.application_id] = result.success
+                    job_queue.finish_job(
+                        db, job.id, self.worker_id, result.status, result.output,
+                        exit_code=result.exit_code, duration=result.duration, retries=result.attempts - 1
+                    )
+                    if result.status == models.JobStatus.FAILED:
+                        job_queue.check_failure_threshold(db, deployment_id)
+
+    def _run_batch(
+        self,
+        db,
+        deployment_id: int,
+        server: models.Server,
+        jobs: list,
+        finished: Dict[int, bool],
+        applications: dict,
+        max_retries: Optional[int]
+    ):
+        """Run the lane's jobs as one remote script (DEPLOYMENT_BATCH_SCRIPTS)"""
+        # Skip the jobs whose prerequisites failed before the lane was claimed
+        finished = dict(finished)
+        remaining = []
+        for job in jobs:  # In position (dependency) order
+            failed_prerequisite = next(
+                (application_id for application_id in job.depends_on or [] if finished.get(application_id) is False),
+                None
+            )
+            if failed_prerequisite is None:
+                remaining.append(job)
+            else:
+                finished[job.application_id] = False
+                self._skip_job(db, deployment_id, server, job, applications, failed_prerequisite)
+        jobs = remaining
+        jobs_by_application = {job.application_id: job for job in jobs}
+        for job in jobs:
+            if job.application_id not in applications and job_queue.start_job(db, job.id, self.worker_id):
+                job_queue.finish_job(
+                    db, job.id, self.worker_id, models.JobStatus.FAILED,
+                    "Server or application no longer part of the deployment"
+                )
+        lane = [applications[job.application_id] for job in jobs if job.application_id in applications]
+
+        def log_for(application_id: Optional[int]):
+            return lambda message: log_writer.write(deployment_id, message, server.id, application_id)
+
+        def on_start(application_id: int) -> bool:
+            return job_queue.start_job(db, jobs_by_application[application_id].id, self.worker_id)
+
+        def on_finish(application_id: int, result: ExecutionResult):
+            job_queue.finish_job(
+                db, jobs_by_application[application_id].id, self.worker_id, result.status, result.output,
+                exit_code=result.exit_code, duration=result.duration, retries=result.attempts - 1
+            )
+            if result.status == models.JobStatus.FAILED:
+                job_queue.check_failure_threshold(db, deployment_id)
+
+        def on_skip(application_id: int, reason: str):
+            if job_queue.finish_job(db, jobs_by_application[application_id].id, self.worker_id, models.JobStatus.SKIPPED, reason):
+                log_writer.write(deployment_id, f"⏭️  {reason}\n", server.id, application_id)
+
+        DeploymentExecutor.execute_batch(
+            server, lane, {job.application_id: job.depends_on or [] for job in jobs},
+            log_for, on_start, on_finish, on_skip, max_retries
+        )
+
+    def _skip_job(
+        self,
+        db,
+        deployment_id: int,
+        server: models.Server,
+        job: models.DeploymentJob,
+        applications: dict,
+        prerequisite_id: int
+    ):
+        application, prerequisite = applications.get(job.application_id), applications.get(prerequisite_id)
+        if server is None or application is None or prerequisite is None:
+            reason = "Skipped: a prerequisite did not succeed"
+        else:
+            reason = prerequisite_failed_message(server, application, prerequisite.name)
+        if job_queue.finish_job(db, job.id, self.worker_id, models.JobStatus.SKIPPED, reason):
+            log_writer.write(deployment_id, f"⏭️  {reason}\n", job.server_id, job.application_id)
+
+    def _run_job(
+        self,
+        deployment_id: int,
+        server: models.Server,
+        application: models.Application,
+        max_retries: Optional[int]
+    ) -> ExecutionResult:
+        if server is None or application is None:
+            return ExecutionResult(models.JobStatus.FAILED, "Server or application no longer part of the deployment")
+
+        def log_callback(message: str):
+            log_writer.write(deployment_id, message, server.id, application.id)
+
+        return DeploymentExecutor.execute_deployment(server, application, log_callback, max_retries)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Server lanes run at once")
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL, help="Idle poll interval (seconds)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    ensure_schema()
+    with SessionLocal() as db:
+        stats.ensure_counters(db)
+        log_search.ensure_index(db)
+
+    worker = DeploymentWorker(args.concurrency, args.poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+if __name__ == "__main__":
+    main()
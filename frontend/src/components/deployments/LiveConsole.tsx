@@ -1,6 +1,7 @@
 import { useEffect, useRef, useState } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Terminal } from 'lucide-react';
+import type { LogFrame } from '@/types';
 
 interface LiveConsoleProps {
   deploymentId: number;
@@ -26,7 +27,11 @@ export function LiveConsole({ deploymentId }: LiveConsoleProps) {
     };
 
     ws.onmessage = (event) => {
-      setLogs((prev) => prev + event.data);
+      // Each frame carries a batch of lines, so one state update per frame
+      const frame: LogFrame = JSON.parse(event.data);
+      const text =
+        frame.type === 'logs' ? frame.lines.map((line) => line.text).join('') : frame.text;
+      setLogs((prev) => prev + text);
     };
 
     ws.onerror = (error) => {
@@ -4,8 +4,16 @@ import type {
   ApplicationCreate,
   Server,
   ServerCreate,
+  ServerProbe,
   Deployment,
   DeploymentCreate,
+  DeploymentLogChunk,
+  DeploymentLogParams,
+  DeploymentPage,
+  DeploymentResult,
+  JobStatus,
+  LogSearchPage,
+  LogSearchParams,
   DashboardStats,
 } from '@/types';
 
@@ -30,12 +38,27 @@ export const getServer = (id: number) => api.get<Server>(`/servers/${id}`);
 export const createServer = (data: ServerCreate) => api.post<Server>('/servers', data);
 export const updateServer = (id: number, data: Partial<ServerCreate>) => 
   api.put<Server>(`/servers/${id}`, data);
+export const probeServers = (serverIds?: number[], refresh = false) =>
+  api.post<ServerProbe[]>('/servers/probe', { server_ids: serverIds, refresh });
 export const deleteServer = (id: number) => api.delete(`/servers/${id}`);
 
 // Deployments
-export const getDeployments = () => api.get<Deployment[]>('/deployments');
+export const getDeployments = (cursor?: string, limit = 50) =>
+  api.get<DeploymentPage>('/deployments', { params: { cursor, limit } });
 export const getDeployment = (id: number) => api.get<Deployment>(`/deployments/${id}`);
+export const getDeploymentLogChunks = (id: number, afterSequence = -1, limit = 1000) =>
+  api.get<DeploymentLogChunk[]>(`/deployments/${id}/log-chunks`, {
+    params: { after_sequence: afterSequence, limit },
+  });
+export const getDeploymentLogs = (id: number, params: DeploymentLogParams = {}) =>
+  api.get<string>(`/deployments/${id}/logs`, { params, responseType: 'text' });
 export const createDeployment = (data: DeploymentCreate) => api.post<Deployment>('/deployments', data);
+export const getDeploymentResults = (id: number, status?: JobStatus) =>
+  api.get<DeploymentResult[]>(`/deployments/${id}/results`, { params: { status } });
+export const retryDeployment = (id: number) => api.post<Deployment>(`/deployments/${id}/retry`);
+
+// Log search
+export const searchLogs = (params: LogSearchParams) => api.get<LogSearchPage>('/logs/search', { params });
 
 // Dashboard
 export const getDashboardStats = () => api.get<DashboardStats>('/dashboard');
@@ -2,15 +2,21 @@ export type OSType = 'linux' | 'windows';
 
 export type DeploymentStatus = 'pending' | 'running' | 'success' | 'failed';
 
+export type DeploymentStrategy = 'all_at_once' | 'rolling' | 'canary';
+
+export type JobStatus = 'queued' | 'running' | 'success' | 'failed' | 'skipped';
+
 export interface Application {
   id: number;
   name: string;
   version: string;
   os_type: OSType;
   installer_url?: string;
+  installer_sha256?: string;
   description?: string;
   install_command: string;
   install_parameters?: string;
+  dependency_ids: number[];
   created_at: string;
   updated_at: string;
 }
@@ -26,22 +32,136 @@ export interface Server {
   updated_at: string;
 }
 
-export interface Deployment {
+export interface ServerProbe {
+  server_id: number;
+  hostname: string;
+  reachable: boolean;
+  latency_ms?: number;
+  error?: string;
+  checked_at: string;
+  cached: boolean;
+}
+
+export interface DeploymentOverview {
   id: number;
   status: DeploymentStatus;
-  logs: string;
   started_at: string;
   completed_at?: string;
   error_message?: string;
+  max_parallel?: number;
+  max_retries?: number;
+  retry_of_id?: number;
+  strategy: DeploymentStrategy;
+  batch_size?: number;
+  batch_percent?: number;
+  max_failures?: number;
+  current_wave: number;
   applications: Application[];
   servers: Server[];
 }
 
+export interface Deployment extends DeploymentOverview {
+  logs: string;
+}
+
+export interface DeploymentResult {
+  id: number;
+  deployment_id: number;
+  server_id: number;
+  application_id: number;
+  wave: number;
+  depends_on?: number[];
+  status: JobStatus;
+  exit_code?: number;
+  duration?: number;
+  attempts: number;
+  started_at?: string;
+  finished_at?: string;
+}
+
+export interface DeploymentSummary {
+  id: number;
+  status: DeploymentStatus;
+  started_at: string;
+  completed_at?: string;
+  error_message?: string;
+  application_count: number;
+  server_count: number;
+}
+
+export interface DeploymentPage {
+  items: DeploymentSummary[];
+  next_cursor?: string;
+}
+
+export interface DeploymentLogChunk {
+  sequence: number;
+  server_id?: number;
+  application_id?: number;
+  content: string;
+  created_at: string;
+}
+
+export interface LogSearchHit {
+  chunk_id: number;
+  deployment_id: number;
+  sequence: number;
+  server_id?: number;
+  server_hostname?: string;
+  application_id?: number;
+  application_name?: string;
+  created_at: string;
+  // Raw log text with the matches wrapped in <mark></mark>; escape everything else before rendering
+  snippet: string;
+  // From a deployment whose logs have been compressed into an archive
+  archived: boolean;
+}
+
+export interface LogSearchPage {
+  items: LogSearchHit[];
+  next_cursor?: string;
+}
+
+export interface DeploymentLogParams {
+  format?: 'text' | 'ndjson';
+  // Byte offset into the plain-text log (format=text only)
+  offset?: number;
+  // Last N lines (text) or records (ndjson)
+  tail?: number;
+  server_id?: number;
+  application_id?: number;
+}
+
+export interface LogSearchParams {
+  q: string;
+  // 'phrase' matches the text literally, 'fts' accepts FTS5 syntax (AND/OR/NOT, "phrases", prefix*)
+  syntax?: 'phrase' | 'fts';
+  deployment_id?: number;
+  server_id?: number;
+  application_id?: number;
+  since?: string;
+  until?: string;
+  limit?: number;
+  cursor?: string;
+}
+
+export interface LogFrameLine {
+  server_id?: number;
+  application_id?: number;
+  text: string;
+}
+
+// Frames sent over /ws/deployments/{id}
+export type LogFrame =
+  | { type: 'logs'; offset: number; lines: LogFrameLine[] }
+  | { type: 'notice'; text: string };
+
 export interface DashboardStats {
   total_servers: number;
   total_applications: number;
   total_deployments: number;
-  recent_deployments: Deployment[];
+  deployments_by_status: Record<DeploymentStatus, number>;
+  recent_deployments: DeploymentOverview[];
   success_rate: number;
 }
 
@@ -50,9 +170,11 @@ export interface ApplicationCreate {
   version: string;
   os_type: OSType;
   installer_url?: string;
+  installer_sha256?: string;
   description?: string;
   install_command: string;
   install_parameters?: string;
+  dependency_ids?: number[];
 }
 
 export interface ServerCreate {
@@ -68,4 +190,10 @@ export interface ServerCreate {
 export interface DeploymentCreate {
   application_ids: number[];
   server_ids: number[];
+  max_parallel?: number;
+  max_retries?: number;
+  strategy?: DeploymentStrategy;
+  batch_size?: number;
+  batch_percent?: number;
+  max_failures?: number;
 }